@@ -0,0 +1,318 @@
+# =========================
+# File: app/bar_store.py
+# 說明：本地歷史日線欄式儲存：每個 (市場, 代號) 一個欄位檔（日期序數 + 數值欄位），
+#      讀取後常駐記憶體（LRU），區間查詢以二分搜尋切片，不建立逐列 dict
+# =========================
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import json
+import logging
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, Optional, Set, Tuple
+
+from app.config import env_int
+
+log = logging.getLogger(__name__)
+
+# 未設定路徑時停用本地儲存
+BAR_STORE_PATH: str = os.getenv("BAR_STORE_PATH", "").strip()
+BAR_STORE_MAX_SERIES: int = env_int("BAR_STORE_MAX_SERIES", 512)
+
+FIELDS: Tuple[str, ...] = (
+    "open",
+    "high",
+    "low",
+    "close",
+    "change",
+    "volume",
+    "turnover",
+    "transactions",
+)
+Key = Tuple[str, str]
+
+_MAGIC = b"TWB1"
+_HEADER = struct.Struct("<4sI")
+NAN = float("nan")
+
+
+class BarSeries:
+    """
+    單一代號的日線欄式序列；days 為 date.toordinal()，其餘為 array('d')（缺值 NaN）。
+    stale_since：上游故障時回傳的過期快取之原始抓取時間（不落地）。
+    """
+
+    __slots__ = ("market", "symbol", "days", "stale_since") + FIELDS
+
+    def __init__(
+        self, market: str, symbol: str, days: Optional[array] = None, **cols: array
+    ):
+        self.market = market
+        self.symbol = symbol
+        self.days = days if days is not None else array("q")
+        self.stale_since: Optional[dt.datetime] = None
+        for f in FIELDS:
+            setattr(self, f, cols.get(f) if cols.get(f) is not None else array("d"))
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def slice(self, lo: int, hi: int) -> "BarSeries":
+        return BarSeries(
+            self.market,
+            self.symbol,
+            self.days[lo:hi],
+            **{f: getattr(self, f)[lo:hi] for f in FIELDS},
+        )
+
+    def range(self, start: dt.date, end: dt.date) -> "BarSeries":
+        lo = bisect_left(self.days, start.toordinal())
+        hi = bisect_right(self.days, end.toordinal())
+        return self.slice(lo, hi)
+
+    def marked_stale(self, since: dt.datetime) -> "BarSeries":
+        """共用欄位的淺複本，標記為過期資料。"""
+        s = BarSeries(
+            self.market, self.symbol, self.days, **{f: getattr(self, f) for f in FIELDS}
+        )
+        s.stale_since = since
+        return s
+
+    def index_on_or_before(self, day: dt.date) -> int:
+        """日期 <= day 的最後一筆位置；沒有則回 -1。"""
+        return bisect_right(self.days, day.toordinal()) - 1
+
+    def index_of(self, day: dt.date) -> int:
+        """該日所在位置；不存在回 -1。"""
+        o = day.toordinal()
+        i = bisect_left(self.days, o)
+        return i if i < len(self.days) and self.days[i] == o else -1
+
+    def record(self, i: int) -> Dict[str, Optional[float]]:
+        out: Dict[str, Optional[float]] = {}
+        for f in FIELDS:
+            v = getattr(self, f)[i]
+            out[f] = None if v != v else v
+        return out
+
+    @classmethod
+    def from_records(
+        cls, market: str, symbol: str, records: Dict[int, Dict[str, Optional[float]]]
+    ) -> "BarSeries":
+        """{日期序數: record} → 依日期排序的欄式序列。"""
+        days = array("q", sorted(records))
+        cols = {
+            f: array(
+                "d",
+                (
+                    NAN if records[o].get(f) is None else float(records[o][f])
+                    for o in days
+                ),
+            )
+            for f in FIELDS
+        }
+        return cls(market.upper(), symbol, days, **cols)
+
+    @classmethod
+    def concat(
+        cls, market: str, symbol: str, parts: Iterable["BarSeries"]
+    ) -> "BarSeries":
+        """依序串接日期不重疊、已排序的片段（例如逐月資料）。"""
+        parts = sorted((p for p in parts if len(p)), key=lambda p: p.days[0])
+        out = cls(market.upper(), symbol)
+        for p in parts:
+            out.days.extend(p.days)
+            for f in FIELDS:
+                getattr(out, f).extend(getattr(p, f))
+        return out
+
+    def to_bytes(self) -> bytes:
+        parts = [_HEADER.pack(_MAGIC, len(self.days)), self.days.tobytes()]
+        parts.extend(getattr(self, f).tobytes() for f in FIELDS)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, market: str, symbol: str, buf: bytes) -> "BarSeries":
+        magic, n = _HEADER.unpack_from(buf, 0)
+        if magic != _MAGIC:
+            raise ValueError("bad bar file")
+        view = memoryview(buf)[_HEADER.size :]
+        days = array("q")
+        days.frombytes(view[: n * 8])
+        cols = {}
+        for k, f in enumerate(FIELDS, 1):
+            col = array("d")
+            col.frombytes(view[n * 8 * k : n * 8 * (k + 1)])
+            cols[f] = col
+        return cls(market, symbol, days, **cols)
+
+
+class BarStore:
+    """
+    (市場, 代號) → BarSeries；另記錄「已完整」的月份（{代號}.months），只有月份結束後寫入的整月資料才算完整。
+    寫入先更新記憶體，檔案改寫交給背景執行緒，同一序列連續寫入只落地最後一版。
+    """
+
+    def __init__(self, root: str, max_series: int = BAR_STORE_MAX_SERIES):
+        self.root = Path(root)
+        self.max_series = max(1, max_series)
+        self._series: "OrderedDict[Key, BarSeries]" = OrderedDict()
+        self._complete: Dict[Key, Set[Tuple[int, int]]] = {}
+        # 尚未落地的最新版本：(序列, 完整月份)
+        self._dirty: Dict[Key, Tuple[BarSeries, FrozenSet[Tuple[int, int]]]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _path(self, market: str, symbol: str) -> Path:
+        return self.root / market.upper() / f"{symbol}.bars"
+
+    def series(self, market: str, symbol: str) -> BarSeries:
+        """整段序列（記憶體 LRU；未命中時從欄位檔載入）。"""
+        key = (market.upper(), symbol)
+        s = self._series.get(key)
+        if s is not None:
+            self._series.move_to_end(key)
+            return s
+        pending = self._dirty.get(key)
+        if pending is not None:
+            s = pending[0]
+        else:
+            try:
+                s = BarSeries.from_bytes(key[0], symbol, self._path(*key).read_bytes())
+            except (OSError, ValueError, struct.error):
+                s = BarSeries(key[0], symbol)
+        self._remember(key, s)
+        return s
+
+    def _remember(self, key: Key, s: BarSeries) -> None:
+        self._series[key] = s
+        self._series.move_to_end(key)
+        while len(self._series) > self.max_series:
+            self._series.popitem(last=False)
+
+    def _months(self, key: Key) -> Set[Tuple[int, int]]:
+        months = self._complete.get(key)
+        if months is None:
+            try:
+                raw = json.loads(
+                    self._path(*key).with_suffix(".months").read_text(encoding="utf-8")
+                )
+                months = {(int(ym[:4]), int(ym[5:7])) for ym in raw}
+            except (OSError, ValueError, TypeError):
+                months = set()
+            self._complete[key] = months
+        return months
+
+    def read_range(
+        self, market: str, symbol: str, start: dt.date, end: dt.date
+    ) -> BarSeries:
+        return self.series(market, symbol).range(start, end)
+
+    def get(
+        self, market: str, symbol: str, day: dt.date
+    ) -> Optional[Dict[str, Optional[float]]]:
+        s = self.series(market, symbol)
+        i = s.index_of(day)
+        return s.record(i) if i >= 0 else None
+
+    def month_complete(self, market: str, symbol: str, year: int, month: int) -> bool:
+        return (year, month) in self._months((market.upper(), symbol))
+
+    def put_series(
+        self, series: BarSeries, complete: Iterable[Tuple[int, int]] = ()
+    ) -> int:
+        """
+        合併一段已排序的序列（同日以新資料為準）；complete 為此次寫入後可視為完整的 (年, 月)。
+        只重組與新資料重疊的區段，不展開整段歷史。回傳新增/更新筆數。
+        """
+        key = (series.market.upper(), series.symbol)
+        if not len(series):
+            return 0
+        old = self.series(*key)
+        lo = bisect_left(old.days, series.days[0])
+        hi = bisect_right(old.days, series.days[-1])
+        mid = series
+        incoming = set(series.days)
+        if any(o not in incoming for o in old.days[lo:hi]):
+            # 新資料中間有缺日：重疊區段逐日合併
+            records = {o: old.record(i) for i, o in enumerate(old.days[lo:hi], lo)}
+            records.update((o, series.record(i)) for i, o in enumerate(series.days))
+            mid = BarSeries.from_records(key[0], key[1], records)
+        merged = BarSeries.concat(
+            key[0], key[1], (old.slice(0, lo), mid, old.slice(hi, len(old)))
+        )
+        self._remember(key, merged)
+        months = self._months(key)
+        months.update(complete)
+        self._schedule_write(key, merged, frozenset(months))
+        return len(series)
+
+    def put(
+        self,
+        market: str,
+        symbol: str,
+        bars: Iterable[Tuple[dt.date, Dict[str, Optional[float]]]],
+        complete: Iterable[Tuple[int, int]] = (),
+    ) -> int:
+        records = {day.toordinal(): rec for day, rec in bars}
+        return self.put_series(
+            BarSeries.from_records(market, symbol, records), complete
+        )
+
+    # ---- 落地 ----
+
+    def _schedule_write(
+        self, key: Key, s: BarSeries, months: FrozenSet[Tuple[int, int]]
+    ) -> None:
+        self._dirty[key] = (s, months)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # 沒有 event loop（同步工具/測試）：直接寫
+            self._write_batch(self._dirty)
+            self._dirty.clear()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+
+    def _write_batch(
+        self, batch: Dict[Key, Tuple[BarSeries, FrozenSet[Tuple[int, int]]]]
+    ) -> None:
+        for (market, symbol), (s, months) in batch.items():
+            path = self._path(market, symbol)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                _atomic_write(path, s.to_bytes())
+                body = json.dumps(sorted(f"{y:04d}-{m:02d}" for y, m in months))
+                _atomic_write(path.with_suffix(".months"), body.encode("utf-8"))
+            except OSError:
+                log.warning("writing bar store %s failed", path, exc_info=True)
+
+    async def _flush(self) -> None:
+        while self._dirty:
+            batch = dict(self._dirty)
+            await asyncio.to_thread(self._write_batch, batch)
+            for key, item in batch.items():
+                if self._dirty.get(key) is item:
+                    del self._dirty[key]
+
+    async def flush(self) -> None:
+        """等待尚未落地的寫入完成（關閉前呼叫）。"""
+        while self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        if self._dirty:
+            await self._flush()
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+BAR_STORE: Optional[BarStore] = BarStore(BAR_STORE_PATH) if BAR_STORE_PATH else None
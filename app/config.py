@@ -16,3 +16,21 @@ def load_settings() -> Settings:
     if not token:
         raise RuntimeError("請先在 .env 設定 DISCORD_TOKEN")
     return Settings(discord_token=token)
+
+
+def env_int(name: str, default: int) -> int:
+    """讀取整數環境變數；不合法時回預設"""
+    try:
+        v = int(os.getenv(name, "").strip() or default)
+        return v if v >= 0 else default
+    except Exception:
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """讀取浮點數環境變數；不合法時回預設"""
+    try:
+        v = float(os.getenv(name, "").strip() or default)
+        return v if v >= 0 else default
+    except Exception:
+        return default
@@ -0,0 +1,125 @@
+# =========================
+# File: app/eod.py
+# 說明：盤後整批匯入：每個交易日盤後資料公布後，抓一次 MI_INDEX（上市）與 TPEX 收盤行情（上櫃）
+#      全市場快照放進排行快照快取；之後 fetch_daily / auto_daily 對該日任一代號直接由記憶體回答，
+#      盤後數千個逐檔 STOCK_DAY 請求變成兩個。
+# =========================
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import logging
+import os
+from typing import Callable, Dict, Optional
+
+from app.config import env_float, env_int
+from app.market_hours import close_update_at, taipei_now
+from app.rankings import SNAPSHOTS, get_snapshot
+from app.ratelimit import BACKGROUND, set_priority
+from app.trading_calendar import ensure_loaded, is_trading_day
+
+log = logging.getLogger(__name__)
+
+EOD_INGEST_ENABLED: bool = os.getenv("EOD_INGEST_ENABLED", "1").strip().lower() not in {
+    "0",
+    "false",
+    "no",
+}
+# 盤後更新時點（14:30）之後再等多久才抓，給交易所完成發布的緩衝
+EOD_INGEST_DELAY_SEC: float = env_float("EOD_INGEST_DELAY_SEC", 600.0)
+# 資料尚未公布（空表）或上游失敗時的重試間隔與次數
+EOD_RETRY_SEC: float = env_float("EOD_RETRY_SEC", 600.0)
+EOD_MAX_ATTEMPTS: int = env_int("EOD_MAX_ATTEMPTS", 6)
+
+MARKETS = ("TWSE", "TPEX")
+
+
+def is_ingested(date: dt.date) -> bool:
+    return all(SNAPSHOTS.final(m, date) is not None for m in MARKETS)
+
+
+async def ingest(date: dt.date) -> Dict[str, int]:
+    """抓取（或沿用快取中已定稿的）兩個市場當日全市場資料；回傳各市場筆數。"""
+    counts: Dict[str, int] = {}
+    for market in MARKETS:
+        snap = SNAPSHOTS.final(market, date) or await get_snapshot(market, date)
+        counts[market] = len(snap)
+    return counts
+
+
+class EodIngestor:
+    """每個交易日盤後更新時點 + EOD_INGEST_DELAY_SEC 執行 ingest；由 bot 生命週期啟停。"""
+
+    def __init__(
+        self,
+        delay_sec: float = EOD_INGEST_DELAY_SEC,
+        retry_sec: float = EOD_RETRY_SEC,
+        max_attempts: int = EOD_MAX_ATTEMPTS,
+        clock: Callable[[], dt.datetime] = taipei_now,
+    ):
+        self.delay_sec = delay_sec
+        self.retry_sec = retry_sec
+        self.max_attempts = max(1, max_attempts)
+        self.clock = clock
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        # 最近一次已處理（成功或放棄）的日期；休市日重試用盡後不再重複嘗試
+        self.last_date: Optional[dt.date] = None
+
+    def next_run(self, now: dt.datetime) -> dt.datetime:
+        """下一次匯入時點；今日已過匯入時點但尚未匯入時即為現在（例如盤後重啟）。"""
+        day = now.date()
+        while True:
+            if is_trading_day(day):
+                at = close_update_at(day) + dt.timedelta(seconds=self.delay_sec)
+                if day == now.date() and now >= at:
+                    if day != self.last_date and not is_ingested(day):
+                        return now
+                elif at > now:
+                    return at
+            day += dt.timedelta(days=1)
+
+    async def run_once(self, date: dt.date) -> bool:
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                counts = await ingest(date)
+            except Exception as e:
+                log.warning("EOD ingest %s attempt %d failed: %s", date, attempt, e)
+            else:
+                if all(counts.values()):
+                    self.runs += 1
+                    log.info("EOD ingest %s: %s", date, counts)
+                    return True
+                # 空表：當日資料尚未公布（或休市）
+                log.info(
+                    "EOD ingest %s attempt %d: data not published yet %s",
+                    date,
+                    attempt,
+                    counts,
+                )
+            if attempt < self.max_attempts:
+                await asyncio.sleep(self.retry_sec)
+        return False
+
+    async def _run(self) -> None:
+        set_priority(BACKGROUND)
+        while True:
+            now = self.clock()
+            await ensure_loaded(now.date())
+            at = self.next_run(now)
+            await asyncio.sleep(max(0.0, (at - now).total_seconds()))
+            await self.run_once(at.date())
+            self.last_date = at.date()
+
+    def start(self) -> None:
+        if not EOD_INGEST_ENABLED or (self._task is not None and not self._task.done()):
+            return
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+EOD_INGESTOR = EodIngestor()
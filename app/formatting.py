@@ -2,9 +2,14 @@
 # File: app/formatting.py
 # =========================
 from __future__ import annotations
-from typing import Any, Dict, List
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import datetime as dt
+import math
 import discord
 
+from app.config import env_int
+
 def _fmt_num(v: Any) -> str:
     try:
         if isinstance(v, (int, float)):
@@ -18,42 +23,141 @@ def _fmt_num(v: Any) -> str:
     except Exception:
         return str(v)
 
+
+def _item_line(it: Dict[str, Any], mode: str) -> Tuple[str, str]:
+    """單列的 (標題, 明細) 純文字；名次與粗體由 _lines_from_items 統一加上。"""
+    tag = it.get("market", "")
+    tag_s = f"[{tag}] " if tag else ""
+    if mode == "movers":
+        pct = it.get("change_pct")
+        pct_str = f"{pct:.2f}%" if isinstance(pct, (int, float)) else str(pct)
+        change = it.get("change")
+        chg_str = (
+            (f"{change:+.2f}" if isinstance(change, (int, float)) else str(change))
+            if change is not None
+            else "-"
+        )
+        return (
+            f"{tag_s}{it['symbol']} {it.get('name','')}",
+            f"收盤 {it['close']:.2f}｜漲跌 {chg_str}｜漲幅 {pct_str}",
+        )
+    vol = it.get("volume")
+    val = it.get("value")
+    vol_s = _fmt_num(vol) if vol is not None else "-"
+    val_s = _fmt_num(val) if val is not None else "-"
+    return (
+        f"{tag_s}{it['symbol']} {it.get('name','')}",
+        f"收盤 {it['close']:.2f}｜量 {vol_s}｜額 {val_s}",
+    )
+
+
 def _lines_from_items(items: List[Dict[str, Any]], mode: str) -> List[str]:
+    # (標題, 明細) 純文字快取在 item["display"]；排行快照的 item 跨請求共用，只需格式化一次
+    if mode not in ("movers", "actives"):
+        return []
     lines: List[str] = []
     for idx, it in enumerate(items, 1):
-        tag = it.get("market", "")
-        tag_s = f"[{tag}] " if tag else ""
-        if mode == "movers":
-            pct = it.get("change_pct")
-            pct_str = f"{pct:.2f}%" if isinstance(pct, (int, float)) else str(pct)
-            change = it.get("change")
-            chg_str = (f"{change:+.2f}" if isinstance(change, (int, float)) else str(change)) if change is not None else "-"
-            lines.append(
-                f"**{idx}. {tag_s}{it['symbol']} {it.get('name','')}**\n"
-                f"收盤 {it['close']:.2f}｜漲跌 {chg_str}｜漲幅 {pct_str}"
-            )
-        elif mode == "actives":
-            vol = it.get("volume")
-            val = it.get("value")
-            vol_s = _fmt_num(vol) if vol is not None else "-"
-            val_s = _fmt_num(val) if val is not None else "-"
-            lines.append(
-                f"**{idx}. {tag_s}{it['symbol']} {it.get('name','')}**\n"
-                f"收盤 {it['close']:.2f}｜量 {vol_s}｜額 {val_s}"
-            )
+        display = it.get("display")
+        cached = display.get(mode) if display is not None else None
+        if cached is None:
+            cached = _item_line(it, mode)
+            if display is not None:
+                display[mode] = cached
+        title, detail = cached
+        lines.append(f"**{idx}. {title}**\n{detail}")
     return lines
 
-def rank_embed(payload: Dict[str, Any], title: str, mode: str, color: int) -> discord.Embed:
+FIELD_VALUE_MAX = 1024  # Discord 單一 field value 上限
+
+
+def _paginate(lines: List[str], limit: int = FIELD_VALUE_MAX) -> List[str]:
+    """依行切成多段，每段不超過 limit 字元（單行超長時截斷）。"""
+    pages: List[str] = []
+    cur: List[str] = []
+    size = 0
+    for line in lines:
+        line = line if len(line) <= limit else line[: limit - 1] + "…"
+        extra = len(line) + (1 if cur else 0)
+        if cur and size + extra > limit:
+            pages.append("\n".join(cur))
+            cur, size = [], 0
+            extra = len(line)
+        cur.append(line)
+        size += extra
+    if cur:
+        pages.append("\n".join(cur))
+    return pages
+
+
+def _stale_note(payload: Dict[str, Any]) -> str:
+    # 上游慢或故障時回傳的是過期快取：標示原始抓取時間
+    since = payload.get("stale_since")
+    if not since:
+        return ""
+    try:
+        since = dt.datetime.fromisoformat(since).strftime("%m/%d %H:%M")
+    except (TypeError, ValueError):
+        pass
+    return f"⚠ 上游暫時無法更新，顯示 {since} 的快取資料"
+
+
+RENDER_CACHE_SIZE: int = env_int("RENDER_CACHE_SIZE", 256)
+# (payload version, mode, title, color) → embed.to_dict()
+_RENDERED: "OrderedDict[Tuple[Any, ...], Dict[str, Any]]" = OrderedDict()
+
+
+def _clone(data: Dict[str, Any]) -> Dict[str, Any]:
+    # Embed.from_dict 直接引用 fields/footer；複製一層避免呼叫端修改污染快取
+    return {
+        k: (
+            [dict(x) for x in v]
+            if isinstance(v, list)
+            else dict(v) if isinstance(v, dict) else v
+        )
+        for k, v in data.items()
+    }
+
+
+def _build_rank_embed(
+    payload: Dict[str, Any], title: str, mode: str, color: int
+) -> discord.Embed:
     items: List[Dict[str, Any]] = payload.get("items", [])
     date_str = payload.get("date", "")
     source = payload.get("source", "")
     embed = discord.Embed(title=title, description=f"日期：{date_str}", color=color)
-    lines = _lines_from_items(items, mode)
-    embed.add_field(name="前幾名", value="\n".join(lines) if lines else "無資料", inline=False)
-    if source:
-        embed.set_footer(text=f"來源：{source}")
+    pages = _paginate(_lines_from_items(items, mode))
+    for n, page in enumerate(pages or ["無資料"]):
+        embed.add_field(
+            name="前幾名" if n == 0 else "前幾名（續）", value=page, inline=False
+        )
+    footer = f"來源：{source}" if source else ""
+    stale = _stale_note(payload)
+    if stale:
+        footer = f"{footer}｜{stale}" if footer else stale
+    if footer:
+        embed.set_footer(text=footer)
     return embed
 
+
+def rank_embed(
+    payload: Dict[str, Any], title: str, mode: str, color: int
+) -> discord.Embed:
+    version = payload.get("version")
+    if version is None:
+        return _build_rank_embed(payload, title, mode, color)
+    key = (version, mode, title, color)
+    cached = _RENDERED.get(key)
+    if cached is None:
+        cached = _RENDERED[key] = _build_rank_embed(
+            payload, title, mode, color
+        ).to_dict()
+        while len(_RENDERED) > RENDER_CACHE_SIZE:
+            _RENDERED.popitem(last=False)
+    else:
+        _RENDERED.move_to_end(key)
+    return discord.Embed.from_dict(_clone(cached))
+
+
 def gainers_embed(payload: Dict[str, Any], title: str = "漲幅排行") -> discord.Embed:
     return rank_embed(payload, title, mode="movers", color=0xE74C3C)
 
@@ -62,3 +166,180 @@ def losers_embed(payload: Dict[str, Any], title: str = "跌幅排行") -> discor
 
 def actives_embed(payload: Dict[str, Any], title: str = "成交量排行") -> discord.Embed:
     return rank_embed(payload, title, mode="actives", color=0x3498DB)
+
+
+def _fmt_price(v: Any) -> str:
+    if isinstance(v, (int, float)):
+        return f"{v:,.2f}"
+    return "-" if v in (None, "") else str(v)
+
+
+def ohlc_embed(
+    title: str, payload: Dict[str, Any], actual_date: Optional[str] = None
+) -> discord.Embed:
+    rec: Dict[str, Any] = payload.get("record") or {}
+    date_str = actual_date or payload.get("date", "")
+    embed = discord.Embed(
+        title=title,
+        description=f"日期：{date_str}（{rec.get('date', '-')}）",
+        color=0x2ECC71,
+    )
+    embed.add_field(name="開盤", value=_fmt_price(rec.get("open")))
+    embed.add_field(name="最高", value=_fmt_price(rec.get("high")))
+    embed.add_field(name="最低", value=_fmt_price(rec.get("low")))
+    embed.add_field(name="收盤", value=_fmt_price(rec.get("close")))
+    change = rec.get("change")
+    embed.add_field(
+        name="漲跌",
+        value=(
+            f"{change:+.2f}"
+            if isinstance(change, (int, float))
+            else str(change or "-").strip()
+        ),
+    )
+    embed.add_field(
+        name="成交量",
+        value=_fmt_num(rec.get("volume")) if rec.get("volume") is not None else "-",
+    )
+    footer = f"來源：{payload.get('market', '')}"
+    stale = _stale_note(payload)
+    embed.set_footer(text=f"{footer}｜{stale}" if stale else footer)
+    return embed
+
+
+def realtime_embed(symbol: str, data: Dict[str, Any]) -> discord.Embed:
+    # MIS 欄位：n 名稱、z 成交價、o/h/l 開高低、y 昨收、v 累積量（張）、d/t 日期時間
+    name = data.get("n", "")
+    embed = discord.Embed(title=f"{symbol} {name} 即時報價".strip(), color=0xF1C40F)
+    embed.add_field(name="成交價", value=str(data.get("z") or data.get("price") or "-"))
+    embed.add_field(name="開盤", value=str(data.get("o") or "-"))
+    embed.add_field(name="最高", value=str(data.get("h") or "-"))
+    embed.add_field(name="最低", value=str(data.get("l") or "-"))
+    embed.add_field(name="昨收", value=str(data.get("y") or "-"))
+    embed.add_field(
+        name="累積量(張)", value=_fmt_num(data.get("v")) if data.get("v") else "-"
+    )
+    if data.get("closed"):
+        # 休市：最近交易日收盤（日線資料）
+        embed.set_footer(
+            text=f"已收盤｜來源：{data.get('market', '')} 日線｜{data.get('d', '')}"
+        )
+    else:
+        embed.set_footer(
+            text=f"來源：TWSE MIS｜{data.get('d', '')} {data.get('t', '')}".rstrip()
+        )
+    return embed
+
+
+def range_embed(title: str, series: Any) -> discord.Embed:
+    # series：app.bar_store.BarSeries（欄式，缺值為 NaN）
+    n = len(series)
+    if n == 0:
+        return discord.Embed(title=title, description="區間內無資料", color=0x9B59B6)
+    first = dt.date.fromordinal(series.days[0]).isoformat()
+    last = dt.date.fromordinal(series.days[-1]).isoformat()
+    highs = [v for v in series.high if not math.isnan(v)]
+    lows = [v for v in series.low if not math.isnan(v)]
+    closes = [v for v in series.close if not math.isnan(v)]
+    # 區間報酬以首日開盤前的昨收（首日收盤 - 漲跌）為基準；缺漲跌時退回首日收盤
+    base = None
+    if closes:
+        c0, ch0 = series.close[0], series.change[0]
+        base = c0 - ch0 if not (math.isnan(c0) or math.isnan(ch0)) else closes[0]
+    ret = f"{(closes[-1] / base - 1) * 100:+.2f}%" if closes and base else "-"
+    volume = sum(v for v in series.volume if not math.isnan(v))
+    embed = discord.Embed(
+        title=title, description=f"{first} ~ {last}（{n} 個交易日）", color=0x9B59B6
+    )
+    embed.add_field(name="最高", value=_fmt_price(max(highs)) if highs else "-")
+    embed.add_field(name="最低", value=_fmt_price(min(lows)) if lows else "-")
+    embed.add_field(name="收盤", value=_fmt_price(closes[-1]) if closes else "-")
+    embed.add_field(name="區間報酬", value=ret)
+    embed.add_field(name="總成交量", value=_fmt_num(volume))
+    embed.set_footer(text=f"來源：{series.market}")
+    return embed
+
+
+def _fmt_ind(v: Any, digits: int = 2) -> str:
+    if not isinstance(v, (int, float)) or math.isnan(v):
+        return "-"
+    return f"{v:,.{digits}f}"
+
+
+def indicators_embed(title: str, ind: Dict[str, Any]) -> discord.Embed:
+    embed = discord.Embed(
+        title=title,
+        description=f"日期：{ind.get('date', '')}｜收盤 {_fmt_ind(ind.get('close'))}",
+        color=0x1ABC9C,
+    )
+    embed.add_field(
+        name="MA5 / MA20 / MA60",
+        value=" / ".join(_fmt_ind(ind.get(k)) for k in ("ma5", "ma20", "ma60")),
+        inline=False,
+    )
+    embed.add_field(name="RSI(14)", value=_fmt_ind(ind.get("rsi")))
+    embed.add_field(
+        name="K / D", value=f"{_fmt_ind(ind.get('k'))} / {_fmt_ind(ind.get('d'))}"
+    )
+    embed.add_field(
+        name="MACD / 訊號 / 柱",
+        value=" / ".join(
+            _fmt_ind(ind.get(k), 3) for k in ("macd", "macd_signal", "macd_hist")
+        ),
+        inline=False,
+    )
+    embed.add_field(name="5 日均量", value=_fmt_ind(ind.get("vol_ma5"), 0))
+    embed.set_footer(text=f"來源：{ind.get('market', '')}")
+    return embed
+
+
+def _fmt_ms(sec: Optional[float]) -> str:
+    if sec is None:
+        return "-"
+    return ">30s" if math.isinf(sec) else f"≤{sec * 1000:,.0f}ms"
+
+
+def stats_embed(summary: Dict[str, Any]) -> discord.Embed:
+    embed = discord.Embed(title="Bot 狀態", color=0x95A5A6)
+    if not summary.get("enabled"):
+        embed.description = (
+            "量測未啟用（設定 METRICS_ENABLED=1），以下僅列快取、限速與斷路器狀態。"
+        )
+    cmds = summary.get("commands") or {}
+    lines = [
+        f"/{name}：{c['count']} 次（失敗 {c['errors']}）｜p50 {_fmt_ms(c.get('p50'))}｜p95 {_fmt_ms(c.get('p95'))}"
+        for name, c in sorted(cmds.items())
+    ]
+    for i, chunk in enumerate(_paginate(lines) if lines else ["-"]):
+        embed.add_field(
+            name="指令延遲" if i == 0 else "指令延遲（續）", value=chunk, inline=False
+        )
+    up = summary.get("upstream") or {}
+    lines = [
+        f"{host}："
+        + "、".join(f"{status}×{int(n)}" for status, n in sorted(st.items()))
+        for host, st in sorted(up.items())
+    ]
+    embed.add_field(name="上游請求", value="\n".join(lines) or "-", inline=False)
+    caches = summary.get("caches") or {}
+    lines = [
+        f"{name}：{'-' if r is None else f'{r:.0%}'}"
+        for name, r in sorted(caches.items())
+    ]
+    embed.add_field(name="快取命中率", value="\n".join(lines) or "-", inline=False)
+    breakers = summary.get("breakers") or {}
+    lines = [
+        f"{host}：{b['state']}（短路 {b['short_circuited']}）"
+        for host, b in sorted(breakers.items())
+    ]
+    embed.add_field(name="斷路器", value="\n".join(lines) or "-", inline=False)
+    limits = summary.get("rate_limits") or {}
+    lines = [
+        f"{host}：排隊 {s.get('queued', 0)}｜互動平均等待 {s.get('interactive', {}).get('avg_delay_ms', 0)}ms"
+        for host, s in sorted(limits.items())
+    ]
+    embed.add_field(name="限速", value="\n".join(lines) or "-", inline=False)
+    embed.set_footer(
+        text=f"event loop 延遲 p99：{_fmt_ms(summary.get('loop_lag_p99'))}"
+    )
+    return embed
@@ -0,0 +1,116 @@
+# =========================
+# File: app/http_client.py
+# 說明：Bot 生命週期共用的 aiohttp session（keep-alive / DNS 快取 / 每主機連線上限 / 逾時可調）
+#      以及回應 JSON 解碼：直接解碼 bytes，有安裝 orjson 時使用，否則退回標準庫
+# =========================
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any, Iterable, Optional
+
+import aiohttp
+
+from app.config import env_float, env_int
+
+try:
+    import orjson as _orjson
+except ImportError:  # 選用相依
+    _orjson = None
+
+DEFAULT_HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+# 可配置常數：連線池與逾時
+HTTP_LIMIT: int = env_int("HTTP_LIMIT", 100)
+HTTP_LIMIT_PER_HOST: int = env_int("HTTP_LIMIT_PER_HOST", 10)
+HTTP_DNS_TTL_SEC: int = env_int("HTTP_DNS_TTL_SEC", 300)
+HTTP_KEEPALIVE_SEC: float = env_float("HTTP_KEEPALIVE_SEC", 30.0)
+HTTP_TIMEOUT_SEC: float = env_float("HTTP_TIMEOUT_SEC", 15.0)
+HTTP_CONNECT_TIMEOUT_SEC: float = env_float("HTTP_CONNECT_TIMEOUT_SEC", 5.0)
+
+_session: Optional[aiohttp.ClientSession] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _build_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_LIMIT,
+        limit_per_host=HTTP_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_TTL_SEC,
+        use_dns_cache=True,
+        keepalive_timeout=HTTP_KEEPALIVE_SEC,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=HTTP_TIMEOUT_SEC,
+        connect=HTTP_CONNECT_TIMEOUT_SEC,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        headers=DEFAULT_HEADERS,
+    )
+
+
+def _usable() -> bool:
+    # session 綁定建立時的 event loop；換 loop（如測試）時必須重建
+    return (
+        _session is not None
+        and not _session.closed
+        and _session_loop is asyncio.get_running_loop()
+    )
+
+
+async def start_session() -> aiohttp.ClientSession:
+    """建立（或沿用）共用 session；由 bot 的 setup_hook 呼叫。"""
+    global _session, _session_loop
+    if not _usable():
+        _session = _build_session()
+        _session_loop = asyncio.get_running_loop()
+    return _session
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """取得共用 session；尚未啟動時（腳本/測試）會自動建立。"""
+    if _usable():
+        return _session
+    return await start_session()
+
+
+async def close_session() -> None:
+    """關閉共用 session；由 bot 關閉流程呼叫。"""
+    global _session, _session_loop
+    sess, _session, _session_loop = _session, None, None
+    if sess is not None and not sess.closed:
+        await sess.close()
+
+
+def loads(body: bytes) -> Any:
+    """bytes → JSON 物件；不先轉成 str。"""
+    if _orjson is not None:
+        try:
+            return _orjson.loads(body)
+        except _orjson.JSONDecodeError:
+            # orjson 不接受 BOM 等少見格式，交給標準庫處理
+            pass
+    if isinstance(body, (bytes, bytearray)):
+        body = bytes(body).decode("utf-8-sig")
+    return json.loads(body)
+
+
+def decode_json(body: bytes, keep: Optional[Iterable[str]] = None) -> Any:
+    """
+    解碼 JSON；指定 keep 時只保留這些頂層鍵（例如 data9 / aaData / msgArray），
+    其餘部分不會被快取或後續處理持有。
+    """
+    if not body.strip():
+        return None
+    data = loads(body)
+    if keep is not None and isinstance(data, dict):
+        data = {k: data[k] for k in keep if k in data}
+    return data
+
+
+async def read_json(
+    resp: aiohttp.ClientResponse, keep: Optional[Iterable[str]] = None
+) -> Any:
+    return decode_json(await resp.read(), keep)
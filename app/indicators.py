@@ -0,0 +1,314 @@
+# =========================
+# File: app/indicators.py
+# 說明：技術指標引擎（NumPy）：MA5/20/60、RSI14、MACD(12,26,9)、KD(9,3,3)
+#      全量計算以「代號 × 日期」矩陣一次處理整個市場；遞迴指標只沿時間軸迴圈，代號方向向量化。
+#      每個代號保留遞迴狀態與尾端視窗，新增一根日線時只做一步更新，不重算整段歷史。
+# =========================
+from __future__ import annotations
+
+import datetime as dt
+import math
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from app.bar_store import BarSeries
+from app.config import env_int
+from app.tw_markets import fetch_daily_range
+
+MA_WINDOWS: Tuple[int, ...] = (5, 20, 60)
+RSI_PERIOD = 14
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+KD_PERIOD = 9
+VOL_MA = 5
+_TAIL = max(MA_WINDOWS + (KD_PERIOD, VOL_MA))
+
+_A_FAST = 2.0 / (MACD_FAST + 1)
+_A_SLOW = 2.0 / (MACD_SLOW + 1)
+_A_SIGNAL = 2.0 / (MACD_SIGNAL + 1)
+_A_RSI = 1.0 / RSI_PERIOD  # Wilder 平滑
+_A_KD = 1.0 / 3.0
+
+# 取多少日曆天的日線做全量計算：約 120 個交易日，足夠 MA60 與 EMA 暖機（MACD 殘差 < 0.1%），
+# 冷快取時只需抓 6～7 個月；快取代號數上限
+INDICATOR_LOOKBACK_DAYS: int = env_int("INDICATOR_LOOKBACK_DAYS", 180)
+INDICATOR_CACHE_SIZE: int = env_int("INDICATOR_CACHE_SIZE", 4096)
+
+
+class IndicatorState:
+    """單一代號的遞迴狀態與尾端視窗；latest() 由狀態直接得出最新指標值。"""
+
+    __slots__ = (
+        "market",
+        "symbol",
+        "last_day",
+        "count",
+        "closes",
+        "highs",
+        "lows",
+        "volumes",
+        "ema_fast",
+        "ema_slow",
+        "signal",
+        "avg_gain",
+        "avg_loss",
+        "k",
+        "d",
+    )
+
+    def step(
+        self, day: int, close: float, high: float, low: float, volume: float
+    ) -> None:
+        """新增一根日線（與全量計算逐步等價）。"""
+        prev = self.closes[-1]
+        self.closes = np.append(self.closes[1:], close)
+        self.highs = np.append(self.highs[1:], high)
+        self.lows = np.append(self.lows[1:], low)
+        self.volumes = np.append(self.volumes[1:], volume)
+
+        self.ema_fast += _A_FAST * (close - self.ema_fast)
+        self.ema_slow += _A_SLOW * (close - self.ema_slow)
+        self.signal += _A_SIGNAL * ((self.ema_fast - self.ema_slow) - self.signal)
+
+        diff = close - prev
+        self.avg_gain += _A_RSI * (max(diff, 0.0) - self.avg_gain)
+        self.avg_loss += _A_RSI * (max(-diff, 0.0) - self.avg_loss)
+
+        hh = float(self.highs[-KD_PERIOD:].max())
+        ll = float(self.lows[-KD_PERIOD:].min())
+        rsv = (close - ll) / (hh - ll) * 100.0 if hh > ll else 50.0
+        self.k += _A_KD * (rsv - self.k)
+        self.d += _A_KD * (self.k - self.d)
+
+        self.count += 1
+        self.last_day = day
+
+    def latest(self) -> Dict[str, Any]:
+        nan = math.nan
+        out: Dict[str, Any] = {
+            "market": self.market,
+            "symbol": self.symbol,
+            "date": dt.date.fromordinal(self.last_day).isoformat(),
+            "close": float(self.closes[-1]),
+        }
+        for w in MA_WINDOWS:
+            out[f"ma{w}"] = float(self.closes[-w:].mean()) if self.count >= w else nan
+        out["vol_ma5"] = (
+            float(self.volumes[-VOL_MA:].mean()) if self.count >= VOL_MA else nan
+        )
+        if self.count > RSI_PERIOD:
+            if self.avg_loss > 0:
+                out["rsi"] = 100.0 - 100.0 / (1.0 + self.avg_gain / self.avg_loss)
+            else:
+                out["rsi"] = 100.0 if self.avg_gain > 0 else 50.0
+        else:
+            out["rsi"] = nan
+        macd = self.ema_fast - self.ema_slow
+        out["macd"] = macd
+        out["macd_signal"] = self.signal
+        out["macd_hist"] = macd - self.signal
+        out["k"] = self.k if self.count >= KD_PERIOD else nan
+        out["d"] = self.d if self.count >= KD_PERIOD else nan
+        return out
+
+
+def _clean(series: BarSeries) -> Tuple[np.ndarray, ...]:
+    """
+    去除無成交（收盤 NaN）的日子；高低缺值（或高低未包住收盤）以收盤補、量缺值補 0。
+    array('d') 以零拷貝轉為 ndarray。
+    """
+    close = np.frombuffer(series.close, dtype=np.float64)
+    keep = ~np.isnan(close)
+    days = np.frombuffer(series.days, dtype=np.int64)[keep]
+    close = close[keep]
+    high = np.frombuffer(series.high, dtype=np.float64)[keep]
+    low = np.frombuffer(series.low, dtype=np.float64)[keep]
+    vol = np.frombuffer(series.volume, dtype=np.float64)[keep]
+    high = np.where(high >= close, high, close)
+    low = np.where(low <= close, low, close)
+    vol = np.nan_to_num(vol, nan=0.0)
+    return days, close, high, low, vol
+
+
+def _ema(x: np.ndarray, alpha: float, init: np.ndarray) -> np.ndarray:
+    """沿時間軸（axis=1）的指數平滑；各列同時計算。"""
+    out = np.empty_like(x)
+    acc = init.astype(np.float64, copy=True)
+    for t in range(x.shape[1]):
+        acc += alpha * (x[:, t] - acc)
+        out[:, t] = acc
+    return out
+
+
+def _rolling(x: np.ndarray, w: int, fn) -> np.ndarray:
+    padded = np.pad(x, ((0, 0), (w - 1, 0)), mode="edge")
+    return fn(sliding_window_view(padded, w, axis=1), axis=-1)
+
+
+def build_states(series_list: Sequence[BarSeries]) -> List[Optional[IndicatorState]]:
+    """
+    全量計算：各序列左側補齊成同長矩陣後一次計算；收盤、最高、最低一律補首日收盤，量補 0。
+    補齊不影響結果：EMA 以首值起始、漲跌為 0；補齊區間高低相同，KD 的 RSV 為 50（與起始值相同），
+    且首日最高 ≥ 收盤 ≥ 最低，進入實際資料後 KD 視窗的高低點與單獨計算（邊界值延伸）相同。
+    無有效資料的序列回傳 None。
+    """
+    cleaned = [_clean(s) for s in series_list]
+    lengths = [len(c[0]) for c in cleaned]
+    n = max(lengths, default=0)
+    states: List[Optional[IndicatorState]] = [None] * len(series_list)
+    rows = [i for i, m in enumerate(lengths) if m > 0]
+    if not rows:
+        return states
+
+    def _matrix(k: int, pad_zero: bool = False) -> np.ndarray:
+        mat = np.empty((len(rows), n), dtype=np.float64)
+        for r, i in enumerate(rows):
+            col = cleaned[i][k]
+            pad = n - len(col)
+            mat[r, pad:] = col
+            mat[r, :pad] = 0.0 if pad_zero else cleaned[i][1][0]
+        return mat
+
+    close, high, low, vol = (
+        _matrix(1),
+        _matrix(2),
+        _matrix(3),
+        _matrix(4, pad_zero=True),
+    )
+
+    ema_fast = _ema(close, _A_FAST, close[:, 0])
+    ema_slow = _ema(close, _A_SLOW, close[:, 0])
+    signal = _ema(ema_fast - ema_slow, _A_SIGNAL, np.zeros(len(rows)))
+
+    diff = np.diff(close, axis=1, prepend=close[:, :1])
+    zeros = np.zeros(len(rows))
+    avg_gain = _ema(np.maximum(diff, 0.0), _A_RSI, zeros)
+    avg_loss = _ema(np.maximum(-diff, 0.0), _A_RSI, zeros)
+
+    hh = _rolling(high, KD_PERIOD, np.max)
+    ll = _rolling(low, KD_PERIOD, np.min)
+    span = hh - ll
+    rsv = np.full_like(close, 50.0)
+    np.divide((close - ll) * 100.0, span, out=rsv, where=span > 0)
+    fifty = np.full(len(rows), 50.0)
+    k = _ema(rsv, _A_KD, fifty)
+    d = _ema(k, _A_KD, fifty)
+
+    # 尾端視窗：不足長度時左側以首日收盤補齊（與全量計算的補齊方式一致）
+    tail = max(_TAIL, n)
+    if tail > n:
+        first = np.repeat(close[:, :1], tail - n, axis=1)
+        close_t = np.concatenate([first, close], axis=1)
+        high_t = np.concatenate([first, high], axis=1)
+        low_t = np.concatenate([first, low], axis=1)
+        vol_t = np.concatenate([np.zeros((len(rows), tail - n)), vol], axis=1)
+    else:
+        close_t, high_t, low_t, vol_t = close, high, low, vol
+
+    for r, i in enumerate(rows):
+        st = IndicatorState()
+        st.market = series_list[i].market
+        st.symbol = series_list[i].symbol
+        st.last_day = int(cleaned[i][0][-1])
+        st.count = lengths[i]
+        st.closes = close_t[r, -_TAIL:].copy()
+        st.highs = high_t[r, -_TAIL:].copy()
+        st.lows = low_t[r, -_TAIL:].copy()
+        st.volumes = vol_t[r, -_TAIL:].copy()
+        st.ema_fast = float(ema_fast[r, -1])
+        st.ema_slow = float(ema_slow[r, -1])
+        st.signal = float(signal[r, -1])
+        st.avg_gain = float(avg_gain[r, -1])
+        st.avg_loss = float(avg_loss[r, -1])
+        st.k = float(k[r, -1])
+        st.d = float(d[r, -1])
+        states[i] = st
+    return states
+
+
+class IndicatorCache:
+    """
+    每代號保留 IndicatorState（LRU）。序列最後一天與快取相同時直接回傳；
+    只多出一根日線時做增量更新；其餘情況（首次、缺口、改寫）全量重算。
+    """
+
+    def __init__(self, max_entries: int = INDICATOR_CACHE_SIZE):
+        self.max_entries = max(1, max_entries)
+        self._states: "OrderedDict[Tuple[str, str], IndicatorState]" = OrderedDict()
+        self.full = 0
+        self.incremental = 0
+
+    def clear(self) -> None:
+        self._states.clear()
+
+    def _remember(self, st: IndicatorState) -> None:
+        key = (st.market, st.symbol)
+        self._states[key] = st
+        self._states.move_to_end(key)
+        while len(self._states) > self.max_entries:
+            self._states.popitem(last=False)
+
+    def _try_step(self, series: BarSeries) -> Optional[IndicatorState]:
+        st = self._states.get((series.market, series.symbol))
+        n = len(series)
+        if st is None or n == 0:
+            return None
+        if st.last_day == series.days[-1]:
+            return st
+        if n >= 2 and st.last_day == series.days[-2]:
+            close = series.close[-1]
+            if close != close:
+                # 無成交日：指標不變，只記錄已看過該日
+                st.last_day = series.days[-1]
+                return st
+            high, low, vol = series.high[-1], series.low[-1], series.volume[-1]
+            st.step(
+                series.days[-1],
+                close,
+                high if high >= close else close,
+                low if low <= close else close,
+                0.0 if vol != vol else vol,
+            )
+            self.incremental += 1
+            return st
+        return None
+
+    def update_many(
+        self, series_list: Sequence[BarSeries]
+    ) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """批次更新（例如收盤後全市場）：能增量的逐一步進，其餘合併為一次矩陣計算。"""
+        out: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        rebuild: List[BarSeries] = []
+        for s in series_list:
+            st = self._try_step(s)
+            if st is None:
+                rebuild.append(s)
+            else:
+                self._remember(st)
+                out[(st.market, st.symbol)] = st.latest()
+        if rebuild:
+            self.full += len(rebuild)
+            for st in build_states(rebuild):
+                if st is not None:
+                    self._remember(st)
+                    out[(st.market, st.symbol)] = st.latest()
+        return out
+
+    def update(self, series: BarSeries) -> Optional[Dict[str, Any]]:
+        return self.update_many([series]).get((series.market, series.symbol))
+
+
+INDICATORS = IndicatorCache()
+
+
+async def indicators_for(
+    symbol: str, market: str, end: Optional[dt.date] = None
+) -> Optional[Dict[str, Any]]:
+    """取近 INDICATOR_LOOKBACK_DAYS 天日線並回傳最新指標；無資料回傳 None。"""
+    end = end or dt.date.today()
+    series = await fetch_daily_range(
+        symbol, market, end - dt.timedelta(days=INDICATOR_LOOKBACK_DAYS), end
+    )
+    return INDICATORS.update(series)
@@ -0,0 +1,25 @@
+# =========================
+# File: app/market_hours.py
+# 說明：台北時間與盤後資料更新時點（台灣無日光節約，固定 UTC+8）
+# =========================
+from __future__ import annotations
+
+import datetime as dt
+
+TAIPEI_TZ = dt.timezone(dt.timedelta(hours=8), name="Asia/Taipei")
+
+# 盤後日線（STOCK_DAY / st43）通常於收盤後約 14:30 前完成更新
+CLOSE_UPDATE_TIME = dt.time(14, 30)
+
+# 一般交易時段（台北時間）；是否為交易日見 app.trading_calendar
+SESSION_OPEN_TIME = dt.time(9, 0)
+SESSION_CLOSE_TIME = dt.time(13, 30)
+
+
+def taipei_now() -> dt.datetime:
+    return dt.datetime.now(TAIPEI_TZ)
+
+
+def close_update_at(day: dt.date) -> dt.datetime:
+    """該日盤後資料更新時點（台北時間）。"""
+    return dt.datetime.combine(day, CLOSE_UPDATE_TIME, tzinfo=TAIPEI_TZ)
@@ -4,60 +4,131 @@
 # =========================
 from __future__ import annotations
 
-import os
 import asyncio
 import datetime as dt
+import math
+import os
 from typing import Any, Dict, Generator, Optional, Tuple
 
-from app.tw_markets import fetch_daily, fetch_realtime
-
-
-def _env_int(name: str, default: int) -> int:
-    """讀取整數環境變數；不合法時回預設"""
-    try:
-        v = int(os.getenv(name, "").strip() or default)
-        return v if v >= 0 else default
-    except Exception:
-        return default
-
-
-def _env_float(name: str, default: float) -> float:
-    """讀取浮點數環境變數；不合法時回預設"""
-    try:
-        v = float(os.getenv(name, "").strip() or default)
-        return v if v >= 0 else default
-    except Exception:
-        return default
-
+from app.config import env_float as _env_float, env_int as _env_int
+from app.market_hours import taipei_now
+from app.realtime import RealtimePoller, has_tick as _has_tick
+from app.singleflight import SingleFlight
+from app.symbols import lookup, markets_for, remember
+from app.trading_calendar import (
+    ensure_loaded,
+    is_session_open,
+    last_trading_day,
+    trading_days_back,
+)
+from app.tw_markets import (
+    REALTIME_BATCH_MAX,
+    daily_from_snapshot,
+    fetch_daily,
+    fetch_daily_on_or_before,
+    fetch_realtime,
+    fetch_realtime_many,
+)
 
 # 可配置常數：不同環境（節能/測試）可調整回溯範圍與重試成本
 MAX_BACKTRACK_DAYS: int = _env_int("MARKETS_MAX_BACKTRACK_DAYS", 14)
 REALTIME_MAX_MINUTES_DEFAULT: int = _env_int("REALTIME_MAX_MINUTES", 3)
 REALTIME_INTERVAL_SEC_DEFAULT: float = _env_float("REALTIME_INTERVAL_SEC", 15.0)
+# 共用即時輪詢：多個等待中的查詢每個間隔只發一次批次請求
+REALTIME_POLLER = RealtimePoller(
+    fetch_realtime_many,
+    interval_sec=REALTIME_INTERVAL_SEC_DEFAULT,
+    max_batch=REALTIME_BATCH_MAX,
+)
+
+_AUTO_DAILY_FLIGHT = SingleFlight("markets_utils.auto_daily")
+_FIND_LAST_DAILY_FLIGHT = SingleFlight("markets_utils.find_last_daily")
+
+# 市場未知時同時查 TWSE/TPEX，先取得 record 者勝出、另一個取消
+AUTO_RACE: bool = os.getenv("MARKETS_AUTO_RACE", "0").strip().lower() in {
+    "1",
+    "true",
+    "yes",
+}
+# month：直接從整月資料挑 <= 目標日的最後一筆（最多跨一個月）；daily：逐日回溯
+BACKTRACK_MODE: str = (
+    os.getenv("MARKETS_BACKTRACK_MODE", "month").strip().lower() or "month"
+)
 
 
 def _iter_dates(base: dt.date, days: int) -> Generator[dt.date, None, None]:
-    """從 base 往前回溯最多 days 天（含 base）。"""
-    for delta in range(0, max(0, int(days)) + 1):
-        yield base - dt.timedelta(days=delta)
+    """從 base 往前回溯最多 days 天（含 base），只列出交易日；週末、國定假日與臨時休市不打上游。"""
+    yield from trading_days_back(base, days)
+
+
+async def _race_daily(
+    symbol: str,
+    when: dt.date,
+    markets: Tuple[str, ...],
+) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """多市場同時查詢；第一個含 record 的回應勝出，其餘取消。"""
+    tasks = {asyncio.ensure_future(fetch_daily(symbol, m, when)): m for m in markets}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for t in done:
+                if t.cancelled() or t.exception() is not None:
+                    continue
+                payload = t.result()
+                if payload and payload.get("record"):
+                    return tasks[t], payload
+        return None, None
+    finally:
+        for t in pending:
+            t.cancel()
 
 
 async def auto_daily(
     symbol: str,
     date: Optional[dt.date] = None,
+    race: Optional[bool] = None,
 ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
     """
-    對單一日期依序嘗試 TWSE → TPEX。
-    成功回傳 (市場, payload)，否則 (None, None)。
+    對單一日期查詢：代號目錄可判斷市場時直接查該市場，否則依序嘗試 TWSE → TPEX
+    （race=True 或 MARKETS_AUTO_RACE=1 時改為同時查詢）。
+    成功回傳 (市場, payload)，否則 (None, None)；查無代號時不打上游。
+    查到的市場會被記住，之後同代號直接路由。
     """
     when = date or dt.date.today()
-    for market in ("TWSE", "TPEX"):
+    race = AUTO_RACE if race is None else race
+    key = (symbol.strip().upper(), when, race)
+    return await _AUTO_DAILY_FLIGHT.do(key, lambda: _auto_daily(symbol, when, race))
+
+
+async def _auto_daily(
+    symbol: str,
+    when: dt.date,
+    race: bool,
+) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    markets = await markets_for(symbol)
+    # 盤後整批匯入已涵蓋該日：直接由記憶體判斷市場，不必逐一試打上游
+    for market in markets:
+        payload = daily_from_snapshot(symbol, market, when)
+        if payload is not None:
+            remember(symbol, market)
+            return market, payload
+    if race and len(markets) > 1:
+        market, payload = await _race_daily(symbol, when, markets)
+        if market:
+            remember(symbol, market)
+        return market, payload
+
+    for market in markets:
         try:
             payload = await fetch_daily(symbol, market, when)
         except Exception:
             # 避免單一市場錯誤中斷整體流程
             continue
         if payload and payload.get("record"):
+            remember(symbol, market)
             return market, payload
     return None, None
 
@@ -67,35 +138,88 @@ async def find_last_daily(
     date: Optional[dt.date],
 ) -> Tuple[Optional[str], Optional[Dict[str, Any]], Optional[dt.date]]:
     """
-    回補日線：對 base, base-1, ... 呼叫 auto_daily（TWSE→TPEX），最多回溯 MAX_BACKTRACK_DAYS。
+    回補日線，最多回溯 MAX_BACKTRACK_DAYS：
+    - month 模式：每個市場只抓目標月（必要時加上個月），直接取 <= base 的最後交易日
+    - daily 模式：對 base 往前的各交易日呼叫 auto_daily（TWSE→TPEX）
+    非交易日（交易日曆：週末、休市日程、EXTRA_HOLIDAYS）一律略過。
     回傳 (市場/None, payload/None, 使用到的日期/None)
     """
     base = date or dt.date.today()
-    for d in _iter_dates(base, MAX_BACKTRACK_DAYS):
+    key = (symbol.strip().upper(), base, BACKTRACK_MODE)
+    return await _FIND_LAST_DAILY_FLIGHT.do(key, lambda: _find_last_daily(symbol, base))
+
+
+async def _find_last_daily(
+    symbol: str,
+    base: dt.date,
+) -> Tuple[Optional[str], Optional[Dict[str, Any]], Optional[dt.date]]:
+    markets = await markets_for(symbol)
+    if not markets:
+        return None, None, None
+    await ensure_loaded(base)
+    not_before = base - dt.timedelta(days=max(0, MAX_BACKTRACK_DAYS))
+    # 非交易日直接從前一個交易日開始（月初連假時也省下抓當月的請求）
+    base = last_trading_day(base)
+    if base < not_before:
+        return None, None, None
+    for market in markets:
+        payload = daily_from_snapshot(symbol, market, base)
+        if payload is not None:
+            remember(symbol, market)
+            return market, payload, base
+    if BACKTRACK_MODE == "month":
+        for market in markets:
+            try:
+                payload, used = await fetch_daily_on_or_before(
+                    symbol, market, base, not_before
+                )
+            except Exception:
+                continue
+            if used and payload.get("record"):
+                remember(symbol, market)
+                return market, payload, used
+        return None, None, None
+
+    for d in _iter_dates(base, (base - not_before).days):
         market, payload = await auto_daily(symbol, d)
         if market and payload and payload.get("record"):
             return market, payload, d
     return None, None, None
 
 
-def _has_tick(data: Optional[Dict[str, Any]]) -> bool:
+def _fmt_quote(v: Any) -> str:
+    return f"{v:.2f}" if isinstance(v, (int, float)) and not math.isnan(v) else "-"
+
+
+async def last_close_quote(symbol: str) -> Optional[Dict[str, Any]]:
     """
-    判斷 TWSE MIS 回傳是否含有效成交價（欄位名稱可能為 price 或 z），時間欄位寬鬆檢查。
+    最近交易日收盤，轉成 MIS 欄位格式（z/o/h/l/y/v/d/n），並標記 closed=True；
+    供休市時的即時報價查詢使用。查無資料回傳 None。
     """
-    if not data:
-        return False
-    price = data.get("price") or data.get("z")
-    t = data.get("time") or data.get("t") or data.get("ts")
-    try:
-        if price is None:
-            return False
-        s = str(price).strip().replace(",", "")
-        if s in {"", "-", "—", "--", "NaN"}:
-            return False
-        float(s)
-        return True if t is None else (str(t).strip() != "")
-    except Exception:
-        return False
+    market, payload, used = await find_last_daily(symbol, taipei_now().date())
+    rec = (payload or {}).get("record") or {}
+    if not market or used is None or not isinstance(rec.get("close"), (int, float)):
+        return None
+    close, change, volume = rec["close"], rec.get("change"), rec.get("volume")
+    info = lookup(symbol.strip().upper())
+    return {
+        "c": symbol.strip().upper(),
+        "n": info.name if info else "",
+        "z": _fmt_quote(close),
+        "o": _fmt_quote(rec.get("open")),
+        "h": _fmt_quote(rec.get("high")),
+        "l": _fmt_quote(rec.get("low")),
+        "y": _fmt_quote(close - change) if isinstance(change, (int, float)) else "-",
+        "v": (
+            int(volume // 1000)
+            if isinstance(volume, (int, float)) and not math.isnan(volume)
+            else None
+        ),
+        "d": f"{used:%Y%m%d}",
+        "t": "",
+        "market": market,
+        "closed": True,
+    }
 
 
 async def find_last_realtime(
@@ -104,27 +228,32 @@ async def find_last_realtime(
     interval_sec: Optional[float] = None,
 ) -> Optional[Dict[str, Any]]:
     """
-    以「時間窗口重試」近似回補最近一筆即時報價（MIS 無歷史分鐘 API）。
+    以「時間窗口等待」近似回補最近一筆即時報價（MIS 無歷史分鐘 API）。
+    先查一次；無成交時：非交易時段直接回傳最近交易日收盤（last_close_quote），
+    交易時段內才登記到共用輪詢器，等待下一筆有效成交。
     - max_minutes: 窗口分鐘（預設取 REALTIME_MAX_MINUTES；預設 3）
-    - interval_sec: 重試間隔秒（預設取 REALTIME_INTERVAL_SEC；預設 15.0）
+    - interval_sec: 希望的輪詢間隔秒（預設取 REALTIME_INTERVAL_SEC；預設 15.0）
     成功回傳資料 dict，逾時回傳 None。
     """
     max_minutes = REALTIME_MAX_MINUTES_DEFAULT if max_minutes is None else max(0, int(max_minutes))
     interval_sec = REALTIME_INTERVAL_SEC_DEFAULT if interval_sec is None else max(0.2, float(interval_sec))
 
-    attempts = max(1, int((max_minutes * 60) // interval_sec) + 1)
-    for i in range(attempts):
-        try:
-            data = await fetch_realtime(symbol)
-        except Exception:
-            data = None
-
-        if _has_tick(data):
-            return data
+    try:
+        data = await fetch_realtime(symbol)
+    except Exception:
+        data = None
+    if _has_tick(data):
+        return data
+    if not is_session_open():
+        # 休市/盤後不會再有新成交，輪詢只是浪費請求
+        return await last_close_quote(symbol)
+    if max_minutes <= 0:
+        return None
 
-        if i < attempts - 1:
-            try:
-                await asyncio.sleep(interval_sec)
-            except Exception:
-                break
-    return None
+    markets = await markets_for(symbol)
+    if not markets:
+        return None
+    code = symbol.strip().upper()
+    return await REALTIME_POLLER.wait_tick(
+        markets[0], code, timeout=max_minutes * 60, interval_sec=interval_sec
+    )
@@ -0,0 +1,350 @@
+# =========================
+# File: app/metrics.py
+# 說明：內建量測：指令延遲（defer→followup）、上游請求次數/延遲/狀態（依主機與端點）、
+#      快取命中率、event loop 延遲；以 Prometheus 文字格式經本機 HTTP 端點輸出，並供 /stats 摘要。
+#      METRICS_ENABLED 關閉時記錄函式只做一次布林判斷即返回。
+# =========================
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import re
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from app.config import env_float, env_int
+
+METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "0").strip().lower() in {
+    "1",
+    "true",
+    "yes",
+}
+# 0 = 不開 HTTP 端點（/stats 仍可用）；預設只綁本機
+METRICS_PORT: int = env_int("METRICS_PORT", 9108)
+METRICS_HOST: str = os.getenv("METRICS_HOST", "127.0.0.1").strip() or "127.0.0.1"
+LOOP_LAG_INTERVAL_SEC: float = env_float("LOOP_LAG_INTERVAL_SEC", 0.5)
+
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
+LAG_BUCKETS: Tuple[float, ...] = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+)
+
+Labels = Tuple[str, ...]
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) + value
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        out += [
+            f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}"
+            for k, v in self.values.items()
+        ]
+        return out
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...],
+        buckets: Tuple[float, ...],
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels → [各 bucket 計數..., +Inf 計數, 總和]
+        self.series: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        s = self.series.get(labels)
+        if s is None:
+            s = self.series[labels] = [0.0] * (len(self.buckets) + 2)
+        s[bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    def count(self, labels: Labels) -> int:
+        s = self.series.get(labels)
+        return int(sum(s[:-1])) if s else 0
+
+    def quantile(self, q: float, labels: Labels) -> Optional[float]:
+        """以 bucket 上界估計分位數（與 Prometheus histogram_quantile 同精度等級）。"""
+        s = self.series.get(labels)
+        if not s:
+            return None
+        total = sum(s[:-1])
+        if not total:
+            return None
+        rank = q * total
+        seen = 0.0
+        for i, c in enumerate(s[:-1]):
+            seen += c
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else math.inf
+        return math.inf
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        for labels, s in self.series.items():
+            cum = 0.0
+            for le, c in zip(self.buckets + (math.inf,), s[:-1]):
+                cum += c
+                le_s = "+Inf" if le == math.inf else repr(le)
+                out.append(
+                    f"{self.name}_bucket{_fmt_labels(names, labels + (le_s,))} {_fmt_value(cum)}"
+                )
+            out.append(
+                f"{self.name}_sum{_fmt_labels(self.labelnames, labels)} {_fmt_value(s[-1])}"
+            )
+            out.append(
+                f"{self.name}_count{_fmt_labels(self.labelnames, labels)} {_fmt_value(cum)}"
+            )
+        return out
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names: Tuple[str, ...], values: Labels) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+COMMAND_LATENCY = Histogram(
+    "stockbot_command_latency_seconds",
+    "Slash command latency from interaction to final reply",
+    ("command", "outcome"),
+    LATENCY_BUCKETS,
+)
+UPSTREAM_LATENCY = Histogram(
+    "stockbot_upstream_request_seconds",
+    "Upstream HTTP request latency",
+    ("host", "endpoint"),
+    LATENCY_BUCKETS,
+)
+UPSTREAM_REQUESTS = Counter(
+    "stockbot_upstream_requests_total",
+    "Upstream HTTP requests by status",
+    ("host", "endpoint", "status"),
+)
+LOOP_LAG = Histogram(
+    "stockbot_event_loop_lag_seconds", "Event loop scheduling lag", (), LAG_BUCKETS
+)
+
+_METRICS = (COMMAND_LATENCY, UPSTREAM_LATENCY, UPSTREAM_REQUESTS, LOOP_LAG)
+
+_ENDPOINT_RE = re.compile(r"/([^/?]+?)(?:\.(?:jsp|php))?(?:\?|$)")
+_STATUS_RE = re.compile(r"HTTP (\d{3})")
+
+
+def endpoint_of(path: str) -> str:
+    """URL 路徑最後一段當端點名（STOCK_DAY、MI_INDEX、st43_result、getStockInfo...）。"""
+    m = _ENDPOINT_RE.search(path)
+    return m.group(1) if m else path
+
+
+def status_of(exc: Optional[BaseException]) -> str:
+    """成功為 200；client 對非 200 以 'HTTP nnn' 拋錯時取其狀態碼，其餘以例外類別名稱表示。"""
+    if exc is None:
+        return "200"
+    m = _STATUS_RE.search(str(exc))
+    return m.group(1) if m else type(exc).__name__
+
+
+def observe_upstream(
+    host: str, path: str, seconds: Optional[float], exc: Optional[BaseException] = None
+) -> None:
+    """seconds 為 None 表示未實際送出（例如斷路），只計次數。"""
+    if not METRICS_ENABLED:
+        return
+    endpoint = endpoint_of(path)
+    if seconds is not None:
+        UPSTREAM_LATENCY.observe(seconds, host, endpoint)
+    UPSTREAM_REQUESTS.inc(host, endpoint, status_of(exc))
+
+
+def observe_command(command: str, seconds: float, ok: bool = True) -> None:
+    if not METRICS_ENABLED:
+        return
+    COMMAND_LATENCY.observe(seconds, command, "ok" if ok else "error")
+
+
+# ---- 快取與其他元件的既有計數：輸出時才讀取 ----
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    """{快取名稱: {hits, misses}}；延遲匯入避免循環相依。"""
+    from app.month_cache import MONTH_CACHE
+    from app.rankings import SNAPSHOTS
+    from app.singleflight import singleflight_stats
+    from app.tw_markets import REALTIME_BATCHER
+
+    out = {
+        "month": {"hits": MONTH_CACHE.hits, "misses": MONTH_CACHE.misses},
+        "snapshot": {"hits": SNAPSHOTS.hits, "misses": SNAPSHOTS.misses},
+        # 即時報價：合併進同一批次的請求視為命中
+        "realtime_batch": {
+            "hits": REALTIME_BATCHER.requests - REALTIME_BATCHER.batches,
+            "misses": REALTIME_BATCHER.batches,
+        },
+    }
+    for name, st in singleflight_stats().items():
+        out[f"singleflight:{name}"] = {
+            "hits": st["coalesced"],
+            "misses": st["calls"] - st["coalesced"],
+        }
+    return out
+
+
+def _render_caches() -> List[str]:
+    hits = Counter("stockbot_cache_hits_total", "Cache hits", ("cache",))
+    misses = Counter("stockbot_cache_misses_total", "Cache misses", ("cache",))
+    for name, st in cache_stats().items():
+        hits.inc(name, value=st["hits"])
+        misses.inc(name, value=st["misses"])
+    return hits.render() + misses.render()
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in _METRICS:
+        lines += m.render()
+    lines += _render_caches()
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    for m in _METRICS:
+        if isinstance(m, Histogram):
+            m.series.clear()
+        else:
+            m.values.clear()
+
+
+# ---- event loop 延遲與 HTTP 端點 ----
+
+
+async def _watch_loop_lag(interval: float) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - start - interval))
+
+
+class MetricsServer:
+    """持有 loop 延遲監測 task 與 aiohttp.web 端點；由 bot 生命週期啟停。"""
+
+    def __init__(self) -> None:
+        self._lag_task: Optional[asyncio.Task] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self, host: str = METRICS_HOST, port: int = METRICS_PORT) -> None:
+        if not METRICS_ENABLED:
+            return
+        self._lag_task = asyncio.create_task(_watch_loop_lag(LOOP_LAG_INTERVAL_SEC))
+        if port:
+            app = web.Application()
+            app.router.add_get("/metrics", self._handle)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, host, port).start()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=render(),
+            content_type="text/plain",
+            headers={"X-Content-Type-Options": "nosniff"},
+        )
+
+    async def stop(self) -> None:
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+METRICS_SERVER = MetricsServer()
+
+
+def summary() -> Dict[str, Any]:
+    """/stats 用的摘要：各指令 p50/p95 與次數、上游各主機請求數與狀態、快取命中率、loop 延遲。"""
+    commands: Dict[str, Dict[str, Any]] = {}
+    for command, outcome in COMMAND_LATENCY.series:
+        c = commands.setdefault(command, {"count": 0, "errors": 0})
+        n = COMMAND_LATENCY.count((command, outcome))
+        c["count"] += n
+        if outcome == "error":
+            c["errors"] += n
+        if outcome == "ok":
+            c["p50"] = COMMAND_LATENCY.quantile(0.5, (command, outcome))
+            c["p95"] = COMMAND_LATENCY.quantile(0.95, (command, outcome))
+    upstream: Dict[str, Dict[str, float]] = {}
+    for (host, _endpoint, status), v in UPSTREAM_REQUESTS.values.items():
+        upstream.setdefault(host, {})[status] = (
+            upstream.get(host, {}).get(status, 0) + v
+        )
+    caches = {
+        name: (
+            st["hits"] / (st["hits"] + st["misses"])
+            if st["hits"] + st["misses"]
+            else None
+        )
+        for name, st in cache_stats().items()
+    }
+    from app.ratelimit import LIMITER
+    from app.resilience import breaker_stats
+
+    return {
+        "enabled": METRICS_ENABLED,
+        "commands": commands,
+        "upstream": upstream,
+        "caches": caches,
+        "loop_lag_p99": LOOP_LAG.quantile(0.99, ()),
+        "rate_limits": LIMITER.stats(),
+        "breakers": breaker_stats(),
+    }
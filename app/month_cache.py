@@ -0,0 +1,157 @@
+# =========================
+# File: app/month_cache.py
+# 說明：STOCK_DAY / st43 月資料快取（鍵：市場, 代號, 年月）；存放已解析的欄式 BarSeries
+#      已結束的月份視為不可變（常駐，可選擇以欄位檔落地磁碟）；當月資料短 TTL，且跨過交易日盤後更新時點即失效
+# =========================
+from __future__ import annotations
+
+import datetime as dt
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from app.bar_store import BarSeries
+from app.config import env_int
+from app.market_hours import taipei_now
+from app.trading_calendar import last_close_update
+
+MONTH_CACHE_TTL_SEC: int = env_int("MONTH_CACHE_TTL_SEC", 300)
+MONTH_CACHE_MAX_ENTRIES: int = env_int("MONTH_CACHE_MAX_ENTRIES", 5000)
+MONTH_CACHE_DIR: str = os.getenv("MONTH_CACHE_DIR", "").strip()
+
+Key = Tuple[str, str, str]
+
+
+def _year_month(day: dt.date) -> str:
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+class _Entry:
+    __slots__ = ("payload", "fetched_at", "immutable")
+
+    def __init__(self, payload: Any, fetched_at: dt.datetime, immutable: bool):
+        self.payload = payload
+        self.fetched_at = fetched_at
+        self.immutable = immutable
+
+
+class MonthCache:
+    def __init__(
+        self,
+        ttl_sec: int = MONTH_CACHE_TTL_SEC,
+        max_entries: int = MONTH_CACHE_MAX_ENTRIES,
+        persist_dir: Optional[str] = MONTH_CACHE_DIR or None,
+        clock: Callable[[], dt.datetime] = taipei_now,
+    ):
+        self.ttl_sec = ttl_sec
+        self.max_entries = max(1, max_entries)
+        self.persist_dir = Path(persist_dir) if persist_dir else None
+        self.clock = clock
+        self._entries: "OrderedDict[Key, _Entry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(market: str, symbol: str, day: dt.date) -> Key:
+        return (market.upper(), symbol, _year_month(day))
+
+    def _is_past_month(self, day: dt.date, now: dt.datetime) -> bool:
+        today = now.date()
+        return (day.year, day.month) < (today.year, today.month)
+
+    def _fresh(self, entry: _Entry, now: dt.datetime) -> bool:
+        if entry.immutable:
+            return True
+        if (now - entry.fetched_at).total_seconds() >= self.ttl_sec:
+            return False
+        # 抓取後若已跨過最近一個交易日的盤後更新時點，視為過期（休市日沒有更新時點）
+        return entry.fetched_at >= last_close_update(now)
+
+    def _path(self, key: Key) -> Optional[Path]:
+        if self.persist_dir is None:
+            return None
+        market, symbol, ym = key
+        return self.persist_dir / market / symbol / f"{ym}.bars"
+
+    def _load_disk(self, key: Key) -> Optional[BarSeries]:
+        path = self._path(key)
+        if path is None or not path.is_file():
+            return None
+        try:
+            return BarSeries.from_bytes(key[0], key[1], path.read_bytes())
+        except Exception:
+            return None
+
+    def _save_disk(self, key: Key, payload: BarSeries) -> None:
+        path = self._path(key)
+        if path is None:
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_bytes(payload.to_bytes())
+            os.replace(tmp, path)
+        except Exception:
+            # 落地失敗不影響記憶體快取
+            pass
+
+    def _store(self, key: Key, entry: _Entry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, market: str, symbol: str, day: dt.date) -> Optional[Any]:
+        key = self.key(market, symbol, day)
+        now = self.clock()
+        entry = self._entries.get(key)
+        if entry is not None and self._fresh(entry, now):
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.payload
+        if entry is None and self._is_past_month(day, now):
+            payload = self._load_disk(key)
+            if payload is not None:
+                self._store(key, _Entry(payload, now, True))
+                self.hits += 1
+                return payload
+        self.misses += 1
+        return None
+
+    def peek(
+        self, market: str, symbol: str, day: dt.date
+    ) -> Optional[Tuple[Any, dt.datetime]]:
+        """不論是否過期，回傳記憶體中的 (payload, 抓取時間)；供 stale-while-revalidate 使用。"""
+        entry = self._entries.get(self.key(market, symbol, day))
+        return (entry.payload, entry.fetched_at) if entry is not None else None
+
+    def put(self, market: str, symbol: str, day: dt.date, payload: Any) -> None:
+        key = self.key(market, symbol, day)
+        now = self.clock()
+        immutable = self._is_past_month(day, now)
+        self._store(key, _Entry(payload, now, immutable))
+        if immutable:
+            self._save_disk(key, payload)
+
+    def items(self) -> Iterator[Tuple[Key, Any, dt.datetime, bool]]:
+        """(鍵, payload, 抓取時間, 是否不可變)，由舊到新；供暖啟動狀態保存。"""
+        for key, e in self._entries.items():
+            yield key, e.payload, e.fetched_at, e.immutable
+
+    def restore(
+        self, key: Key, payload: Any, fetched_at: dt.datetime, immutable: bool
+    ) -> None:
+        """載回先前保存的項目（保留原抓取時間，是否過期仍依一般規則判斷）。"""
+        self._store(key, _Entry(payload, fetched_at, immutable))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+MONTH_CACHE = MonthCache()
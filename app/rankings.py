@@ -1,73 +1,564 @@
 # =========================
 # File: app/rankings.py
+# 說明：全市場排行引擎：MI_INDEX（TWSE data9）與 TPEX 每日收盤行情（aaData）解析為欄式陣列，
+#      以 heapq 部分選取計算前 N 名漲幅/跌幅/成交量
 # =========================
 from __future__ import annotations
-from typing import Any, Dict, List, Optional
-import aiohttp
+from array import array
+from collections import OrderedDict
+import asyncio
+import heapq
+import itertools
+import math
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 import datetime as dt
 
-CACHE: Dict[str, Any] = {}
-CACHE_TTL = 60
+from app.config import env_int
+from app.http_client import get_session, read_json
+from app.resilience import guarded, revalidate
+from app.market_hours import close_update_at, taipei_now
+from app.singleflight import SingleFlight
+from app.symbols import lookup
+from app.trading_calendar import (
+    ensure_loaded,
+    is_trading_day,
+    last_close_update,
+    last_trading_day,
+    next_session_open,
+)
 
+TWSE_MI_INDEX_URL = "https://www.twse.com.tw/exchangeReport/MI_INDEX?response=json&date={date:%Y%m%d}&type=ALLBUT0999"
+TPEX_QUOTES_URL = (
+    "https://www.tpex.org.tw/web/stock/aftertrading/otc_quotes_no1430/"
+    "stk_wn1430_result.php?l=zh-tw&se=EW&d={roc}"
+)
 
-def _filter_items(items: List[Dict[str, Any]], exclude_warrants: bool, exclude_etf: bool) -> List[Dict[str, Any]]:
-    result = []
-    for it in items:
-        sym = it.get("symbol", "")
-        name = it.get("name", "")
-        if exclude_warrants and any(x in name for x in ("購", "售", "牛", "熊")):
-            continue
+# 快取單位為 (市場, 日期) 的整份快照；排行種類/篩選/筆數皆由快照即時推導
+RANKINGS_CACHE_SIZE: int = env_int("RANKINGS_CACHE_SIZE", 16)
+RANKINGS_TTL_SEC: int = env_int("RANKINGS_TTL_SEC", 60)
+RANK_LIMIT_MAX = 50
+_SNAPSHOT_FLIGHT = SingleFlight("rankings.snapshot")
+
+NAN = float("nan")
+# 每份解析出的快照有唯一版本號；排行 payload 以此組成 version，供 embed 渲染快取使用
+_SNAPSHOT_VERSIONS = itertools.count(1)
+
+# 欄位名稱 → 欄位角色；不同來源/版本的標題不盡相同
+_FIELD_ALIASES: Dict[str, Tuple[str, ...]] = {
+    "symbol": ("證券代號", "代號"),
+    "name": ("證券名稱", "名稱"),
+    "close": ("收盤價", "收盤"),
+    "change": ("漲跌價差", "漲跌"),
+    "sign": ("漲跌(+/-)",),
+    "change_pct": ("漲跌幅",),
+    "volume": ("成交股數",),
+    "value": ("成交金額", "成交金額(元)"),
+    "open": ("開盤價", "開盤"),
+    "high": ("最高價", "最高"),
+    "low": ("最低價", "最低"),
+    "transactions": ("成交筆數",),
+}
+# 日線欄位（盤後整批匯入用）；舊版表格可能沒有，缺少時不影響排行
+_OHLC_ROLES = ("open", "high", "low", "transactions")
+
+# 無 fields 標題時的預設欄位位置
+_DEFAULT_COLUMNS: Dict[str, Dict[str, int]] = {
+    # MI_INDEX data9：代號, 名稱, 成交股數, 成交筆數, 成交金額, 開, 高, 低, 收, 漲跌(+/-), 漲跌價差, ...
+    "TWSE": {
+        "symbol": 0,
+        "name": 1,
+        "volume": 2,
+        "transactions": 3,
+        "value": 4,
+        "open": 5,
+        "high": 6,
+        "low": 7,
+        "close": 8,
+        "sign": 9,
+        "change": 10,
+    },
+    # TPEX 收盤行情：代號, 名稱, 收盤, 漲跌, 開, 高, 低, 均價, 成交股數, 成交金額, 成交筆數, ...
+    "TPEX": {
+        "symbol": 0,
+        "name": 1,
+        "close": 2,
+        "change": 3,
+        "open": 4,
+        "high": 5,
+        "low": 6,
+        "volume": 8,
+        "value": 9,
+        "transactions": 10,
+    },
+}
+
+_TAG_RE = re.compile(r"<[^>]*>")
+_WARRANT_RE = re.compile("[購售牛熊]")
+
+
+def _num(x: Any) -> float:
+    try:
+        # 快速路徑：絕大多數欄位為 "1,234.50" / "+1.11%"
+        return float(x.replace(",", "").rstrip("%"))
+    except (AttributeError, ValueError):
+        pass
+    if isinstance(x, (int, float)):
+        return float(x)
+    s = str(x).replace(",", "").replace("%", "").strip()
+    if s[:1] == "X":
+        # 除權息標記，例如 X0.00
+        s = s[1:]
+    try:
+        return float(s)
+    except ValueError:
+        return NAN
+
+
+def _column_index(fields: Sequence[str], market: str) -> Dict[str, int]:
+    if not fields:
+        return dict(_DEFAULT_COLUMNS[market])
+    pos = {str(f).strip(): i for i, f in enumerate(fields)}
+    cols: Dict[str, int] = {}
+    for role, names in _FIELD_ALIASES.items():
+        for n in names:
+            if n in pos:
+                cols[role] = pos[n]
+                break
+    return cols
+
+
+# _select_table 只讀這些頂層鍵；其餘表格（指數、類股等）解碼後即丟棄
+MI_INDEX_KEYS = ("stat", "date", "fields9", "data9", "tables")
+TPEX_QUOTES_KEYS = ("reportDate", "fields", "aaData", "tables")
+
+
+def _select_table(
+    payload: Dict[str, Any], market: str
+) -> Tuple[Sequence[str], List[List[Any]]]:
+    """找出個股行情表：舊版為 data9 / aaData，新版為 tables[] 中含代號與收盤欄位者。"""
+    if market == "TWSE" and payload.get("data9") is not None:
+        return payload.get("fields9") or [], payload.get("data9") or []
+    if market == "TPEX" and payload.get("aaData") is not None:
+        return payload.get("fields") or [], payload.get("aaData") or []
+    best: Tuple[Sequence[str], List[List[Any]]] = ([], [])
+    for table in payload.get("tables") or []:
+        fields = table.get("fields") or []
+        cols = _column_index(fields, market)
+        rows = table.get("data") or []
+        if "symbol" in cols and "close" in cols and len(rows) > len(best[1]):
+            best = (fields, rows)
+    return best
+
+
+class Snapshot:
+    """
+    單一市場單日全市場行情，欄式儲存（數值欄為 array('d')，缺值為 NaN）。
+    除排行欄位外也保留開高低與成交筆數，盤後資料可直接回答任一代號當日的日線。
+    """
+
+    COLUMNS = (
+        "close",
+        "change",
+        "change_pct",
+        "volume",
+        "value",
+        "open",
+        "high",
+        "low",
+        "transactions",
+    )
+
+    __slots__ = (
+        "market",
+        "date",
+        "symbols",
+        "names",
+        "version",
+        "_candidates",
+        "_items",
+        "_index",
+    ) + COLUMNS
+
+    def __init__(self, market: str, date: dt.date):
+        self.market = market
+        self.date = date
+        self.symbols: List[str] = []
+        self.names: List[str] = []
+        self.close = array("d")
+        self.change = array("d")
+        self.change_pct = array("d")
+        self.volume = array("d")
+        self.value = array("d")
+        self.open = array("d")
+        self.high = array("d")
+        self.low = array("d")
+        self.transactions = array("d")
+        self.version = next(_SNAPSHOT_VERSIONS)
+        self._candidates: Dict[Tuple[bool, bool], List[int]] = {}
+        self._items: Dict[int, Dict[str, Any]] = {}
+        self._index: Optional[Dict[str, int]] = None
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    @classmethod
+    def parse(cls, payload: Dict[str, Any], market: str, date: dt.date) -> "Snapshot":
+        snap = cls(market, date)
+        fields, rows = _select_table(payload or {}, market)
+        cols = _column_index(fields, market)
+        if "symbol" not in cols or "close" not in cols:
+            return snap
+        i_sym, i_name, i_close = cols["symbol"], cols.get("name"), cols["close"]
+        i_chg, i_sign, i_pct = (
+            cols.get("change"),
+            cols.get("sign"),
+            cols.get("change_pct"),
+        )
+        i_vol, i_val = cols.get("volume"), cols.get("value")
+        width = max(v for k, v in cols.items() if k not in _OHLC_ROLES) + 1
+        rows = [r for r in rows if r and len(r) >= width]
+        n = len(rows)
+
+        # 逐欄以 comprehension 建立陣列，避免逐列 append 的直譯器開銷
+        snap.symbols = [str(r[i_sym]).strip() for r in rows]
+        snap.names = (
+            [str(r[i_name]).strip() for r in rows] if i_name is not None else [""] * n
+        )
+        close = [_num(r[i_close]) for r in rows]
+        change = [_num(r[i_chg]) for r in rows] if i_chg is not None else [NAN] * n
+        if i_sign is not None:
+            # MI_INDEX 的漲跌價差不帶正負號，符號另以 HTML 標示
+            for k, r in enumerate(rows):
+                if "-" in _TAG_RE.sub("", str(r[i_sign])):
+                    change[k] = -abs(change[k])
+        if i_pct is not None:
+            change_pct = [_num(r[i_pct]) for r in rows]
+        else:
+            change_pct = [
+                chg / (c - chg) * 100.0 if c - chg > 0 else NAN
+                for c, chg in zip(close, change)
+            ]
+        snap.close = array("d", close)
+        snap.change = array("d", change)
+        snap.change_pct = array("d", change_pct)
+        snap.volume = array(
+            "d", [_num(r[i_vol]) for r in rows] if i_vol is not None else [NAN] * n
+        )
+        snap.value = array(
+            "d", [_num(r[i_val]) for r in rows] if i_val is not None else [NAN] * n
+        )
+        for role in _OHLC_ROLES:
+            i = cols.get(role)
+            if i is not None:
+                setattr(
+                    snap,
+                    role,
+                    array("d", [_num(r[i]) if i < len(r) else NAN for r in rows]),
+                )
+            else:
+                setattr(snap, role, array("d", [NAN]) * n)
+        return snap
+
+    def index_of(self, symbol: str) -> int:
+        """代號所在列；不存在回傳 -1（索引於第一次查詢時建立）。"""
+        if self._index is None:
+            self._index = {s: i for i, s in enumerate(self.symbols)}
+        return self._index.get(symbol, -1)
+
+    def record(self, i: int) -> Dict[str, Optional[float]]:
+        """與 BarSeries.record 相同欄位的單日日線（成交金額對應 turnover）。"""
+        out: Dict[str, Optional[float]] = {}
+        for field, col in (
+            ("open", self.open),
+            ("high", self.high),
+            ("low", self.low),
+            ("close", self.close),
+            ("change", self.change),
+            ("volume", self.volume),
+            ("turnover", self.value),
+            ("transactions", self.transactions),
+        ):
+            v = col[i]
+            out[field] = None if v != v else v
+        return out
+
+    def _excluded(self, i: int, exclude_warrants: bool, exclude_etf: bool) -> bool:
+        sym, name = self.symbols[i], self.names[i]
+        info = lookup(sym)
+        if info is not None:
+            # 代號目錄有證券類別時以其為準
+            return (exclude_warrants and info.is_warrant) or (
+                exclude_etf and info.is_etf
+            )
+        if exclude_warrants and _WARRANT_RE.search(name):
+            return True
         if exclude_etf and ("ETF" in name or sym.startswith("00")):
-            continue
-        result.append(it)
-    return result
+            return True
+        return False
 
+    def candidates(self, exclude_warrants: bool, exclude_etf: bool) -> List[int]:
+        """通過篩選且有收盤價的列索引（依篩選組合快取）。"""
+        key = (exclude_warrants, exclude_etf)
+        idx = self._candidates.get(key)
+        if idx is None:
+            close = self.close
+            if exclude_warrants or exclude_etf:
+                idx = [
+                    i
+                    for i in range(len(self.symbols))
+                    if close[i] == close[i]
+                    and not self._excluded(i, exclude_warrants, exclude_etf)
+                ]
+            else:
+                idx = [i for i in range(len(self.symbols)) if close[i] == close[i]]
+            self._candidates[key] = idx
+        return idx
 
-async def _fetch_market_data(market: str) -> List[Dict[str, Any]]:
-    # 假 API 範例，實際要改為 TWSE/TPEX 即時排行 API
-    url = f"https://example.com/{market}/rankings"
-    async with aiohttp.ClientSession() as sess:
-        async with sess.get(url) as resp:
-            return await resp.json()
+    def item(self, i: int) -> Dict[str, Any]:
+        """
+        單列資料（依索引快取，與快照同生命週期；呼叫端不應修改）。
+        display 為 formatting 依顯示模式填入的 (標題, 明細) 文字快取，熱門名次不必每次重新格式化。
+        """
+        it = self._items.get(i)
+        if it is not None:
+            return it
 
+        def _opt(v: float) -> Optional[float]:
+            return None if math.isnan(v) else v
 
-async def _get_rank(
+        it = self._items[i] = {
+            "market": self.market,
+            "symbol": self.symbols[i],
+            "name": self.names[i],
+            "close": self.close[i],
+            "change": _opt(self.change[i]),
+            "change_pct": _opt(self.change_pct[i]),
+            "volume": _opt(self.volume[i]),
+            "value": _opt(self.value[i]),
+            "display": {},
+        }
+        return it
+
+
+def top_n(
+    snapshots: Iterable[Snapshot],
     rank_type: str,
-    market: str,
     limit: int,
     exclude_warrants: bool,
     exclude_etf: bool,
+) -> List[Dict[str, Any]]:
+    """跨市場以 heapq 部分選取前 N 名（O(n log N)），不對整個市場排序。"""
+    sign = -1.0 if rank_type == "losers" else 1.0
+    scored: List[Tuple[float, int, Snapshot]] = []
+    for snap in snapshots:
+        col = snap.volume if rank_type == "actives" else snap.change_pct
+        scored.extend(
+            (sign * col[i], i, snap)
+            for i in snap.candidates(exclude_warrants, exclude_etf)
+            if col[i] == col[i]  # 排除 NaN
+        )
+    best = heapq.nlargest(limit, scored, key=lambda e: e[0])
+    return [snap.item(i) for _, i, snap in best]
+
+
+async def _fetch_twse_mi_index(date: dt.date) -> Dict[str, Any]:
+    url = TWSE_MI_INDEX_URL.format(date=date)
+    sess = await get_session()
+
+    async def _get() -> Dict[str, Any]:
+        async with sess.get(url) as resp:
+            if resp.status != 200:
+                raise RuntimeError(f"TWSE MI_INDEX HTTP {resp.status}")
+            return await read_json(resp, keep=MI_INDEX_KEYS)
+
+    return await guarded(url, _get)
+
+
+async def _fetch_tpex_quotes(date: dt.date) -> Dict[str, Any]:
+    roc = f"{date.year - 1911:03d}/{date.month:02d}/{date.day:02d}"
+    url = TPEX_QUOTES_URL.format(roc=roc)
+    sess = await get_session()
+
+    async def _get() -> Dict[str, Any]:
+        async with sess.get(url) as resp:
+            if resp.status != 200:
+                raise RuntimeError(f"TPEX quotes HTTP {resp.status}")
+            return await read_json(resp, keep=TPEX_QUOTES_KEYS)
+
+    return await guarded(url, _get)
+
+
+async def _load_snapshot(market: str, date: dt.date) -> Snapshot:
+    if market == "TWSE":
+        payload = await _fetch_twse_mi_index(date)
+    else:
+        payload = await _fetch_tpex_quotes(date)
+    return Snapshot.parse(payload, market, date)
+
+
+_SnapKey = Tuple[str, dt.date]
+_SnapEntry = Tuple[dt.datetime, dt.datetime, Snapshot]
+
+
+class SnapshotCache:
+    """(市場, 日期) → Snapshot 的 LRU 快取；到期時間依盤中/盤後決定。"""
+
+    def __init__(
+        self, max_entries: int = RANKINGS_CACHE_SIZE, ttl_sec: int = RANKINGS_TTL_SEC
+    ):
+        self.max_entries = max(1, max_entries)
+        self.ttl_sec = ttl_sec
+        # (市場, 日期) → (到期時間, 抓取時間, Snapshot)
+        self._entries: "OrderedDict[_SnapKey, _SnapEntry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def expires_at(self, snap: Snapshot, now: dt.datetime) -> dt.datetime:
+        short = now + dt.timedelta(seconds=self.ttl_sec)
+        if snap.date < now.date():
+            # 過去的日期（含休市日）不會再變動
+            return dt.datetime.max.replace(tzinfo=now.tzinfo)
+        if not is_trading_day(snap.date):
+            # 休市日（空表）：下一個交易時段開盤前都不會有資料
+            return max(short, next_session_open(now))
+        if not len(snap) or now < close_update_at(now.date()):
+            # 盤中或盤後資料尚未公布：短 TTL
+            return short
+        # 當日盤後資料已定稿：保留至下一個交易時段開盤
+        return max(short, next_session_open(now))
+
+    def get(self, market: str, date: dt.date, now: dt.datetime) -> Optional[Snapshot]:
+        entry = self._entries.get((market, date))
+        if entry is not None and now < entry[0]:
+            self._entries.move_to_end((market, date))
+            self.hits += 1
+            return entry[2]
+        self.misses += 1
+        return None
+
+    def peek(
+        self, market: str, date: dt.date
+    ) -> Optional[Tuple[Snapshot, dt.datetime]]:
+        """不論是否過期，回傳 (Snapshot, 抓取時間)；供 stale-while-revalidate 使用。"""
+        entry = self._entries.get((market, date))
+        return (entry[2], entry[1]) if entry is not None else None
+
+    def put(self, snap: Snapshot, now: dt.datetime) -> None:
+        key = (snap.market, snap.date)
+        self._entries[key] = (self.expires_at(snap, now), now, snap)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def items(self) -> List[Tuple[dt.datetime, dt.datetime, Snapshot]]:
+        """(到期時間, 抓取時間, Snapshot)，由舊到新；供暖啟動狀態保存。"""
+        return list(self._entries.values())
+
+    def restore(
+        self, snap: Snapshot, expires: dt.datetime, fetched_at: dt.datetime
+    ) -> None:
+        key = (snap.market, snap.date)
+        self._entries[key] = (expires, fetched_at, snap)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def final(self, market: str, date: dt.date) -> Optional[Snapshot]:
+        """
+        已定稿的當日全市場資料：盤後更新時點之後抓取且非空；不計入命中率、不影響 LRU 順序。
+        供 fetch_daily 等以記憶體回答單一代號日線。
+        """
+        entry = self._entries.get((market, date))
+        if entry is None:
+            return None
+        _, fetched_at, snap = entry
+        if not len(snap) or fetched_at < close_update_at(date):
+            return None
+        return snap
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+SNAPSHOTS = SnapshotCache()
+
+
+async def _snapshot(
+    market: str, date: dt.date
+) -> Tuple[Snapshot, Optional[dt.datetime]]:
+    """回傳 (Snapshot, 過期資料的抓取時間或 None)。"""
+    snap = SNAPSHOTS.get(market, date, taipei_now())
+    if snap is not None:
+        return snap, None
+
+    async def _load() -> Snapshot:
+        loaded = await _load_snapshot(market, date)
+        SNAPSHOTS.put(loaded, taipei_now())
+        return loaded
+
+    # 快取未命中時，並發請求共用同一次抓取
+    last = SNAPSHOTS.peek(market, date)
+    if last is None:
+        return await _SNAPSHOT_FLIGHT.do((market, date), _load), None
+    # 已過期：上游慢或故障時先回上一份快照
+    snap, stale = await revalidate(_SNAPSHOT_FLIGHT, (market, date), _load, last[0])
+    return snap, (last[1] if stale else None)
+
+
+async def get_snapshot(market: str, date: dt.date) -> Snapshot:
+    return (await _snapshot(market, date))[0]
+
+
+async def _get_rank(
+    rank_type: str,
+    market: str = "TWSE",
+    limit: Optional[int] = 10,
+    exclude_warrants: bool = True,
+    exclude_etf: bool = True,
+    date: Optional[dt.date] = None,
 ) -> Dict[str, Any]:
-    key = f"{rank_type}:{market}:{exclude_warrants}:{exclude_etf}"
-    now = dt.datetime.now().timestamp()
-    if key in CACHE and now - CACHE[key]["time"] < CACHE_TTL:
-        return CACHE[key]["data"]
+    market = (market or "TWSE").upper()
+    limit = max(1, min(int(limit or 10), RANK_LIMIT_MAX))
+    markets = ["TWSE", "TPEX"] if market == "ALL" else [market]
+
+    async def _load_all(day: dt.date) -> List[Tuple[Snapshot, Optional[dt.datetime]]]:
+        # ALL 時兩個市場同時抓取
+        return list(await asyncio.gather(*(_snapshot(m, day) for m in markets)))
 
-    if market == "ALL":
-        markets = ["TWSE", "TPEX"]
+    if date is not None:
+        loaded = await _load_all(date)
     else:
-        markets = [market]
-
-    all_items = []
-    for m in markets:
-        items = await _fetch_market_data(m)
-        items = _filter_items(items, exclude_warrants, exclude_etf)
-        all_items.extend(items)
-
-    if rank_type == "gainers":
-        all_items.sort(key=lambda x: x.get("change_pct", 0), reverse=True)
-    elif rank_type == "losers":
-        all_items.sort(key=lambda x: x.get("change_pct", 0))
-    elif rank_type == "actives":
-        all_items.sort(key=lambda x: x.get("volume", 0), reverse=True)
-
-    result = {
-        "date": dt.date.today().isoformat(),
-        "items": all_items[:limit],
-        "source": "TWSE/TPEX",
+        # 未指定日期：最近一個已過盤後更新時點的交易日（週末、休市日、盤中不打當日空表）
+        await ensure_loaded()
+        date = last_close_update(taipei_now()).date()
+        loaded = await _load_all(date)
+        if not all(len(snap) for snap, _ in loaded):
+            # 當日資料晚於預定時點公布：改用前一個交易日
+            date = last_trading_day(date - dt.timedelta(days=1))
+            loaded = await _load_all(date)
+    snapshots = [snap for snap, _ in loaded]
+    stale = [since for _, since in loaded if since is not None]
+    payload: Dict[str, Any] = {
+        "date": date.isoformat(),
+        "items": top_n(snapshots, rank_type, limit, exclude_warrants, exclude_etf),
+        "source": "TWSE/TPEX" if market == "ALL" else market,
     }
-    CACHE[key] = {"time": now, "data": result}
-    return result
+    if stale:
+        payload["stale_since"] = min(stale).isoformat()
+    # 相同快照 + 相同參數 → 相同內容；formatting 以此重用已渲染的 embed
+    payload["version"] = (
+        rank_type,
+        market,
+        limit,
+        exclude_warrants,
+        exclude_etf,
+        tuple(s.version for s in snapshots),
+        payload.get("stale_since"),
+    )
+    return payload
 
 
 async def top_gainers(**kwargs) -> Dict[str, Any]:
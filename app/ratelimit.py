@@ -0,0 +1,222 @@
+# =========================
+# File: app/ratelimit.py
+# 說明：上游每主機 token bucket 限速（所有 client 共用），等待者以優先序排隊：
+#      使用者指令（INTERACTIVE）先於背景回補/輪詢（BACKGROUND）；優先序以 contextvar 隨 task 傳遞。
+#      並統計排隊延遲，供調整 bucket 大小。
+# =========================
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from app.config import env_float
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# 未標記的工作（啟動預熱、回補、輪詢）視為背景；指令處理時由 bot 標為 INTERACTIVE
+_PRIORITY: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "request_priority", default=BACKGROUND
+)
+
+RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "1").strip().lower() not in {
+    "0",
+    "false",
+    "no",
+}
+# 未列出的主機：每秒 RATE_LIMIT_DEFAULT_RPS 次、最多連發 RATE_LIMIT_DEFAULT_BURST 次
+RATE_LIMIT_DEFAULT_RPS: float = env_float("RATE_LIMIT_DEFAULT_RPS", 1.0)
+RATE_LIMIT_DEFAULT_BURST: float = env_float("RATE_LIMIT_DEFAULT_BURST", 3.0)
+# TWSE 約每 5 秒 3 次即可能封鎖 IP；格式 host=rps/burst,host=rps/burst
+RATE_LIMITS: str = os.getenv(
+    "RATE_LIMITS",
+    "www.twse.com.tw=0.5/2,mis.twse.com.tw=1/3,www.tpex.org.tw=1/3,isin.twse.com.tw=0.5/2",
+)
+
+
+def _parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    out: Dict[str, Tuple[float, float]] = {}
+    for part in spec.split(","):
+        host, _, value = part.strip().partition("=")
+        if not host or not value:
+            continue
+        rps, _, burst = value.partition("/")
+        try:
+            out[host.strip().lower()] = (
+                float(rps),
+                float(burst or RATE_LIMIT_DEFAULT_BURST),
+            )
+        except ValueError:
+            continue
+    return out
+
+
+def current_priority() -> int:
+    return _PRIORITY.get()
+
+
+def set_priority(level: int) -> None:
+    """標記目前 task（及其後建立的子 task）的請求優先序。"""
+    _PRIORITY.set(level)
+
+
+@contextlib.contextmanager
+def priority(level: int) -> Iterator[None]:
+    """區塊內暫時改用指定優先序，離開時還原（適合在被直接 await 的函式內使用）。"""
+    token = _PRIORITY.set(level)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+class _DelayStats:
+    __slots__ = ("count", "delayed", "total_sec", "max_sec")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.delayed = 0
+        self.total_sec = 0.0
+        self.max_sec = 0.0
+
+    def add(self, sec: float) -> None:
+        self.count += 1
+        if sec > 0:
+            self.delayed += 1
+            self.total_sec += sec
+            self.max_sec = max(self.max_sec, sec)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "delayed": self.delayed,
+            "avg_delay_ms": (
+                round(self.total_sec / self.count * 1000, 1) if self.count else 0.0
+            ),
+            "max_delay_ms": round(self.max_sec * 1000, 1),
+        }
+
+
+class HostBucket:
+    """單一主機的 token bucket；取不到 token 的請求依 (優先序, 到達順序) 排隊。"""
+
+    def __init__(self, host: str, rate: float, burst: float):
+        self.host = host
+        self.rate = max(0.01, rate)
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.delays: Dict[int, _DelayStats] = {p: _DelayStats() for p in PRIORITY_NAMES}
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        # 等待中的 future 綁定建立時的 event loop；換 loop（如測試）時清掉舊佇列
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = []
+            self._pump = None
+
+    async def acquire(self, level: int) -> float:
+        """取得一個 token；回傳排隊秒數。"""
+        loop = asyncio.get_running_loop()
+        self._bind(loop)
+        self._refill()
+        if not self._queue and self._tokens >= 1.0:
+            self._tokens -= 1.0
+            self.delays.setdefault(level, _DelayStats()).add(0.0)
+            return 0.0
+        start = loop.time()
+        fut: asyncio.Future = loop.create_future()
+        heapq.heappush(self._queue, (level, next(self._seq), fut))
+        if self._pump is None or self._pump.done():
+            self._pump = loop.create_task(self._run())
+        await fut
+        waited = loop.time() - start
+        self.delays.setdefault(level, _DelayStats()).add(waited)
+        return waited
+
+    async def _run(self) -> None:
+        while self._queue:
+            self._refill()
+            if self._tokens < 1.0:
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+                continue
+            _, _, fut = heapq.heappop(self._queue)
+            if fut.done():
+                # 等待者已取消：不消耗 token
+                continue
+            self._tokens -= 1.0
+            fut.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "tokens": round(self._tokens, 2),
+            "queued": sum(1 for *_, f in self._queue if not f.done()),
+            **{
+                PRIORITY_NAMES.get(p, str(p)): d.as_dict()
+                for p, d in self.delays.items()
+            },
+        }
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Tuple[float, float]]] = None,
+        default: Tuple[float, float] = (
+            RATE_LIMIT_DEFAULT_RPS,
+            RATE_LIMIT_DEFAULT_BURST,
+        ),
+        enabled: bool = True,
+    ):
+        self.limits = dict(limits or {})
+        self.default = default
+        self.enabled = enabled
+        self._buckets: Dict[str, HostBucket] = {}
+
+    def bucket(self, host: str) -> HostBucket:
+        host = host.lower()
+        b = self._buckets.get(host)
+        if b is None:
+            rate, burst = self.limits.get(host, self.default)
+            b = self._buckets[host] = HostBucket(host, rate, burst)
+        return b
+
+    async def acquire(self, url: str, level: Optional[int] = None) -> float:
+        """對 url 的主機取 token；未指定優先序時取自 contextvar。回傳排隊秒數。"""
+        if not self.enabled:
+            return 0.0
+        host = urlsplit(url).hostname or ""
+        return await self.bucket(host).acquire(
+            current_priority() if level is None else level
+        )
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {host: b.stats() for host, b in self._buckets.items()}
+
+
+LIMITER = RateLimiter(_parse_limits(RATE_LIMITS), enabled=RATE_LIMIT_ENABLED)
+
+
+async def throttle(url: str) -> float:
+    """所有上游請求發出前呼叫（以 contextvar 的優先序排隊）。"""
+    return await LIMITER.acquire(url)
@@ -0,0 +1,257 @@
+# =========================
+# File: app/realtime.py
+# 說明：MIS 即時報價微批次：短時間窗口內的查詢合併為一次 getStockInfo.jsp（ex_ch 以 | 串接）
+#      以及共用的背景輪詢器：所有等待成交的查詢共用一次批次請求
+# =========================
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.ratelimit import BACKGROUND, set_priority
+
+Channel = Tuple[str, str]  # (市場, 代號)
+Quote = Optional[Dict[str, Any]]
+FetchMany = Callable[[List[Channel]], Awaitable[Dict[Channel, Dict[str, Any]]]]
+
+
+def has_tick(data: Optional[Dict[str, Any]]) -> bool:
+    """
+    判斷 TWSE MIS 回傳是否含有效成交價（欄位名稱可能為 price 或 z），時間欄位寬鬆檢查。
+    """
+    if not data:
+        return False
+    price = data.get("price") or data.get("z")
+    t = data.get("time") or data.get("t") or data.get("ts")
+    try:
+        if price is None:
+            return False
+        s = str(price).strip().replace(",", "")
+        if s in {"", "-", "—", "--", "NaN"}:
+            return False
+        float(s)
+        return True if t is None else (str(t).strip() != "")
+    except Exception:
+        return False
+
+
+class QuoteBatcher:
+    """
+    收集 window_sec 內到達的即時報價請求，一次向上游查詢後分送給各呼叫者。
+    同一頻道的多個呼叫者共用同一筆結果；單批超過 max_batch 個頻道時立即送出。
+    """
+
+    def __init__(
+        self, fetch_many: FetchMany, window_sec: float = 0.075, max_batch: int = 50
+    ):
+        self.fetch_many = fetch_many
+        self.window_sec = max(0.0, window_sec)
+        self.max_batch = max(1, max_batch)
+        self._pending: Dict[Channel, List[asyncio.Future]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+        self.requests = 0
+        self.batches = 0
+
+    async def get(self, market: str, symbol: str) -> Quote:
+        loop = asyncio.get_running_loop()
+        fut: asyncio.Future = loop.create_future()
+        self._pending.setdefault((market, symbol), []).append(fut)
+        self.requests += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_sec, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: Dict[Channel, List[asyncio.Future]]) -> None:
+        self.batches += 1
+        results: Dict[Channel, Dict[str, Any]] = {}
+        try:
+            results = await self.fetch_many(list(batch))
+        except Exception:
+            # 與單筆查詢一致：上游失敗視為無資料
+            pass
+        finally:
+            for channel, futs in batch.items():
+                quote = results.get(channel)
+                for fut in futs:
+                    if not fut.done():
+                        fut.set_result(quote)
+
+
+class _Waiter:
+    __slots__ = ("future", "interval_sec")
+
+    def __init__(self, future: asyncio.Future, interval_sec: float):
+        self.future = future
+        self.interval_sec = interval_sec
+
+
+class Subscription:
+    """持續訂閱單一頻道；只保留最新一筆報價（讀取前的多筆更新會合併）。"""
+
+    def __init__(self, poller: "RealtimePoller", channel: Channel, interval_sec: float):
+        self.poller = poller
+        self.channel = channel
+        self.interval_sec = interval_sec
+        self.latest: Quote = None
+        self._event = asyncio.Event()
+        self.closed = False
+
+    def _push(self, quote: Quote) -> None:
+        self.latest = quote
+        self._event.set()
+
+    async def next(self, timeout: Optional[float] = None) -> Quote:
+        """等待下一筆更新並回傳最新值；逾時回傳 None。"""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._event.clear()
+        return self.latest
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.poller._unsubscribe(self)
+
+
+class RealtimePoller:
+    """
+    共用背景輪詢：查詢者登記想要的頻道並等待下一筆有效成交，或持續訂閱；
+    每個間隔只對「仍有人等待/訂閱」的頻道發一次批次請求，無人需要時停止輪詢。
+    頻道超過 max_batch 個時分成多個請求並行送出（避免網址過長被上游拒絕）。
+    間隔取目前需求中的最小值（不低於 min_interval_sec）。
+    """
+
+    def __init__(
+        self,
+        fetch_many: FetchMany,
+        interval_sec: float = 15.0,
+        min_interval_sec: float = 2.0,
+        predicate: Callable[[Quote], bool] = has_tick,
+        max_batch: int = 50,
+    ):
+        self.fetch_many = fetch_many
+        self.max_batch = max(1, max_batch)
+        self.interval_sec = interval_sec
+        self.min_interval_sec = min_interval_sec
+        self.predicate = predicate
+        self._waiters: Dict[Channel, List[_Waiter]] = {}
+        self._subs: Dict[Channel, List[Subscription]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.polls = 0
+
+    def wanted(self) -> List[Channel]:
+        return list(dict.fromkeys([*self._waiters, *self._subs]))
+
+    def subscribe(
+        self, market: str, symbol: str, interval_sec: Optional[float] = None
+    ) -> Subscription:
+        """訂閱頻道的每一筆有效報價；用畢須呼叫 Subscription.close()。"""
+        interval = max(self.min_interval_sec, interval_sec or self.interval_sec)
+        sub = Subscription(self, (market, symbol), interval)
+        self._subs.setdefault(sub.channel, []).append(sub)
+        self._ensure_running(asyncio.get_running_loop())
+        return sub
+
+    def _unsubscribe(self, sub: Subscription) -> None:
+        subs = self._subs.get(sub.channel)
+        if subs and sub in subs:
+            subs.remove(sub)
+        if subs is not None and not subs:
+            del self._subs[sub.channel]
+
+    async def wait_tick(
+        self,
+        market: str,
+        symbol: str,
+        timeout: float,
+        interval_sec: Optional[float] = None,
+    ) -> Quote:
+        """等待該頻道下一筆有效成交；逾時回傳 None。"""
+        loop = asyncio.get_running_loop()
+        interval = max(self.min_interval_sec, interval_sec or self.interval_sec)
+        waiter = _Waiter(loop.create_future(), interval)
+        channel = (market, symbol)
+        self._waiters.setdefault(channel, []).append(waiter)
+        self._ensure_running(loop)
+        try:
+            return await asyncio.wait_for(waiter.future, timeout=max(0.0, timeout))
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._unregister(channel, waiter)
+
+    def _unregister(self, channel: Channel, waiter: _Waiter) -> None:
+        waiters = self._waiters.get(channel)
+        if not waiters:
+            return
+        if waiter in waiters:
+            waiters.remove(waiter)
+        if not waiters:
+            del self._waiters[channel]
+
+    def _ensure_running(self, loop: asyncio.AbstractEventLoop) -> None:
+        if (
+            self._task is not None
+            and not self._task.done()
+            and self._task.get_loop() is loop
+        ):
+            return
+        self._task = loop.create_task(self._run())
+
+    def _next_interval(self) -> float:
+        intervals = [w.interval_sec for ws in self._waiters.values() for w in ws]
+        intervals += [sub.interval_sec for subs in self._subs.values() for sub in subs]
+        return min(intervals) if intervals else self.interval_sec
+
+    async def _fetch_chunked(
+        self, channels: List[Channel]
+    ) -> Dict[Channel, Dict[str, Any]]:
+        """每 max_batch 個頻道一個請求並行送出；失敗的批次只影響該批頻道。"""
+        chunks = [
+            channels[i : i + self.max_batch]
+            for i in range(0, len(channels), self.max_batch)
+        ]
+        results = await asyncio.gather(
+            *(self.fetch_many(c) for c in chunks), return_exceptions=True
+        )
+        quotes: Dict[Channel, Dict[str, Any]] = {}
+        for result in results:
+            if isinstance(result, dict):
+                quotes.update(result)
+        return quotes
+
+    async def _run(self) -> None:
+        # 輪詢 task 可能由指令觸發而繼承 INTERACTIVE；固定以背景優先序排隊
+        set_priority(BACKGROUND)
+        while self._waiters or self._subs:
+            channels = self.wanted()
+            self.polls += 1
+            quotes = await self._fetch_chunked(channels)
+            for channel in channels:
+                quote = quotes.get(channel)
+                if not self.predicate(quote):
+                    continue
+                for waiter in self._waiters.pop(channel, []):
+                    if not waiter.future.done():
+                        waiter.future.set_result(quote)
+                for sub in self._subs.get(channel, []):
+                    sub._push(quote)
+            if not (self._waiters or self._subs):
+                break
+            await asyncio.sleep(self._next_interval())
@@ -0,0 +1,171 @@
+# =========================
+# File: app/resilience.py
+# 說明：上游容錯：每主機斷路器（連續失敗即短路，冷卻後放行一個試探請求）
+#      以及 stale-while-revalidate：快取過期時背景更新，上游慢或故障時先回上一份好資料並標記為過期
+# =========================
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+from urllib.parse import urlsplit
+
+from app import metrics
+from app.config import env_float, env_int
+from app.ratelimit import throttle
+from app.singleflight import SingleFlight
+
+T = TypeVar("T")
+
+# 連續失敗幾次後斷路、斷路多久後放行試探請求
+BREAKER_FAILURES: int = env_int("BREAKER_FAILURES", 5)
+BREAKER_RESET_SEC: float = env_float("BREAKER_RESET_SEC", 30.0)
+# 有舊資料時最多等更新幾秒；逾時先回舊資料，更新在背景繼續（0 = 一律先回舊資料）
+SWR_WAIT_SEC: float = env_float("SWR_WAIT_SEC", 2.0)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """斷路中：不打上游直接失敗。"""
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        host: str,
+        threshold: int = BREAKER_FAILURES,
+        reset_sec: float = BREAKER_RESET_SEC,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.host = host
+        self.threshold = max(1, threshold)
+        self.reset_sec = reset_sec
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self.short_circuited = 0
+
+    def before(self) -> None:
+        """請求前檢查；斷路中（或試探請求進行中）拋出 CircuitOpenError。"""
+        if self.state == CLOSED:
+            return
+        if self.state == OPEN and self.clock() - self.opened_at >= self.reset_sec:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self._trial:
+            self._trial = True
+            return
+        self.short_circuited += 1
+        raise CircuitOpenError(f"{self.host} 暫時無法連線，請稍後再試")
+
+    def success(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self._trial = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            self.state = OPEN
+            self.opened_at = self.clock()
+        self._trial = False
+
+    def abandon(self) -> None:
+        # 試探請求被取消：不算成功也不算失敗
+        self._trial = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "short_circuited": self.short_circuited,
+        }
+
+
+BREAKERS: Dict[str, CircuitBreaker] = {}
+
+
+def breaker_for(url: str) -> CircuitBreaker:
+    host = (urlsplit(url).hostname or "").lower()
+    b = BREAKERS.get(host)
+    if b is None:
+        b = BREAKERS[host] = CircuitBreaker(host)
+    return b
+
+
+async def guarded(url: str, fn: Callable[[], Awaitable[T]]) -> T:
+    """
+    上游請求包裝：先過斷路器（斷路時立即失敗，不進限速佇列），再取限速 token，
+    fn 拋出的任何例外都計為該主機的一次失敗。
+    """
+    breaker = breaker_for(url)
+    parts = urlsplit(url)
+    try:
+        breaker.before()
+    except CircuitOpenError as e:
+        metrics.observe_upstream(breaker.host, parts.path, None, e)
+        raise
+    start = 0.0
+    try:
+        await throttle(url)
+        start = time.perf_counter()
+        result = await fn()
+    except asyncio.CancelledError:
+        breaker.abandon()
+        raise
+    except Exception as e:
+        breaker.failure()
+        metrics.observe_upstream(
+            breaker.host, parts.path, time.perf_counter() - start if start else None, e
+        )
+        raise
+    breaker.success()
+    metrics.observe_upstream(breaker.host, parts.path, time.perf_counter() - start)
+    return result
+
+
+_REFRESHES: Set[asyncio.Future] = set()
+
+
+def _retrieve(fut: asyncio.Future) -> None:
+    _REFRESHES.discard(fut)
+    if not fut.cancelled():
+        fut.exception()
+
+
+async def revalidate(
+    flight: SingleFlight,
+    key: Hashable,
+    fn: Callable[[], Awaitable[T]],
+    stale: T,
+    wait_sec: Optional[float] = None,
+) -> Tuple[T, bool]:
+    """
+    已有舊資料時的更新：透過 single-flight 啟動（或加入）更新，最多等 wait_sec；
+    更新成功回 (新資料, False)，逾時或失敗（含斷路）回 (舊資料, True)，逾時的更新於背景完成並寫回快取。
+    """
+    wait = SWR_WAIT_SEC if wait_sec is None else max(0.0, wait_sec)
+    task = asyncio.ensure_future(flight.do(key, fn))
+    done, _ = await asyncio.wait({task}, timeout=wait)
+    if done and not task.cancelled() and task.exception() is None:
+        return task.result(), False
+    if not done:
+        _REFRESHES.add(task)
+    task.add_done_callback(_retrieve)
+    return stale, True
+
+
+def breaker_stats() -> Dict[str, Dict[str, Any]]:
+    return {host: b.stats() for host, b in BREAKERS.items()}
@@ -0,0 +1,56 @@
+# =========================
+# File: app/singleflight.py
+# 說明：同鍵並發請求合併（single-flight）：進行中的相同請求共用同一個 future，並統計合併次數
+# =========================
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, List, TypeVar
+
+T = TypeVar("T")
+
+_REGISTRY: List["SingleFlight"] = []
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+        _REGISTRY.append(self)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        key 相同且仍在進行中的呼叫只執行一次 fn，其餘等待同一結果（含例外）。
+        以 shield 保護共用工作：單一呼叫者被取消不會連帶取消其他人。
+        """
+        self.calls += 1
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            return await asyncio.shield(fut)
+
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+
+        def _done(t: asyncio.Future) -> None:
+            if self._inflight.get(key) is t:
+                del self._inflight[key]
+            if not t.cancelled():
+                # 避免無人等待時出現 "exception was never retrieved"
+                t.exception()
+
+        task.add_done_callback(_done)
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
+
+
+def singleflight_stats() -> Dict[str, Dict[str, int]]:
+    return {sf.name: sf.stats() for sf in _REGISTRY}
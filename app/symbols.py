@@ -0,0 +1,227 @@
+# =========================
+# File: app/symbols.py
+# 說明：代號目錄（代號 → 市場/名稱/證券類別），由 TWSE ISIN 上市/上櫃清單建立並每日更新
+#      用於直接路由到正確交易所，並在本地拒絕不存在的代號
+# =========================
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import os
+import time
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import env_int
+from app.http_client import get_session
+from app.resilience import guarded
+from app.market_hours import taipei_now
+
+ISIN_URL = "https://isin.twse.com.tw/isin/C_public.jsp?strMode={mode}"
+# strMode：2 = 上市（TWSE），4 = 上櫃（TPEX）
+ISIN_MODES: Dict[str, int] = {"TWSE": 2, "TPEX": 4}
+ALL_MARKETS: Tuple[str, ...] = ("TWSE", "TPEX")
+
+SYMBOL_DIRECTORY_ENABLED: bool = os.getenv(
+    "SYMBOL_DIRECTORY_ENABLED", "1"
+).strip() not in {"0", "false", "no"}
+# 更新失敗後的重試間隔，避免每次查詢都打 ISIN
+SYMBOL_DIRECTORY_RETRY_SEC: int = env_int("SYMBOL_DIRECTORY_RETRY_SEC", 600)
+
+
+@dataclass(frozen=True)
+class SymbolInfo:
+    symbol: str
+    market: str
+    name: str
+    kind: str  # ISIN 分類標題，例如 股票 / ETF / 上市認購(售)權證
+
+    @property
+    def is_warrant(self) -> bool:
+        return "權證" in self.kind
+
+    @property
+    def is_etf(self) -> bool:
+        return "ETF" in self.kind or "ETN" in self.kind
+
+
+class _IsinTableParser(HTMLParser):
+    """把 ISIN 頁面的 <tr> 拆成儲存格文字列表。"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.rows: List[List[str]] = []
+        self._row: Optional[List[str]] = None
+        self._cell: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self._row = []
+        elif tag == "td" and self._row is not None:
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag == "td" and self._row is not None and self._cell is not None:
+            self._row.append("".join(self._cell).strip())
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def parse_isin_page(html: str, market: str) -> List[SymbolInfo]:
+    parser = _IsinTableParser()
+    parser.feed(html)
+    parser.close()
+    kind = ""
+    out: List[SymbolInfo] = []
+    for row in parser.rows:
+        if len(row) == 1:
+            # 分類標題列，例如「股票」「ETF」
+            kind = row[0].strip()
+            continue
+        if len(row) < 2 or "　" not in row[0]:
+            continue
+        code, _, name = row[0].partition("　")
+        code = code.strip().upper()
+        if code:
+            out.append(
+                SymbolInfo(symbol=code, market=market, name=name.strip(), kind=kind)
+            )
+    return out
+
+
+class SymbolDirectory:
+    def __init__(self) -> None:
+        self._entries: Dict[str, SymbolInfo] = {}
+        self._loaded_on: Optional[dt.date] = None
+        self._last_attempt: float = 0.0
+        self._refreshing: Optional[asyncio.Task] = None
+        # 實際查詢結果學到的路由（目錄無法使用時仍可直達正確市場）
+        self._routes: Dict[str, str] = {}
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, symbol: str) -> Optional[SymbolInfo]:
+        return self._entries.get(symbol.strip().upper())
+
+    def remember(self, symbol: str, market: str) -> None:
+        self._routes[symbol.strip().upper()] = market
+
+    def load(
+        self, infos: List[SymbolInfo], loaded_on: Optional[dt.date] = None
+    ) -> None:
+        self._entries = {it.symbol: it for it in infos}
+        self._loaded_on = loaded_on or taipei_now().date()
+
+    def state(self) -> Dict[str, Any]:
+        """可 JSON 序列化的目錄內容（含學到的路由）；供暖啟動狀態保存。"""
+        return {
+            "loaded_on": self._loaded_on.isoformat() if self._loaded_on else None,
+            "entries": [
+                [it.symbol, it.market, it.name, it.kind]
+                for it in self._entries.values()
+            ],
+            "routes": dict(self._routes),
+        }
+
+    def restore(self, state: Dict[str, Any]) -> None:
+        entries = [SymbolInfo(*row) for row in state.get("entries") or []]
+        if entries and state.get("loaded_on"):
+            self.load(entries, dt.date.fromisoformat(state["loaded_on"]))
+        self._routes.update(state.get("routes") or {})
+
+    async def _fetch_market(self, market: str) -> List[SymbolInfo]:
+        url = ISIN_URL.format(mode=ISIN_MODES[market])
+        sess = await get_session()
+
+        async def _get() -> bytes:
+            async with sess.get(url) as resp:
+                if resp.status != 200:
+                    raise RuntimeError(f"ISIN HTTP {resp.status}")
+                return await resp.read()
+
+        body = await guarded(url, _get)
+        html = body.decode("cp950", errors="replace")
+        # 上市清單含大量權證，解析較重，移出 event loop
+        return await asyncio.to_thread(parse_isin_page, html, market)
+
+    async def refresh(self) -> None:
+        self._last_attempt = time.monotonic()
+        parts = await asyncio.gather(*(self._fetch_market(m) for m in ALL_MARKETS))
+        infos = [it for part in parts for it in part]
+        if infos:
+            self.load(infos)
+
+    def _refresh_done(self, task: asyncio.Task) -> None:
+        if self._refreshing is task:
+            self._refreshing = None
+        if not task.cancelled():
+            task.exception()  # 失敗已由重試間隔處理；取出例外避免 "never retrieved" 警告
+
+    async def ensure_fresh(self) -> None:
+        """
+        每日（台北時間）更新一次；失敗時保留舊資料並延後重試。
+        已有目錄（即使是前一日的）時在背景更新並先沿用舊資料，只有完全沒有資料時才等待。
+        """
+        if self._loaded_on == taipei_now().date():
+            return
+        if self._refreshing is None:
+            if (
+                self._last_attempt
+                and time.monotonic() - self._last_attempt < SYMBOL_DIRECTORY_RETRY_SEC
+            ):
+                return
+            self._refreshing = asyncio.ensure_future(self.refresh())
+            self._refreshing.add_done_callback(self._refresh_done)
+        if self.loaded:
+            return
+        try:
+            await asyncio.shield(self._refreshing)
+        except Exception:
+            pass
+
+    async def markets_for(self, symbol: str) -> Tuple[str, ...]:
+        """
+        回傳應查詢的市場：
+        - 目錄可用且查得到 → (該市場,)
+        - 目錄可用但查無代號 → ()，呼叫端應直接拒絕
+        - 目錄停用/無法取得 → 先前查到過的市場，否則兩個市場都試
+        """
+        if SYMBOL_DIRECTORY_ENABLED:
+            await self.ensure_fresh()
+            if self.loaded:
+                info = self.get(symbol)
+                return (info.market,) if info else ()
+        route = self._routes.get(symbol.strip().upper())
+        return (route,) if route else ALL_MARKETS
+
+
+DIRECTORY = SymbolDirectory()
+
+
+def lookup(symbol: str) -> Optional[SymbolInfo]:
+    return DIRECTORY.get(symbol)
+
+
+def remember(symbol: str, market: str) -> None:
+    DIRECTORY.remember(symbol, market)
+
+
+async def markets_for(symbol: str) -> Tuple[str, ...]:
+    return await DIRECTORY.markets_for(symbol)
+
+
+async def is_unknown(symbol: str) -> bool:
+    """目錄可用且確定查無此代號。"""
+    return not await markets_for(symbol)
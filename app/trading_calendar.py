@@ -0,0 +1,237 @@
+# =========================
+# File: app/trading_calendar.py
+# 說明：交易日曆（台北時間）：TWSE 休市日程（holidaySchedule，每年抓一次並快取）+ EXTRA_HOLIDAYS
+#      （颱風等臨時休市），加上一般交易時段。回溯日線時略過非交易日、休市時不輪詢即時報價、
+#      快取到期時間以實際的開盤/盤後更新時點計算。尚未取得休市日程時退回「週一至週五」。
+# =========================
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.config import env_int
+from app.http_client import get_session, read_json
+from app.market_hours import (
+    SESSION_CLOSE_TIME,
+    SESSION_OPEN_TIME,
+    TAIPEI_TZ,
+    close_update_at,
+    taipei_now,
+)
+from app.resilience import guarded
+
+log = logging.getLogger(__name__)
+
+HOLIDAY_SCHEDULE_URL = "https://www.twse.com.tw/rwd/zh/holidaySchedule/holidaySchedule?date={year}0101&response=json"
+HOLIDAY_FETCH_ENABLED: bool = os.getenv(
+    "HOLIDAY_FETCH_ENABLED", "1"
+).strip().lower() not in {"0", "false", "no"}
+# 臨時休市（颱風假等）：YYYY-MM-DD，以逗號分隔
+EXTRA_HOLIDAYS: str = os.getenv("EXTRA_HOLIDAYS", "")
+# 抓取失敗後的重試間隔；休市日程每日重新確認一次（臨時公告會更新日程）
+HOLIDAY_RETRY_SEC: int = env_int("HOLIDAY_RETRY_SEC", 600)
+HOLIDAY_REFRESH_SEC: int = env_int("HOLIDAY_REFRESH_SEC", 86400)
+
+# 日程中仍有交易的項目（例如「國曆新年開始交易日」「農曆春節前最後交易日」）
+_TRADING_NOTE_RE = re.compile("開始交易|最後交易")
+# 回溯/前進最多掃描的天數（最長連假約 9 天）
+_MAX_SCAN_DAYS = 31
+
+
+def _parse_day(s: Any) -> Optional[dt.date]:
+    s = str(s or "").strip()
+    m = re.match(r"(\d{2,4})[-/]?(\d{1,2})[-/]?(\d{1,2})", s)
+    if not m:
+        return None
+    year = int(m.group(1))
+    if year < 1911:  # 民國年
+        year += 1911
+    try:
+        return dt.date(year, int(m.group(2)), int(m.group(3)))
+    except ValueError:
+        return None
+
+
+def parse_extra_holidays(spec: str) -> Set[dt.date]:
+    return {d for d in (_parse_day(p) for p in spec.split(",")) if d is not None}
+
+
+def parse_holiday_schedule(
+    payload: Dict[str, Any],
+) -> Tuple[Set[dt.date], Set[dt.date]]:
+    """holidaySchedule 回應 → (休市日, 日程中列出但仍有交易的日子)。"""
+    holidays: Set[dt.date] = set()
+    trading: Set[dt.date] = set()
+    for row in (payload or {}).get("data") or []:
+        if not row:
+            continue
+        day = _parse_day(row[0])
+        if day is None:
+            continue
+        note = " ".join(str(x) for x in row[1:])
+        (trading if _TRADING_NOTE_RE.search(note) else holidays).add(day)
+    return holidays, trading
+
+
+class TradingCalendar:
+    def __init__(self, extra_holidays: Iterable[dt.date] = ()):
+        self.extra_holidays: Set[dt.date] = set(extra_holidays)
+        self._holidays: Dict[int, Set[dt.date]] = {}
+        self._trading: Dict[int, Set[dt.date]] = {}
+        self._loaded_at: Dict[int, float] = {}
+        self._last_attempt: Dict[int, float] = {}
+        self._loading: Dict[int, asyncio.Task] = {}
+
+    def load_year(
+        self,
+        year: int,
+        holidays: Iterable[dt.date],
+        trading_days: Iterable[dt.date] = (),
+    ) -> None:
+        self._holidays[year] = {d for d in holidays if d.year == year}
+        self._trading[year] = {d for d in trading_days if d.year == year}
+        self._loaded_at[year] = time.monotonic()
+
+    def loaded(self, year: int) -> bool:
+        return year in self._loaded_at
+
+    # ---- 同步查詢（使用已載入的資料）----
+
+    def is_trading_day(self, day: dt.date) -> bool:
+        if day in self.extra_holidays:
+            return False
+        if day in self._trading.get(day.year, ()):
+            return True
+        return day.weekday() < 5 and day not in self._holidays.get(day.year, ())
+
+    def last_trading_day(self, day: dt.date) -> dt.date:
+        """day 當天或之前最近的交易日。"""
+        for _ in range(_MAX_SCAN_DAYS):
+            if self.is_trading_day(day):
+                return day
+            day -= dt.timedelta(days=1)
+        return day
+
+    def next_trading_day(self, day: dt.date) -> dt.date:
+        """day 之後（不含當天）最近的交易日。"""
+        for _ in range(_MAX_SCAN_DAYS):
+            day += dt.timedelta(days=1)
+            if self.is_trading_day(day):
+                return day
+        return day
+
+    def trading_days_back(self, base: dt.date, days: int) -> List[dt.date]:
+        """base 往前 days 個日曆天內（含 base）的交易日，由近到遠。"""
+        return [
+            d
+            for d in (base - dt.timedelta(days=k) for k in range(max(0, int(days)) + 1))
+            if self.is_trading_day(d)
+        ]
+
+    def is_session_open(self, now: dt.datetime) -> bool:
+        now = now.astimezone(TAIPEI_TZ)
+        return (
+            self.is_trading_day(now.date())
+            and SESSION_OPEN_TIME <= now.time() < SESSION_CLOSE_TIME
+        )
+
+    def next_session_open(self, now: dt.datetime) -> dt.datetime:
+        """下一個交易時段開盤時點（略過週末與休市日）。"""
+        now = now.astimezone(TAIPEI_TZ)
+        day = now.date()
+        if now.time() >= SESSION_OPEN_TIME or not self.is_trading_day(day):
+            day = self.next_trading_day(day)
+        return dt.datetime.combine(day, SESSION_OPEN_TIME, tzinfo=TAIPEI_TZ)
+
+    def last_close_update(self, now: dt.datetime) -> dt.datetime:
+        """最近一次（<= now）盤後資料更新時點。"""
+        now = now.astimezone(TAIPEI_TZ)
+        day = self.last_trading_day(now.date())
+        if close_update_at(day) > now:
+            day = self.last_trading_day(day - dt.timedelta(days=1))
+        return close_update_at(day)
+
+    # ---- 休市日程載入 ----
+
+    async def _fetch_year(self, year: int) -> None:
+        url = HOLIDAY_SCHEDULE_URL.format(year=year)
+        sess = await get_session()
+
+        async def _get() -> Dict[str, Any]:
+            async with sess.get(url) as resp:
+                if resp.status != 200:
+                    raise RuntimeError(f"TWSE holidaySchedule HTTP {resp.status}")
+                return await read_json(resp, keep=("stat", "data"))
+
+        payload = await guarded(url, _get)
+        if not isinstance(payload, dict) or not isinstance(payload.get("data"), list):
+            raise RuntimeError(f"TWSE holidaySchedule {year}: no data")
+        self.load_year(year, *parse_holiday_schedule(payload))
+
+    async def ensure_year(self, year: int) -> None:
+        """確保該年休市日程已載入（過期則重新抓取）；失敗時保留舊資料，稍後再試。"""
+        if not HOLIDAY_FETCH_ENABLED:
+            return
+        now = time.monotonic()
+        loaded_at = self._loaded_at.get(year)
+        if loaded_at is not None and now - loaded_at < HOLIDAY_REFRESH_SEC:
+            return
+        task = self._loading.get(year)
+        if task is None:
+            if (
+                now - self._last_attempt.get(year, -HOLIDAY_RETRY_SEC)
+                < HOLIDAY_RETRY_SEC
+            ):
+                return
+            self._last_attempt[year] = now
+            task = self._loading[year] = asyncio.ensure_future(self._fetch_year(year))
+        try:
+            await asyncio.shield(task)
+        except Exception as e:
+            log.warning("loading holiday schedule %s failed: %s", year, e)
+        finally:
+            if self._loading.get(year) is task and task.done():
+                del self._loading[year]
+
+    async def ensure_loaded(self, day: Optional[dt.date] = None) -> None:
+        """載入 day（預設今天）所在年度；年初時一併載入前一年（回溯會跨年）。"""
+        day = day or taipei_now().date()
+        await self.ensure_year(day.year)
+        if day.month == 1:
+            await self.ensure_year(day.year - 1)
+
+
+CALENDAR = TradingCalendar(parse_extra_holidays(EXTRA_HOLIDAYS))
+
+
+def is_trading_day(day: dt.date) -> bool:
+    return CALENDAR.is_trading_day(day)
+
+
+def last_trading_day(day: dt.date) -> dt.date:
+    return CALENDAR.last_trading_day(day)
+
+
+def trading_days_back(base: dt.date, days: int) -> List[dt.date]:
+    return CALENDAR.trading_days_back(base, days)
+
+
+def is_session_open(now: Optional[dt.datetime] = None) -> bool:
+    return CALENDAR.is_session_open(now or taipei_now())
+
+
+def next_session_open(now: dt.datetime) -> dt.datetime:
+    return CALENDAR.next_session_open(now)
+
+
+def last_close_update(now: dt.datetime) -> dt.datetime:
+    return CALENDAR.last_close_update(now)
+
+
+async def ensure_loaded(day: Optional[dt.date] = None) -> None:
+    await CALENDAR.ensure_loaded(day)
@@ -2,15 +2,42 @@
 # File: app/tw_markets.py
 # =========================
 from __future__ import annotations
+import argparse
+import asyncio
 import datetime as dt
-import json
 import re
-from typing import Any, Dict, List, Optional
+import sys
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
 
 import aiohttp
 
+from app.bar_store import BAR_STORE, BarSeries
+from app.config import env_float, env_int
+from app.http_client import close_session, get_session, read_json
+from app.market_hours import taipei_now
+from app.month_cache import MONTH_CACHE
+from app.rankings import SNAPSHOTS
+from app.ratelimit import BACKGROUND, priority
+from app.resilience import guarded, revalidate
+from app.realtime import QuoteBatcher
+from app.singleflight import SingleFlight
+from app.symbols import is_unknown, markets_for
+
 ROC_START_YEAR = 1911
 
+# MIS 即時報價微批次：窗口內的請求合併為一次上游查詢
+REALTIME_BATCH_WINDOW_MS: float = env_float("REALTIME_BATCH_WINDOW_MS", 75.0)
+REALTIME_BATCH_MAX: int = env_int("REALTIME_BATCH_MAX", 50)
+
+_STOCK_DAY_FLIGHT = SingleFlight("tw_markets.stock_day")
+
+# 區間查詢：同時抓取的月份數上限
+DAILY_RANGE_CONCURRENCY: int = env_int("DAILY_RANGE_CONCURRENCY", 3)
+
+# 歷史回補：每次上游請求之間的最小間隔（秒）
+BACKFILL_INTERVAL_SEC: float = env_float("BACKFILL_INTERVAL_SEC", 3.0)
+
 
 class HttpError(RuntimeError):
     pass
@@ -41,6 +68,16 @@ def _parse_number(x: str) -> Optional[float]:
         return None
 
 
+def _mis_prefix(market: str) -> str:
+    # MIS 頻道：上市 tse_、上櫃 otc_
+    return "otc" if market.upper() == "TPEX" else "tse"
+
+
+async def _ensure_known(symbol: str) -> None:
+    if await is_unknown(symbol):
+        raise ValueError(f"查無此代號：{symbol}")
+
+
 class TWSEClient:
     BASE = "https://www.twse.com.tw"
     MIS = "https://mis.twse.com.tw"
@@ -54,28 +91,51 @@ class TWSEClient:
             f"{self.BASE}/exchangeReport/STOCK_DAY?response=json&date="
             f"{date:%Y%m%d}&stockNo={symbol}"
         )
-        async with self.session.get(url) as resp:
-            if resp.status != 200:
-                raise HttpError(f"TWSE stock_day HTTP {resp.status}")
-            data = await resp.json(content_type=None)
+
+        async def _get() -> Dict[str, Any]:
+            async with self.session.get(url) as resp:
+                if resp.status != 200:
+                    raise HttpError(f"TWSE stock_day HTTP {resp.status}")
+                return await read_json(resp, keep=("stat", "date", "fields", "data"))
+
+        data = await guarded(url, _get)
         if data.get("stat") not in {"OK", "很抱歉，沒有符合條件的資料!"}:
             raise HttpError(f"TWSE unexpected stat: {data.get('stat')}")
         return data
 
-    async def realtime(self, symbol: str) -> Optional[Dict[str, Any]]:
+    async def realtime(
+        self, symbol: str, market: str = "TWSE"
+    ) -> Optional[Dict[str, Any]]:
         symbol = _normalize_symbol(symbol)
-        ex_ch = f"tse_{symbol}.tw"
+        quotes = await self.realtime_many([(market.upper(), symbol)])
+        return quotes.get((market.upper(), symbol))
+
+    async def realtime_many(
+        self, channels: List[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """一次查詢多個 (市場, 代號)；MIS 以 | 串接多個 ex_ch。"""
+        if not channels:
+            return {}
+        ex_ch = "|".join(
+            f"{_mis_prefix(m)}_{_normalize_symbol(s)}.tw" for m, s in channels
+        )
         url = f"{self.MIS}/stock/api/getStockInfo.jsp?ex_ch={ex_ch}&json=1&delay=0"
-        try:
+
+        async def _get() -> Dict[str, Any]:
             async with self.session.get(url) as resp:
                 if resp.status != 200:
-                    return None
-                text = await resp.text()
-                data = json.loads(text)
+                    raise HttpError(f"MIS HTTP {resp.status}")
+                return await read_json(resp, keep=("msgArray",))
+
+        try:
+            data = await guarded(url, _get)
         except Exception:
-            return None
-        arr = data.get("msgArray") or []
-        return arr[0] if arr else None
+            return {}
+        out: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for item in (data or {}).get("msgArray") or []:
+            market = "TPEX" if item.get("ex") == "otc" else "TWSE"
+            out[(market, str(item.get("c", "")).upper())] = item
+        return out
 
 
 class TPEXClient:
@@ -91,91 +151,410 @@ class TPEXClient:
             f"{self.BASE}/web/stock/aftertrading/daily_trading_info/"
             f"st43_result.php?l=zh-tw&d={roc_ym}&stkno={symbol}"
         )
-        async with self.session.get(url) as resp:
-            if resp.status != 200:
-                raise HttpError(f"TPEX stock_day HTTP {resp.status}")
-            data = await resp.json(content_type=None)
-        return data
 
+        async def _get() -> Dict[str, Any]:
+            async with self.session.get(url) as resp:
+                if resp.status != 200:
+                    raise HttpError(f"TPEX stock_day HTTP {resp.status}")
+                return await read_json(
+                    resp, keep=("stat", "reportDate", "aaData", "data")
+                )
 
-async def pick_latest_record_from_twse_day(data: Dict[str, Any], target: dt.date) -> Optional[Dict[str, Any]]:
-    rows: List[List[str]] = data.get("data") or []
-    wanted = _roc_date_str(target)
-    for row in rows:
-        if not row:
-            continue
-        if row[0] == wanted:
-            return {
-                "date": row[0],
-                "volume": _parse_number(row[1]),
-                "turnover": _parse_number(row[2]),
-                "open": _parse_number(row[3]),
-                "high": _parse_number(row[4]),
-                "low": _parse_number(row[5]),
-                "close": _parse_number(row[6]),
-                "change": row[7],
-                "transactions": _parse_number(row[8]),
-            }
-    return None
+        return await guarded(url, _get)
 
 
-async def pick_latest_record_from_tpex_day(data: Dict[str, Any], target: dt.date) -> Optional[Dict[str, Any]]:
-    # TPEX: [日期, 成交仟股, 成交仟元, 開盤, 最高, 最低, 收盤, 漲跌, 筆數]
-    wanted = _roc_date_str(target)
-    rows: List[List[str]] = data.get("aaData") or data.get("data") or []
-    for row in rows:
-        if not row:
+def _parse_roc_date(s: str) -> Optional[dt.date]:
+    m = re.match(r"\s*(\d{2,3})/(\d{1,2})/(\d{1,2})", s or "")
+    if not m:
+        return None
+    try:
+        return dt.date(
+            int(m.group(1)) + ROC_START_YEAR, int(m.group(2)), int(m.group(3))
+        )
+    except ValueError:
+        return None
+
+
+def _roc_ordinal(s: str) -> Optional[int]:
+    """民國日期字串 → date.toordinal()；常見格式走 split 快速路徑，其餘交給正規式。"""
+    try:
+        y, m, d = s.split("/")
+        return dt.date(int(y) + ROC_START_YEAR, int(m), int(d)).toordinal()
+    except (AttributeError, ValueError):
+        day = _parse_roc_date(s)
+        return day.toordinal() if day is not None else None
+
+
+def _parse_change(x: Any) -> Optional[float]:
+    """漲跌欄位轉為帶正負號數值；X 為除權息標記。"""
+    if isinstance(x, (int, float)):
+        return float(x)
+    s = str(x or "").replace(",", "").strip()
+    if s[:1] == "X":
+        s = s[1:].strip()
+    return _parse_number(s)
+
+
+def _month_rows(market: str, data: Dict[str, Any]) -> List[List[str]]:
+    if market == "TPEX":
+        return data.get("aaData") or data.get("data") or []
+    return data.get("data") or []
+
+
+_NAN = float("nan")
+
+
+def _num(x: Any) -> float:
+    # 欄位解析快速路徑：有千分位才 replace，直接 float()；"--" 等缺值為 NaN
+    if x.__class__ is str and "," in x:
+        x = x.replace(",", "")
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return _NAN
+
+
+def parse_month(market: str, symbol: str, data: Dict[str, Any]) -> BarSeries:
+    """
+    整月 STOCK_DAY / st43 一次轉為欄式 BarSeries：民國日期轉序數、數值欄位轉 float、漲跌帶號；
+    依日期排序（同日取最後一列）。TPEX 量/額為千股/千元，轉為股/元。
+    """
+    # 欄位順序：[日期, 成交量, 成交額, 開, 高, 低, 收, 漲跌, 筆數]
+    scale = 1000.0 if market.upper() == "TPEX" else 1.0
+    rows: Dict[int, List[str]] = {}
+    for row in _month_rows(market, data):
+        if len(row) < 9:
             continue
-        if row[0] == wanted:
-            vol = _parse_number(row[1])
-            amt = _parse_number(row[2])
-            return {
-                "date": row[0],
-                "volume": vol * 1000 if vol is not None else None,
-                "turnover": amt * 1000 if amt is not None else None,
-                "open": _parse_number(row[3]),
-                "high": _parse_number(row[4]),
-                "low": _parse_number(row[5]),
-                "close": _parse_number(row[6]),
-                "change": row[7],
-                "transactions": _parse_number(row[8]),
-            }
-    return None
+        o = _roc_ordinal(row[0])
+        if o is not None:
+            rows[o] = row
+    days = array("q", sorted(rows))
+    ordered = [rows[o] for o in days]
+    change = []
+    for r in ordered:
+        c = _parse_change(r[7])
+        change.append(_NAN if c is None else c)
+    return BarSeries(
+        market.upper(),
+        symbol,
+        days,
+        volume=array("d", [_num(r[1]) * scale for r in ordered]),
+        turnover=array("d", [_num(r[2]) * scale for r in ordered]),
+        open=array("d", [_num(r[3]) for r in ordered]),
+        high=array("d", [_num(r[4]) for r in ordered]),
+        low=array("d", [_num(r[5]) for r in ordered]),
+        close=array("d", [_num(r[6]) for r in ordered]),
+        change=array("d", change),
+        transactions=array("d", [_num(r[8]) for r in ordered]),
+    )
+
+
+def _record_at(bars: BarSeries, i: int) -> Dict[str, Any]:
+    day = dt.date.fromordinal(bars.days[i])
+    return {"date": _roc_date_str(day), **bars.record(i)}
+
+
+def _ingest_month(bars: BarSeries, month: dt.date) -> None:
+    """
+    整月資料寫入本地日線儲存（未啟用時略過）。進行中的月份只在月快取，
+    月份結束後抓到的整月資料才落地並標記為完整，回補/區間查詢才能放心略過上游。
+    """
+    if BAR_STORE is None or not len(bars):
+        return
+    today = taipei_now().date()
+    if (month.year, month.month) < (today.year, today.month):
+        BAR_STORE.put_series(bars, complete=[(month.year, month.month)])
+
+
+async def _stock_day_cached(market: str, symbol: str, date: dt.date) -> BarSeries:
+    """整月資料（已解析）；先查月快取，未命中才打上游。"""
+    bars = MONTH_CACHE.get(market, symbol, date)
+    if bars is not None:
+        return bars
+
+    async def _fetch() -> BarSeries:
+        sess = await get_session()
+        client = TWSEClient(sess) if market == "TWSE" else TPEXClient(sess)
+        parsed = parse_month(market, symbol, await client.stock_day(symbol, date))
+        MONTH_CACHE.put(market, symbol, date, parsed)
+        _ingest_month(parsed, date)
+        return parsed
+
+    # 同一 (市場, 代號, 年月) 的並發未命中只打一次上游
+    key = MONTH_CACHE.key(market, symbol, date)
+    last = MONTH_CACHE.peek(market, symbol, date)
+    if last is None:
+        return await _STOCK_DAY_FLIGHT.do(key, _fetch)
+    # 當月資料過期：上游慢或故障時先回上一份並標記為過期
+    bars, stale = await revalidate(_STOCK_DAY_FLIGHT, key, _fetch, last[0])
+    return bars.marked_stale(last[1]) if stale else bars
+
+
+def _with_stale(payload: Dict[str, Any], bars: BarSeries) -> Dict[str, Any]:
+    """月資料為過期快取時，在回傳 payload 標記原始抓取時間（embed 頁尾顯示）。"""
+    if bars.stale_since is not None:
+        payload["stale_since"] = bars.stale_since.isoformat()
+    return payload
+
+
+def daily_from_snapshot(
+    symbol: str, market: str, date: dt.date
+) -> Optional[Dict[str, Any]]:
+    """
+    盤後整批匯入（MI_INDEX / TPEX 收盤行情）的全市場資料含此代號當日日線時，直接由記憶體回答；
+    否則回傳 None，由呼叫端改查 STOCK_DAY / st43。
+    """
+    snap = SNAPSHOTS.final(market, date)
+    if snap is None:
+        return None
+    i = snap.index_of(_normalize_symbol(symbol))
+    if i < 0:
+        return None
+    rec = {"date": _roc_date_str(date), **snap.record(i)}
+    return {
+        "market": market,
+        "symbol": _normalize_symbol(symbol),
+        "date": date.isoformat(),
+        "raw_date": rec["date"],
+        "record": rec,
+    }
 
 
 async def fetch_daily(symbol: str, market: str, date: Optional[dt.date] = None) -> Dict[str, Any]:
     symbol = _normalize_symbol(symbol)
     market = market.upper().strip()
     date = date or dt.date.today()
+    await _ensure_known(symbol)
 
-    async with aiohttp.ClientSession(headers={"User-Agent": "Mozilla/5.0"}) as sess:
-        if market == "TWSE":
-            twse = TWSEClient(sess)
-            raw = await twse.stock_day(symbol, date)
-            rec = await pick_latest_record_from_twse_day(raw, date)
+    if market in ("TWSE", "TPEX") and BAR_STORE is not None:
+        stored = BAR_STORE.get(market, symbol, date)
+        if stored is not None:
+            rec = {"date": _roc_date_str(date), **stored}
             return {
-                "market": "TWSE",
+                "market": market,
                 "symbol": symbol,
                 "date": date.isoformat(),
-                "raw_date": rec.get("date") if rec else None,
+                "raw_date": rec["date"],
                 "record": rec,
             }
-        elif market == "TPEX":
-            tpex = TPEXClient(sess)
-            raw = await tpex.stock_day(symbol, date)
-            rec = await pick_latest_record_from_tpex_day(raw, date)
-            return {
-                "market": "TPEX",
+
+    if market not in ("TWSE", "TPEX"):
+        raise ValueError("market must be 'TWSE' or 'TPEX'")
+    from_snapshot = daily_from_snapshot(symbol, market, date)
+    if from_snapshot is not None:
+        return from_snapshot
+    bars = await _stock_day_cached(market, symbol, date)
+    i = bars.index_of(date)
+    rec = _record_at(bars, i) if i >= 0 else None
+    return _with_stale(
+        {
+            "market": market,
+            "symbol": symbol,
+            "date": date.isoformat(),
+            "raw_date": rec.get("date") if rec else None,
+            "record": rec,
+        },
+        bars,
+    )
+
+
+async def fetch_realtime(
+    symbol: str, market: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    symbol = _normalize_symbol(symbol)
+    markets = await markets_for(symbol)
+    if not markets:
+        raise ValueError(f"查無此代號：{symbol}")
+    market = (market or markets[0]).upper()
+    return await REALTIME_BATCHER.get(market, symbol)
+
+
+async def fetch_realtime_many(
+    channels: List[Tuple[str, str]],
+) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    twse = TWSEClient(await get_session())
+    return await twse.realtime_many(channels)
+
+
+REALTIME_BATCHER = QuoteBatcher(
+    fetch_realtime_many,
+    window_sec=REALTIME_BATCH_WINDOW_MS / 1000.0,
+    max_batch=REALTIME_BATCH_MAX,
+)
+
+
+async def fetch_daily_on_or_before(
+    symbol: str,
+    market: str,
+    date: Optional[dt.date] = None,
+    not_before: Optional[dt.date] = None,
+) -> Tuple[Dict[str, Any], Optional[dt.date]]:
+    """
+    單次回溯：從整月資料直接取日期 <= date 的最後一筆交易日；
+    當月沒有（月初連假）才再抓上個月，且不早於 not_before。
+    回傳 (payload, 實際日期/None)。
+    """
+    symbol = _normalize_symbol(symbol)
+    market = market.upper().strip()
+    if market not in ("TWSE", "TPEX"):
+        raise ValueError("market must be 'TWSE' or 'TPEX'")
+    date = date or dt.date.today()
+    not_before = not_before or date
+    await _ensure_known(symbol)
+
+    bars = await _stock_day_cached(market, symbol, date)
+    i = bars.index_on_or_before(date)
+    prev_month_end = date.replace(day=1) - dt.timedelta(days=1)
+    if i < 0 and prev_month_end >= not_before:
+        bars = await _stock_day_cached(market, symbol, prev_month_end)
+        i = bars.index_on_or_before(prev_month_end)
+    used = dt.date.fromordinal(bars.days[i]) if i >= 0 else None
+    rec = _record_at(bars, i) if i >= 0 else None
+    if used is not None and used < not_before:
+        rec, used = None, None
+    return (
+        _with_stale(
+            {
+                "market": market,
                 "symbol": symbol,
-                "date": date.isoformat(),
+                "date": (used or date).isoformat(),
                 "raw_date": rec.get("date") if rec else None,
                 "record": rec,
-            }
-        else:
-            raise ValueError("market must be 'TWSE' or 'TPEX'")
+            },
+            bars,
+        ),
+        used,
+    )
+
+
+async def backfill_daily(
+    symbol: str,
+    market: str,
+    start: dt.date,
+    end: Optional[dt.date] = None,
+    min_interval_sec: Optional[float] = None,
+) -> int:
+    """
+    逐月回補本地日線儲存；已完整的過去月份略過，上游請求之間至少間隔 min_interval_sec。
+    進行中的月份只會抓取（不落地）。回傳處理的月數。
+    """
+    if BAR_STORE is None:
+        raise RuntimeError("BAR_STORE_PATH 未設定，無法回補")
+    symbol = _normalize_symbol(symbol)
+    market = market.upper().strip()
+    end = end or dt.date.today()
+    interval = (
+        BACKFILL_INTERVAL_SEC
+        if min_interval_sec is None
+        else max(0.0, min_interval_sec)
+    )
+
+    fetched = 0
+    y, m = start.year, start.month
+    # 回補一律以背景優先序排隊，讓使用者指令先取得上游配額
+    with priority(BACKGROUND):
+        while (y, m) <= (end.year, end.month):
+            if not BAR_STORE.month_complete(market, symbol, y, m):
+                if fetched and interval:
+                    await asyncio.sleep(interval)
+                bars = await _stock_day_cached(market, symbol, dt.date(y, m, 1))
+                if not BAR_STORE.month_complete(market, symbol, y, m):
+                    # 月快取命中時不會經過寫入路徑
+                    _ingest_month(bars, dt.date(y, m, 1))
+                fetched += 1
+            y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return fetched
+
+
+def _iter_months(start: dt.date, end: dt.date) -> List[dt.date]:
+    months = []
+    y, m = start.year, start.month
+    while (y, m) <= (end.year, end.month):
+        months.append(dt.date(y, m, 1))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return months
+
+
+async def fetch_daily_range(
+    symbol: str,
+    market: str,
+    start: dt.date,
+    end: Optional[dt.date] = None,
+    concurrency: Optional[int] = None,
+) -> BarSeries:
+    """
+    區間日線：計算涵蓋的月份並以有限並發抓取（本地儲存中已完整的月份直接讀取），
+    合併去重後依日期排序，回傳欄式 BarSeries。
+    """
+    symbol = _normalize_symbol(symbol)
+    market = market.upper().strip()
+    if market not in ("TWSE", "TPEX"):
+        raise ValueError("market must be 'TWSE' or 'TPEX'")
+    end = end or dt.date.today()
+    if start > end:
+        raise ValueError("start 不可晚於 end")
+    await _ensure_known(symbol)
+
+    sem = asyncio.Semaphore(max(1, concurrency or DAILY_RANGE_CONCURRENCY))
+
+    async def _one(month: dt.date) -> BarSeries:
+        nxt = (month.replace(day=28) + dt.timedelta(days=4)).replace(day=1)
+        # 只有標記為完整的月份才直接讀本地儲存；其餘（含只存到月中的舊資料）改抓整月
+        if BAR_STORE is not None and BAR_STORE.month_complete(
+            market, symbol, month.year, month.month
+        ):
+            return BAR_STORE.read_range(
+                market, symbol, month, nxt - dt.timedelta(days=1)
+            )
+        async with sem:
+            bars = await _stock_day_cached(market, symbol, month)
+        # 月資料已依日期排序去重；只取該月範圍
+        return bars.range(month, nxt - dt.timedelta(days=1))
+
+    parts = await asyncio.gather(*(_one(m) for m in _iter_months(start, end)))
+    return BarSeries.concat(market, symbol, parts).range(start, end)
+
+
+# ---- 命令列：python -m app.tw_markets backfill 2330 6488 --start 2015-01-01 ----
+
+
+async def _backfill_cli(args: argparse.Namespace) -> int:
+    if BAR_STORE is None:
+        print("BAR_STORE_PATH 未設定，無法回補", file=sys.stderr)
+        return 2
+    try:
+        for symbol in args.symbols:
+            markets = (args.market,) if args.market else await markets_for(symbol)
+            if len(markets) != 1:
+                print(f"{symbol}: 無法判斷市場，請加上 --market", file=sys.stderr)
+                continue
+            n = await backfill_daily(
+                symbol, markets[0], args.start, args.end, args.interval
+            )
+            print(f"{markets[0]} {symbol}: {n} 個月")
+    finally:
+        await BAR_STORE.flush()
+        await close_session()
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m app.tw_markets")
+    sub = ap.add_subparsers(dest="command", required=True)
+    bf = sub.add_parser("backfill", help="逐月回補本地日線儲存（BAR_STORE_PATH）")
+    bf.add_argument("symbols", nargs="+", metavar="SYMBOL")
+    bf.add_argument("--market", choices=("TWSE", "TPEX"), help="預設依代號目錄判斷")
+    bf.add_argument("--start", type=dt.date.fromisoformat, required=True)
+    bf.add_argument("--end", type=dt.date.fromisoformat, help="預設今天")
+    bf.add_argument(
+        "--interval",
+        type=float,
+        default=None,
+        help=f"上游請求最小間隔秒數（預設 BACKFILL_INTERVAL_SEC={BACKFILL_INTERVAL_SEC}）",
+    )
+    args = ap.parse_args(argv)
+    return asyncio.run(_backfill_cli(args))
 
 
-async def fetch_realtime(symbol: str) -> Optional[Dict[str, Any]]:
-    async with aiohttp.ClientSession(headers={"User-Agent": "Mozilla/5.0"}) as sess:
-        twse = TWSEClient(sess)
-        return await twse.realtime(symbol)
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+# =========================
+# File: app/warm_state.py
+# 說明：快速啟動：關閉時把月資料快取、排行快照與代號目錄寫入 BOT_STATE_DIR，啟動時載回，
+#      重新部署後的第一批查詢即可命中快取；另記錄斜線指令樹指紋，未變更時略過全域 sync。
+#      BOT_STATE_DIR 未設定時全部停用（每次啟動仍 sync 一次）。
+# =========================
+from __future__ import annotations
+
+import datetime as dt
+import hashlib
+import inspect
+import json
+import logging
+import os
+import struct
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from app import rankings, symbols
+from app.bar_store import BarSeries
+from app.month_cache import MONTH_CACHE
+
+log = logging.getLogger(__name__)
+
+BOT_STATE_DIR: str = os.getenv("BOT_STATE_DIR", "").strip()
+
+_MAGIC = b"SBWS"
+_VERSION = 1
+_FILE_HEADER = struct.Struct("<4sI")
+_RECORD_HEADER = struct.Struct("<II")  # meta 長度, blob 長度
+
+Record = Tuple[Dict[str, Any], bytes]
+
+
+def _state_dir(path: Optional[str]) -> Optional[Path]:
+    p = path if path is not None else BOT_STATE_DIR
+    return Path(p) if p else None
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+# ---- 紀錄檔格式：檔頭 + 多筆 (JSON meta, 二進位 blob) ----
+
+
+def _pack(records: Iterable[Record]) -> bytes:
+    parts = [_FILE_HEADER.pack(_MAGIC, _VERSION)]
+    for meta, blob in records:
+        m = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        parts += [_RECORD_HEADER.pack(len(m), len(blob)), m, blob]
+    return b"".join(parts)
+
+
+def _unpack(buf: bytes) -> Iterator[Record]:
+    magic, version = _FILE_HEADER.unpack_from(buf, 0)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError("unsupported warm state file")
+    pos = _FILE_HEADER.size
+    while pos < len(buf):
+        m_len, b_len = _RECORD_HEADER.unpack_from(buf, pos)
+        pos += _RECORD_HEADER.size
+        meta = json.loads(buf[pos : pos + m_len])
+        pos += m_len
+        yield meta, buf[pos : pos + b_len]
+        pos += b_len
+
+
+# ---- 各快取的序列化 ----
+
+
+def _month_records() -> Iterator[Record]:
+    for (market, symbol, ym), bars, fetched_at, immutable in MONTH_CACHE.items():
+        meta = {
+            "key": [market, symbol, ym],
+            "fetched_at": fetched_at.isoformat(),
+            "immutable": immutable,
+        }
+        yield meta, bars.to_bytes()
+
+
+def _restore_month(records: Iterable[Record]) -> int:
+    n = 0
+    for meta, blob in records:
+        market, symbol, ym = meta["key"]
+        bars = BarSeries.from_bytes(market, symbol, blob)
+        MONTH_CACHE.restore(
+            (market, symbol, ym),
+            bars,
+            dt.datetime.fromisoformat(meta["fetched_at"]),
+            meta["immutable"],
+        )
+        n += 1
+    return n
+
+
+def _snapshot_records() -> Iterator[Record]:
+    for expires, fetched_at, snap in rankings.SNAPSHOTS.items():
+        meta = {
+            "market": snap.market,
+            "date": snap.date.isoformat(),
+            "expires": expires.isoformat(),
+            "fetched_at": fetched_at.isoformat(),
+            "symbols": snap.symbols,
+            "names": snap.names,
+            "columns": list(rankings.Snapshot.COLUMNS),
+        }
+        yield meta, b"".join(
+            getattr(snap, c).tobytes() for c in rankings.Snapshot.COLUMNS
+        )
+
+
+def _restore_snapshots(records: Iterable[Record]) -> int:
+    n = 0
+    for meta, blob in records:
+        snap = rankings.Snapshot(meta["market"], dt.date.fromisoformat(meta["date"]))
+        snap.symbols = meta["symbols"]
+        snap.names = meta["names"]
+        n_rows = len(snap.symbols)
+        view = memoryview(blob)
+        # 依保存時的欄位清單讀回；之後新增的欄位以 NaN 補齊
+        for k, c in enumerate(meta["columns"]):
+            if c in rankings.Snapshot.COLUMNS:
+                col = array("d")
+                col.frombytes(view[k * n_rows * 8 : (k + 1) * n_rows * 8])
+                setattr(snap, c, col)
+        for c in rankings.Snapshot.COLUMNS:
+            if c not in meta["columns"]:
+                setattr(snap, c, array("d", [float("nan")]) * n_rows)
+        rankings.SNAPSHOTS.restore(
+            snap,
+            dt.datetime.fromisoformat(meta["expires"]),
+            dt.datetime.fromisoformat(meta["fetched_at"]),
+        )
+        n += 1
+    return n
+
+
+def _restore_symbols(state: Dict[str, Any]) -> int:
+    symbols.DIRECTORY.restore(state)
+    return len(symbols.DIRECTORY)
+
+
+def save(path: Optional[str] = None) -> bool:
+    """寫出暖啟動狀態；任何錯誤只記 log，不影響關閉流程。"""
+    root = _state_dir(path)
+    if root is None:
+        return False
+    try:
+        _atomic_write(root / "month_cache.bin", _pack(_month_records()))
+        _atomic_write(root / "snapshots.bin", _pack(_snapshot_records()))
+        _atomic_write(
+            root / "symbols.json",
+            json.dumps(symbols.DIRECTORY.state(), ensure_ascii=False).encode("utf-8"),
+        )
+    except Exception:
+        log.exception("saving warm state failed")
+        return False
+    return True
+
+
+def load(path: Optional[str] = None) -> Dict[str, int]:
+    """載回暖啟動狀態；檔案缺少或損毀時略過該部分。回傳各部分載入筆數。"""
+    root = _state_dir(path)
+    loaded: Dict[str, int] = {}
+    if root is None:
+        return loaded
+    parts = (
+        ("month_cache", "month_cache.bin", lambda buf: _restore_month(_unpack(buf))),
+        ("snapshots", "snapshots.bin", lambda buf: _restore_snapshots(_unpack(buf))),
+        ("symbols", "symbols.json", lambda buf: _restore_symbols(json.loads(buf))),
+    )
+    for name, filename, restore in parts:
+        file = root / filename
+        if not file.is_file():
+            continue
+        try:
+            loaded[name] = restore(file.read_bytes())
+        except Exception:
+            log.warning("ignoring unreadable warm state %s", file, exc_info=True)
+    return loaded
+
+
+# ---- 斜線指令樹指紋 ----
+
+
+def _command_dict(command: Any, tree: Any) -> Dict[str, Any]:
+    # discord.py 2.4 起 to_dict 需要 tree 參數；2.3.x 不接受
+    if inspect.signature(command.to_dict).parameters:
+        return command.to_dict(tree)
+    return command.to_dict()
+
+
+def tree_fingerprint(tree: Any, application_id: Optional[int]) -> str:
+    """全域指令定義（含參數、選項、權限）的雜湊；application 不同也視為變更。"""
+    commands = sorted(
+        (_command_dict(c, tree) for c in tree.get_commands()),
+        key=lambda d: d.get("name", ""),
+    )
+    blob = json.dumps(
+        {"application_id": application_id, "commands": commands},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def needs_sync(fingerprint: str, path: Optional[str] = None) -> bool:
+    root = _state_dir(path)
+    if root is None:
+        return True
+    try:
+        return (root / "command_tree.sha256").read_text(
+            encoding="ascii"
+        ).strip() != fingerprint
+    except OSError:
+        return True
+
+
+def mark_synced(fingerprint: str, path: Optional[str] = None) -> None:
+    root = _state_dir(path)
+    if root is None:
+        return
+    try:
+        _atomic_write(root / "command_tree.sha256", fingerprint.encode("ascii"))
+    except OSError:
+        log.warning("saving command tree fingerprint failed", exc_info=True)
@@ -0,0 +1,111 @@
+# =========================
+# File: app/watch.py
+# 說明：/watch 看盤：共用輪詢器的訂閱驅動訊息更新；全域限制每秒編輯次數，價格未變不編輯
+# =========================
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from app.config import env_float, env_int
+from app.realtime import Quote, RealtimePoller
+
+# Discord 訊息編輯配額（全域共用）與看盤參數
+WATCH_EDITS_PER_SEC: float = env_float("WATCH_EDITS_PER_SEC", 4.0)
+WATCH_INTERVAL_SEC: float = env_float("WATCH_INTERVAL_SEC", 5.0)
+# interaction token 15 分鐘後失效，之後無法再編輯 followup 訊息
+WATCH_MAX_MINUTES: int = env_int("WATCH_MAX_MINUTES", 14)
+
+OnUpdate = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class EditBudget:
+    """Token bucket：所有看盤共用的每秒編輯上限；等待者依 FIFO 取得配額。"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = max(0.01, rate)
+        self.burst = max(1.0, burst if burst is not None else rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+
+
+EDIT_BUDGET = EditBudget(WATCH_EDITS_PER_SEC)
+WATCHES: Set[asyncio.Task] = set()
+
+
+def _price(quote: Quote) -> Optional[str]:
+    if not quote:
+        return None
+    return str(quote.get("z") or quote.get("price") or "").strip() or None
+
+
+async def run_watch(
+    poller: RealtimePoller,
+    market: str,
+    symbol: str,
+    minutes: float,
+    on_update: OnUpdate,
+    initial: Quote = None,
+    budget: EditBudget = EDIT_BUDGET,
+    interval_sec: float = WATCH_INTERVAL_SEC,
+) -> int:
+    """
+    訂閱報價直到時間到；價格有變才呼叫 on_update（受 budget 限速），
+    等待配額期間到達的新報價會合併成最新一筆。回傳實際更新次數。
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max(0.0, minutes) * 60
+    last_price = _price(initial)
+    edits = 0
+    sub = poller.subscribe(market, symbol, interval_sec)
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            quote = await sub.next(timeout=remaining)
+            if quote is None or _price(quote) == last_price:
+                continue
+            await budget.acquire()
+            quote = sub.latest or quote
+            try:
+                await on_update(quote)
+            except Exception:
+                # 訊息被刪除或 token 失效：停止看盤
+                break
+            last_price = _price(quote)
+            edits += 1
+    finally:
+        sub.close()
+    return edits
+
+
+def start_watch(*args: Any, **kwargs: Any) -> asyncio.Task:
+    """背景執行 run_watch，並登記以便關閉時取消。"""
+    task = asyncio.ensure_future(run_watch(*args, **kwargs))
+    WATCHES.add(task)
+    task.add_done_callback(WATCHES.discard)
+    return task
+
+
+def cancel_watches() -> None:
+    for task in list(WATCHES):
+        task.cancel()
@@ -0,0 +1,243 @@
+# =========================
+# File: benchmarks/bench_interactions.py
+# 說明：斜線指令負載模擬：以假的 discord.Interaction（記錄 response.defer / followup.send 時間）
+#      依指定速率（每分鐘次數，Poisson 到達）直接呼叫 bot.py 的指令 callback，上游為 stub_upstream。
+#      回報 defer 延遲（Discord 要求 3 秒內回應）、端到端延遲分佈與負載下的 event loop 延遲。
+#      用法：python -m benchmarks.bench_interactions [--rate 3000] [--duration 30] [--latency-ms 80]
+# =========================
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from discord import app_commands
+
+import bot
+from app import symbols
+from benchmarks.bench_upstream import offline, percentile, reset_state
+from benchmarks.stub_upstream import StubConfig
+
+DEFER_DEADLINE_SEC = 3.0
+
+# 指令 → 權重；實際流量以日線與即時查詢為主
+COMMAND_MIX: Dict[str, float] = {
+    "search": 3,
+    "daily": 3,
+    "realtime": 3,
+    "top_gainers": 1,
+    "top_losers": 1,
+    "actives": 1,
+}
+
+
+class _FakeMessage:
+    async def edit(self, **kwargs: Any) -> None:
+        pass
+
+
+class _FakeResponse:
+    def __init__(self, owner: "FakeInteraction"):
+        self._owner = owner
+
+    async def defer(self, **kwargs: Any) -> None:
+        self._owner.deferred_at = time.perf_counter()
+
+    async def send_message(self, content: Optional[str] = None, **kwargs: Any) -> None:
+        self._owner.deferred_at = self._owner.deferred_at or time.perf_counter()
+        self._owner.done_at = time.perf_counter()
+
+
+class _FakeFollowup:
+    def __init__(self, owner: "FakeInteraction"):
+        self._owner = owner
+
+    async def send(self, content: Optional[str] = None, **kwargs: Any) -> _FakeMessage:
+        self._owner.done_at = time.perf_counter()
+        return _FakeMessage()
+
+
+class FakeInteraction:
+    """指令 callback 會用到的 discord.Interaction 介面子集，記錄各階段時間。"""
+
+    def __init__(self, command: app_commands.Command):
+        self.command = command
+        self.extras: Dict[str, Any] = {}
+        self.response = _FakeResponse(self)
+        self.followup = _FakeFollowup(self)
+        self.created_at = time.perf_counter()
+        self.deferred_at: Optional[float] = None
+        self.done_at: Optional[float] = None
+        self.failed = False
+
+
+def _choice(value: str) -> app_commands.Choice[str]:
+    return app_commands.Choice(name=value, value=value)
+
+
+def _args(
+    name: str, rng: random.Random, codes: List[str], markets: Dict[str, str]
+) -> Dict[str, Any]:
+    code = rng.choice(codes)
+    if name == "search":
+        return {"symbol": code}
+    if name == "daily":
+        return {"symbol": code, "market": _choice(markets[code])}
+    if name == "realtime":
+        return {"symbol": code, "max_minutes": 1, "interval_sec": 2.0}
+    return {"market": _choice(rng.choice(("TWSE", "TPEX", "ALL"))), "limit": 10}
+
+
+async def _invoke(
+    command: app_commands.Command, kwargs: Dict[str, Any]
+) -> FakeInteraction:
+    # 與 discord.py 分派相同：每個 interaction 一個 task，先過 tree 的 interaction_check
+    interaction = FakeInteraction(command)
+    await bot.BOT.tree.interaction_check(interaction)
+    try:
+        await command.callback(interaction, **kwargs)
+    except Exception:
+        interaction.failed = True
+    await bot.on_app_command_completion(interaction, command)
+    # bot._fail 回覆錯誤訊息時會標記 extras["failed"]
+    interaction.failed = interaction.failed or bool(interaction.extras.get("failed"))
+    return interaction
+
+
+async def _sample_lag(out: List[float], interval: float) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        out.append(max(0.0, loop.time() - start - interval))
+
+
+def _dist(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50_ms": round(percentile(values, 0.5) * 1000, 2),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(max(values) * 1000, 2) if values else float("nan"),
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    config = StubConfig(
+        rows=args.rows,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    rng = random.Random(args.seed)
+    names = list(COMMAND_MIX)
+    weights = [COMMAND_MIX[n] for n in names]
+    commands = {n: bot.BOT.tree.get_command(n) for n in names}
+    tasks: List[Tuple[str, asyncio.Task]] = []
+    lag: List[float] = []
+
+    async with offline(config) as stub:
+        reset_state()
+        await symbols.DIRECTORY.ensure_fresh()
+        codes = rng.sample(
+            list(stub.data.markets), min(args.symbols, len(stub.data.markets))
+        )
+        stub.reset_counts()
+        sampler = asyncio.create_task(_sample_lag(lag, args.lag_interval))
+        rate_per_sec = args.rate / 60.0
+        start = time.perf_counter()
+        next_at = start
+        # 開放式負載：到達時間與處理進度無關，處理變慢時 backlog 會累積
+        while next_at - start < args.duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            name = rng.choices(names, weights)[0]
+            tasks.append(
+                (
+                    name,
+                    asyncio.create_task(
+                        _invoke(
+                            commands[name], _args(name, rng, codes, stub.data.markets)
+                        )
+                    ),
+                )
+            )
+            next_at += rng.expovariate(rate_per_sec)
+        results = await asyncio.gather(*(t for _, t in tasks))
+        elapsed = time.perf_counter() - start
+        sampler.cancel()
+        upstream = dict(stub.requests)
+
+    defer = [
+        it.deferred_at - it.created_at for it in results if it.deferred_at is not None
+    ]
+    e2e = [it.done_at - it.created_at for it in results if it.done_at is not None]
+    per_command: Dict[str, Dict[str, Any]] = {}
+    for (name, _), it in zip(tasks, results):
+        c = per_command.setdefault(name, {"count": 0, "failed": 0, "_e2e": []})
+        c["count"] += 1
+        c["failed"] += int(it.failed or it.done_at is None)
+        if it.done_at is not None:
+            c["_e2e"].append(it.done_at - it.created_at)
+    for c in per_command.values():
+        c.update(_dist(c.pop("_e2e")))
+    return {
+        "interactions": len(results),
+        "elapsed_sec": round(elapsed, 2),
+        "rate_per_min": round(len(results) / elapsed * 60, 1) if elapsed else 0.0,
+        "failed": sum(c["failed"] for c in per_command.values()),
+        "missed_defer_deadline": sum(1 for d in defer if d > DEFER_DEADLINE_SEC)
+        + len(results)
+        - len(defer),
+        "defer": _dist(defer),
+        "end_to_end": _dist(e2e),
+        "loop_lag": _dist(lag),
+        "commands": per_command,
+        "upstream": upstream,
+    }
+
+
+def _print(r: Dict[str, Any]) -> None:
+    print(
+        f"{r['interactions']} interactions in {r['elapsed_sec']}s ({r['rate_per_min']}/min), "
+        f"failed {r['failed']}, missed 3s defer deadline {r['missed_defer_deadline']}"
+    )
+    print(f"{'':<14} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    rows = [
+        ("defer", r["defer"]),
+        ("end-to-end", r["end_to_end"]),
+        ("loop lag", r["loop_lag"]),
+    ]
+    rows += [(f"/{n}", c) for n, c in sorted(r["commands"].items())]
+    for label, d in rows:
+        print(
+            f"{label:<14} {d['p50_ms']:>9.2f} {d['p95_ms']:>9.2f} {d['p99_ms']:>9.2f} {d['max_ms']:>9.2f}"
+        )
+    print("upstream: " + " ".join(f"{k}={v}" for k, v in sorted(r["upstream"].items())))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Slash command load simulator")
+    ap.add_argument("--rate", type=float, default=3000, help="每分鐘 interaction 數")
+    ap.add_argument("--duration", type=float, default=30.0, help="產生負載的秒數")
+    ap.add_argument("--rows", type=int, default=1500, help="每個市場的代號數")
+    ap.add_argument("--symbols", type=int, default=300, help="查詢用的代號池大小")
+    ap.add_argument("--latency-ms", type=float, default=80.0)
+    ap.add_argument("--jitter-ms", type=float, default=40.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument(
+        "--lag-interval", type=float, default=0.05, help="event loop 延遲取樣間隔秒"
+    )
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+    # 注入錯誤時每個失敗指令都會記 log，模擬時不輸出
+    logging.getLogger("stockbot").setLevel(logging.ERROR)
+    _print(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# =========================
+# File: benchmarks/bench_json.py
+# 說明：上游 JSON 解碼基準：以 tests/fixtures 放大成全市場大小的 MI_INDEX / TPEX 回應，
+#      比較「bytes→str→json.loads」（aiohttp resp.json 的作法）與 decode_json（orjson / 標準庫、只保留所需表格）
+#      用法：python -m benchmarks.bench_json [--rows 2700] [--repeat 50]
+# =========================
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from app import http_client
+from app.http_client import decode_json
+from app.rankings import MI_INDEX_KEYS, TPEX_QUOTES_KEYS, Snapshot
+
+FIXTURES = Path(__file__).resolve().parent.parent / "tests" / "fixtures"
+
+
+def _inflate(payload: Dict[str, Any], key: str, rows: int) -> Dict[str, Any]:
+    """複製範例列到指定列數（代號遞增），並加上 MI_INDEX 其他未使用的表格。"""
+    base: List[List[Any]] = payload[key]
+    out = []
+    for i in range(rows):
+        row = list(base[i % len(base)])
+        row[0] = f"{1000 + i}"
+        out.append(row)
+    big = dict(payload)
+    big[key] = out
+    # 指數、類股、漲跌家數等表格：實際回應中佔相當比例，但排行用不到
+    for n in range(1, 9):
+        big[f"fields{n}"] = [
+            "指數",
+            "收盤指數",
+            "漲跌(+/-)",
+            "漲跌點數",
+            "漲跌百分比(%)",
+        ]
+        big[f"data{n}"] = [
+            [f"類股指數{j}", "1,234.56", "+", "12.34", "1.01"] for j in range(60)
+        ]
+    return big
+
+
+def _bench(fn: Callable[[], Any], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1000
+
+
+def run(rows: int, repeat: int) -> None:
+    cases = [
+        ("MI_INDEX", "mi_index_sample.json", "data9", MI_INDEX_KEYS, "TWSE"),
+        ("TPEX", "tpex_quotes_sample.json", "aaData", TPEX_QUOTES_KEYS, "TPEX"),
+    ]
+    print(
+        f"orjson: {'yes' if http_client._orjson is not None else 'no (stdlib fallback)'}"
+    )
+    day = dt.date(2025, 8, 8)
+    for name, fixture, key, keep, market in cases:
+        sample = json.loads((FIXTURES / fixture).read_text(encoding="utf-8"))
+        body = json.dumps(_inflate(sample, key, rows), ensure_ascii=False).encode(
+            "utf-8"
+        )
+        print(f"\n{name}: {len(body) / 1024:.0f} KB, {rows} rows (median of {repeat})")
+
+        results = {
+            "str + json.loads": _bench(
+                lambda: json.loads(body.decode("utf-8")), repeat
+            ),
+            "decode_json": _bench(lambda: decode_json(body), repeat),
+            "decode_json + keep": _bench(lambda: decode_json(body, keep), repeat),
+            "str + json.loads + parse": _bench(
+                lambda: Snapshot.parse(json.loads(body.decode("utf-8")), market, day),
+                repeat,
+            ),
+            "decode_json + keep + parse": _bench(
+                lambda: Snapshot.parse(decode_json(body, keep), market, day), repeat
+            ),
+        }
+        baseline = results["str + json.loads"]
+        for label, ms in results.items():
+            print(
+                f"  {label:<28} {ms:7.2f} ms   x{baseline / ms:4.2f}"
+                if "parse" not in label
+                else f"  {label:<28} {ms:7.2f} ms"
+            )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--rows", type=int, default=2700)
+    ap.add_argument("--repeat", type=int, default=50)
+    args = ap.parse_args()
+    run(args.rows, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
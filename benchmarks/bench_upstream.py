@@ -0,0 +1,261 @@
+# =========================
+# File: benchmarks/bench_upstream.py
+# 說明：離線端到端基準：啟動 stub_upstream 本機上游，以指定並發驅動 fetch_daily、find_last_daily、
+#      find_last_realtime 與排行函式，回報吞吐量、p50/p99 延遲與各端點上游請求數。不需網路，CI 以 --smoke 執行。
+#      用法：python -m benchmarks.bench_upstream [--requests 500] [--concurrency 50] [--latency-ms 80]
+#            [--error-rate 0.0] [--throttle-rps 0] [--rows 1500] [--scenario daily ...] [--smoke]
+# =========================
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import datetime as dt
+import json
+import random
+import statistics
+import sys
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List
+
+from app import resilience, symbols, trading_calendar, tw_markets
+from app.http_client import close_session, start_session
+from app.markets_utils import find_last_daily, find_last_realtime
+from app.month_cache import MONTH_CACHE
+from app.ratelimit import LIMITER
+from app.rankings import SNAPSHOTS, most_actives, top_gainers, top_losers
+from benchmarks.stub_upstream import StubConfig, StubUpstream, is_trading_day
+
+SCENARIOS = ("daily", "find_last_daily", "realtime", "rankings")
+
+
+def _recent_days(n: int) -> List[dt.date]:
+    """今天以前的 n 個交易日（不含今天，避免結果隨執行時間變動）。"""
+    out: List[dt.date] = []
+    day = dt.date.today()
+    while len(out) < n:
+        day -= dt.timedelta(days=1)
+        if is_trading_day(day):
+            out.append(day)
+    return out
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _has_data(name: str, result: Any) -> bool:
+    """回應是否含實際資料（用來抓解析回歸：請求成功但結果為空）。"""
+    if name == "daily":
+        return bool(result and result.get("record"))
+    if name == "find_last_daily":
+        return bool(result and result[0])
+    if name == "rankings":
+        return bool(result and result.get("items"))
+    return bool(result)
+
+
+def reset_state() -> None:
+    # 每個情境從冷快取開始；代號目錄於計時前預熱
+    MONTH_CACHE.clear()
+    SNAPSHOTS.clear()
+    resilience.BREAKERS.clear()
+    symbols.DIRECTORY = symbols.SymbolDirectory()
+    trading_calendar.CALENDAR = trading_calendar.TradingCalendar()
+
+
+def _make_call(
+    name: str,
+    stub: StubUpstream,
+    rng: random.Random,
+    codes: List[str],
+    days: List[dt.date],
+):
+    def _daily() -> Awaitable[Any]:
+        code = rng.choice(codes)
+        return tw_markets.fetch_daily(code, stub.data.markets[code], rng.choice(days))
+
+    def _find_last_daily() -> Awaitable[Any]:
+        # 含週末，觸發回溯
+        return find_last_daily(
+            rng.choice(codes), rng.choice(days) + dt.timedelta(days=rng.randint(0, 2))
+        )
+
+    def _realtime() -> Awaitable[Any]:
+        return find_last_realtime(rng.choice(codes), max_minutes=1, interval_sec=1.0)
+
+    def _rankings() -> Awaitable[Any]:
+        fn = rng.choice((top_gainers, top_losers, most_actives))
+        return fn(
+            market=rng.choice(("TWSE", "TPEX", "ALL")), limit=10, date=rng.choice(days)
+        )
+
+    return {
+        "daily": _daily,
+        "find_last_daily": _find_last_daily,
+        "realtime": _realtime,
+        "rankings": _rankings,
+    }[name]
+
+
+async def _drive(
+    name: str, call: Callable[[], Awaitable[Any]], requests: int, concurrency: int
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    empty = 0
+    remaining = requests
+
+    async def _worker() -> None:
+        nonlocal remaining, errors, empty
+        while remaining > 0:
+            remaining -= 1
+            t0 = time.perf_counter()
+            try:
+                if not _has_data(name, await call()):
+                    empty += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(_worker() for _ in range(max(1, concurrency))))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "errors": errors,
+        "empty": empty,
+        "elapsed_sec": round(elapsed, 3),
+        "throughput": round(requests / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+@contextlib.asynccontextmanager
+async def offline(
+    config: StubConfig, rate_limit: bool = False
+) -> AsyncIterator[StubUpstream]:
+    """啟動本機上游並讓 app 指向它；結束時還原所有設定。"""
+    stub = StubUpstream(config)
+    await stub.start()
+    # 本機上游只有一個主機；預設關閉 app 端限速，量測的是 bot 自身的處理能力
+    limiter_enabled = LIMITER.enabled
+    LIMITER.enabled = rate_limit
+    bar_store, month_dir = tw_markets.BAR_STORE, MONTH_CACHE.persist_dir
+    tw_markets.BAR_STORE, MONTH_CACHE.persist_dir = None, None
+    try:
+        await start_session()
+        with stub.patch():
+            yield stub
+    finally:
+        LIMITER.enabled = limiter_enabled
+        tw_markets.BAR_STORE, MONTH_CACHE.persist_dir = bar_store, month_dir
+        await close_session()
+        await stub.stop()
+
+
+async def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    config = StubConfig(
+        rows=args.rows,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        throttle_rps=args.throttle_rps,
+        seed=args.seed,
+    )
+    rng = random.Random(args.seed)
+    results: List[Dict[str, Any]] = []
+    async with offline(config, args.rate_limit) as stub:
+        all_codes = list(stub.data.markets)
+        codes = rng.sample(all_codes, min(args.symbols, len(all_codes)))
+        days = _recent_days(args.days)
+        for name in args.scenario:
+            reset_state()
+            await symbols.DIRECTORY.ensure_fresh()
+            stub.reset_counts()
+            stats = await _drive(
+                name,
+                _make_call(name, stub, rng, codes, days),
+                args.requests,
+                args.concurrency,
+            )
+            stats["scenario"] = name
+            stats["upstream"] = dict(stub.requests)
+            stats["upstream_errors"] = sum(stub.errors.values())
+            stats["upstream_throttled"] = sum(stub.throttled.values())
+            results.append(stats)
+    return results
+
+
+def _print(results: List[Dict[str, Any]]) -> None:
+    print(
+        f"{'scenario':<16} {'req':>6} {'err':>5} {'empty':>5} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9}  upstream"
+    )
+    for r in results:
+        upstream = " ".join(f"{k}={v}" for k, v in sorted(r["upstream"].items()))
+        print(
+            f"{r['scenario']:<16} {r['requests']:>6} {r['errors']:>5} {r['empty']:>5} {r['throughput']:>8.1f} "
+            f"{r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f}  {upstream}"
+        )
+
+
+def _smoke_failures(results: List[Dict[str, Any]]) -> List[str]:
+    # 無錯誤注入時不應有任何失敗或空結果；每個情境都必須真的打到上游
+    failures = []
+    for r in results:
+        if r["errors"]:
+            failures.append(f"{r['scenario']}: {r['errors']} errors")
+        if r["empty"]:
+            failures.append(f"{r['scenario']}: {r['empty']} empty results")
+        if not r["upstream"]:
+            failures.append(f"{r['scenario']}: no upstream requests")
+    return failures
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Offline upstream benchmark")
+    ap.add_argument("--requests", type=int, default=500)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--rows", type=int, default=1500, help="每個市場的代號數")
+    ap.add_argument("--symbols", type=int, default=200, help="查詢用的代號池大小")
+    ap.add_argument("--days", type=int, default=20, help="查詢用的交易日池大小")
+    ap.add_argument("--latency-ms", type=float, default=80.0)
+    ap.add_argument("--jitter-ms", type=float, default=40.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--throttle-rps", type=float, default=0.0)
+    ap.add_argument("--rate-limit", action="store_true", help="保留 app 端的上游限速")
+    ap.add_argument("--scenario", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--json", dest="json_path", help="結果另存為 JSON")
+    ap.add_argument(
+        "--smoke", action="store_true", help="CI 用：小規模、無錯誤注入，失敗時 exit 1"
+    )
+    args = ap.parse_args()
+    if args.smoke:
+        args.requests, args.concurrency, args.rows = 60, 10, 200
+        args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rps = (
+            5.0,
+            5.0,
+            0.0,
+            0.0,
+        )
+
+    results = asyncio.run(run(args))
+    _print(results)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.smoke:
+        failures = _smoke_failures(results)
+        if failures:
+            print("smoke failed: " + "; ".join(failures), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,474 @@
+# =========================
+# File: benchmarks/stub_upstream.py
+# 說明：離線基準用的本機上游模擬（aiohttp.web）：STOCK_DAY、st43、MI_INDEX、TPEX 收盤行情、
+#      MIS getStockInfo.jsp 與 ISIN 清單。代號/名稱取自 tests/fixtures 並放大成全市場筆數，
+#      價格依 (代號, 日期) 決定性產生；可設定延遲、錯誤率與上游限速（超過即回 403，如同 TWSE 封鎖）。
+#      patch() 期間 app 的上游網址改指向本機伺服器。
+# =========================
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import datetime as dt
+import json
+import math
+import random
+import re
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from aiohttp import web
+
+from app import rankings, symbols, trading_calendar, tw_markets
+
+FIXTURES = Path(__file__).resolve().parent.parent / "tests" / "fixtures"
+ROC_START_YEAR = 1911
+NO_DATA = "很抱歉，沒有符合條件的資料!"
+
+MI_INDEX_FIELDS = [
+    "證券代號",
+    "證券名稱",
+    "成交股數",
+    "成交筆數",
+    "成交金額",
+    "開盤價",
+    "最高價",
+    "最低價",
+    "收盤價",
+    "漲跌(+/-)",
+    "漲跌價差",
+    "最後揭示買價",
+    "最後揭示買量",
+    "最後揭示賣價",
+    "最後揭示賣量",
+    "本益比",
+]
+TPEX_FIELDS = [
+    "代號",
+    "名稱",
+    "收盤",
+    "漲跌",
+    "開盤",
+    "最高",
+    "最低",
+    "均價",
+    "成交股數",
+    "成交金額(元)",
+    "成交筆數",
+]
+
+
+@dataclass
+class StubConfig:
+    rows: int = 1500  # 每個市場的代號數
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0  # 回 HTTP 500 的比例
+    throttle_rps: float = 0.0  # 0 = 不限；超過時回 HTTP 403
+    seed: int = 42
+
+
+def _fixture_names(name: str, key: str) -> List[str]:
+    try:
+        data = json.loads((FIXTURES / name).read_text(encoding="utf-8"))
+        return [str(r[1]) for r in data.get(key) or []] or ["樣本"]
+    except (OSError, ValueError):
+        return ["樣本"]
+
+
+def is_trading_day(day: dt.date) -> bool:
+    # 模擬器的行事曆只排除週末
+    return day.weekday() < 5
+
+
+def _roc(day: dt.date) -> str:
+    return f"{day.year - ROC_START_YEAR:03d}/{day.month:02d}/{day.day:02d}"
+
+
+def _parse_roc(s: str) -> Optional[Tuple[int, int, int]]:
+    m = re.match(r"(\d{2,3})/(\d{1,2})(?:/(\d{1,2}))?", s or "")
+    if not m:
+        return None
+    return int(m.group(1)) + ROC_START_YEAR, int(m.group(2)), int(m.group(3) or 1)
+
+
+class MarketData:
+    """全市場模擬資料：TWSE 代號 1000 起、TPEX 代號 5000 起；收盤價為 (代號, 日期) 的決定性函數。"""
+
+    def __init__(self, rows: int):
+        rows = max(1, min(rows, 4000))
+        twse_names = _fixture_names("mi_index_sample.json", "data9")
+        tpex_names = _fixture_names("tpex_quotes_sample.json", "aaData")
+        self.markets: Dict[str, str] = {}
+        self.names: Dict[str, str] = {}
+        for i in range(rows):
+            for market, code, names in (
+                ("TWSE", f"{1000 + i}", twse_names),
+                ("TPEX", f"{5000 + i}", tpex_names),
+            ):
+                self.markets[code] = market
+                self.names[code] = f"{names[i % len(names)]}{i}"
+        self._snapshots: Dict[Tuple[str, dt.date], List[Dict[str, float]]] = {}
+
+    def codes(self, market: str) -> List[str]:
+        return [c for c, m in self.markets.items() if m == market]
+
+    @staticmethod
+    def _close(code: str, ordinal: int) -> float:
+        seed = zlib.crc32(code.encode())
+        base = 10 + seed % 990
+        return round(base * (1 + 0.08 * math.sin(ordinal / 9 + seed % 97)), 2)
+
+    def bar(self, code: str, day: dt.date) -> Dict[str, float]:
+        o = day.toordinal()
+        close = self._close(code, o)
+        prev_day = day - dt.timedelta(days=1)
+        while not is_trading_day(prev_day):
+            prev_day -= dt.timedelta(days=1)
+        prev = self._close(code, prev_day.toordinal())
+        open_ = round((close + prev) / 2, 2)
+        seed = zlib.crc32(f"{code}{o}".encode())
+        volume = 1000 * (50 + seed % 20000)
+        return {
+            "open": open_,
+            "high": round(max(open_, close) * 1.01, 2),
+            "low": round(min(open_, close) * 0.99, 2),
+            "close": close,
+            "change": round(close - prev, 2),
+            "prev": prev,
+            "volume": volume,
+            "value": round(volume * close),
+            "trades": 1 + seed % 5000,
+        }
+
+    # ---- 各端點回應 ----
+
+    def stock_day(
+        self, market: str, code: str, year: int, month: int, today: dt.date
+    ) -> Dict[str, Any]:
+        if self.markets.get(code) != market:
+            return (
+                {"stat": NO_DATA} if market == "TWSE" else {"stat": "ok", "aaData": []}
+            )
+        day = dt.date(year, month, 1)
+        rows: List[List[str]] = []
+        scale = 1000 if market == "TPEX" else 1  # st43 量/額單位為千股/千元
+        while day.month == month and day <= today:
+            if is_trading_day(day):
+                b = self.bar(code, day)
+                rows.append(
+                    [
+                        _roc(day),
+                        f"{b['volume'] // scale:,}",
+                        f"{b['value'] // scale:,}",
+                        f"{b['open']:.2f}",
+                        f"{b['high']:.2f}",
+                        f"{b['low']:.2f}",
+                        f"{b['close']:.2f}",
+                        f"{b['change']:+.2f}",
+                        f"{b['trades']:,}",
+                    ]
+                )
+            day += dt.timedelta(days=1)
+        if market == "TPEX":
+            return {
+                "stat": "ok",
+                "reportDate": f"{year - ROC_START_YEAR}/{month:02d}",
+                "aaData": rows,
+            }
+        if not rows:
+            return {"stat": NO_DATA}
+        return {
+            "stat": "OK",
+            "date": f"{year}{month:02d}01",
+            "fields": [],
+            "data": rows,
+        }
+
+    def _day_bars(
+        self, market: str, day: dt.date
+    ) -> List[Tuple[str, Dict[str, float]]]:
+        return [(code, self.bar(code, day)) for code in self.codes(market)]
+
+    def mi_index(self, day: dt.date) -> Dict[str, Any]:
+        if not is_trading_day(day):
+            return {"stat": NO_DATA}
+        rows = []
+        for code, b in self._day_bars("TWSE", day):
+            sign = (
+                "<p style= color:green>-</p>"
+                if b["change"] < 0
+                else "<p style= color:red>+</p>"
+            )
+            rows.append(
+                [
+                    code,
+                    self.names[code],
+                    f"{b['volume']:,}",
+                    f"{b['trades']:,}",
+                    f"{b['value']:,}",
+                    f"{b['open']:.2f}",
+                    f"{b['high']:.2f}",
+                    f"{b['low']:.2f}",
+                    f"{b['close']:.2f}",
+                    sign,
+                    f"{abs(b['change']):.2f}",
+                    f"{b['close']:.2f}",
+                    "10",
+                    f"{b['close'] + 0.05:.2f}",
+                    "12",
+                    "15.20",
+                ]
+            )
+        out: Dict[str, Any] = {
+            "stat": "OK",
+            "date": f"{day:%Y%m%d}",
+            "fields9": MI_INDEX_FIELDS,
+            "data9": rows,
+        }
+        # 指數、類股等表格：實際回應中佔相當比例，排行用不到
+        for n in range(1, 9):
+            out[f"fields{n}"] = [
+                "指數",
+                "收盤指數",
+                "漲跌(+/-)",
+                "漲跌點數",
+                "漲跌百分比(%)",
+            ]
+            out[f"data{n}"] = [
+                [f"類股指數{j}", "1,234.56", "+", "12.34", "1.01"] for j in range(60)
+            ]
+        return out
+
+    def tpex_quotes(self, day: dt.date) -> Dict[str, Any]:
+        if not is_trading_day(day):
+            return {"reportDate": _roc(day), "fields": TPEX_FIELDS, "aaData": []}
+        rows = [
+            [
+                code,
+                self.names[code],
+                f"{b['close']:.2f}",
+                f"{b['change']:+.2f}",
+                f"{b['open']:.2f}",
+                f"{b['high']:.2f}",
+                f"{b['low']:.2f}",
+                f"{b['close']:.2f}",
+                f"{b['volume']:,}",
+                f"{b['value']:,}",
+                f"{b['trades']:,}",
+            ]
+            for code, b in self._day_bars("TPEX", day)
+        ]
+        return {"reportDate": _roc(day), "fields": TPEX_FIELDS, "aaData": rows}
+
+    def mis(self, channels: List[Tuple[str, str]], now: dt.datetime) -> Dict[str, Any]:
+        day = now.date()
+        while not is_trading_day(day):
+            day -= dt.timedelta(days=1)
+        items = []
+        for ex, code in channels:
+            market = "TPEX" if ex == "otc" else "TWSE"
+            if self.markets.get(code) != market:
+                continue
+            b = self.bar(code, day)
+            items.append(
+                {
+                    "c": code,
+                    "ex": ex,
+                    "n": self.names[code],
+                    "z": f"{b['close']:.4f}",
+                    "o": f"{b['open']:.4f}",
+                    "h": f"{b['high']:.4f}",
+                    "l": f"{b['low']:.4f}",
+                    "y": f"{b['prev']:.4f}",
+                    "v": str(b["volume"] // 1000),
+                    "d": f"{day:%Y%m%d}",
+                    "t": now.strftime("%H:%M:%S"),
+                    "tlong": str(int(now.timestamp() * 1000)),
+                }
+            )
+        return {"msgArray": items, "rtcode": "0000", "rtmessage": "OK"}
+
+    def isin_page(self, market: str) -> bytes:
+        rows = ["<tr><td colspan=7><B>股票<B></td></tr>"]
+        rows += [
+            f"<tr><td>{code}　{self.names[code]}</td><td>TW000{code}000</td><td>2000/01/01</td></tr>"
+            for code in self.codes(market)
+        ]
+        html = "<html><body><table>" + "".join(rows) + "</table></body></html>"
+        return html.encode("cp950", errors="replace")
+
+
+class StubUpstream:
+    """本機上游伺服器；requests 以端點名計次（含錯誤/被限速的請求）。"""
+
+    def __init__(self, config: Optional[StubConfig] = None):
+        self.config = config or StubConfig()
+        self.data = MarketData(self.config.rows)
+        self.requests: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.throttled: Counter = Counter()
+        self.base_url = ""
+        self._rng = random.Random(self.config.seed)
+        self._tokens = max(1.0, self.config.throttle_rps)
+        self._updated = time.monotonic()
+        self._runner: Optional[web.AppRunner] = None
+        # 全市場回應很大且同一天內固定，序列化結果依 (端點, 日期) 快取
+        self._bodies: Dict[Tuple[str, dt.date], bytes] = {}
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get("/exchangeReport/STOCK_DAY", self._stock_day_twse)
+        app.router.add_get(
+            "/web/stock/aftertrading/daily_trading_info/st43_result.php",
+            self._stock_day_tpex,
+        )
+        app.router.add_get("/exchangeReport/MI_INDEX", self._mi_index)
+        app.router.add_get(
+            "/web/stock/aftertrading/otc_quotes_no1430/stk_wn1430_result.php",
+            self._tpex_quotes,
+        )
+        app.router.add_get("/stock/api/getStockInfo.jsp", self._mis)
+        app.router.add_get("/isin/C_public.jsp", self._isin)
+        app.router.add_get("/rwd/zh/holidaySchedule/holidaySchedule", self._holidays)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def reset_counts(self) -> None:
+        self.requests.clear()
+        self.errors.clear()
+        self.throttled.clear()
+
+    def _take_token(self) -> bool:
+        rps = self.config.throttle_rps
+        if rps <= 0:
+            return True
+        now = time.monotonic()
+        self._tokens = min(max(1.0, rps), self._tokens + (now - self._updated) * rps)
+        self._updated = now
+        if self._tokens < 1.0:
+            return False
+        self._tokens -= 1.0
+        return True
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        name = request.path.rsplit("/", 1)[-1].split(".", 1)[0]
+        self.requests[name] += 1
+        cfg = self.config
+        delay = cfg.latency_ms + (
+            self._rng.uniform(0, cfg.jitter_ms) if cfg.jitter_ms else 0.0
+        )
+        if delay > 0:
+            await asyncio.sleep(delay / 1000.0)
+        if not self._take_token():
+            self.throttled[name] += 1
+            return web.Response(status=403, text="blocked")
+        if cfg.error_rate and self._rng.random() < cfg.error_rate:
+            self.errors[name] += 1
+            return web.Response(status=500, text="error")
+        return await handler(request)
+
+    @staticmethod
+    def _json(payload: Dict[str, Any]) -> web.Response:
+        return web.Response(
+            body=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            content_type="application/json",
+        )
+
+    def _cached(self, name: str, day: dt.date, build) -> web.Response:
+        body = self._bodies.get((name, day))
+        if body is None:
+            body = self._bodies[(name, day)] = json.dumps(
+                build(), ensure_ascii=False
+            ).encode("utf-8")
+        return web.Response(body=body, content_type="application/json")
+
+    async def _stock_day_twse(self, request: web.Request) -> web.Response:
+        q = request.query
+        try:
+            day = dt.datetime.strptime(q.get("date", ""), "%Y%m%d").date()
+        except ValueError:
+            return self._json({"stat": NO_DATA})
+        return self._json(
+            self.data.stock_day(
+                "TWSE", q.get("stockNo", ""), day.year, day.month, dt.date.today()
+            )
+        )
+
+    async def _stock_day_tpex(self, request: web.Request) -> web.Response:
+        ymd = _parse_roc(request.query.get("d", ""))
+        if ymd is None:
+            return self._json({"stat": "ok", "aaData": []})
+        return self._json(
+            self.data.stock_day(
+                "TPEX", request.query.get("stkno", ""), ymd[0], ymd[1], dt.date.today()
+            )
+        )
+
+    async def _mi_index(self, request: web.Request) -> web.Response:
+        try:
+            day = dt.datetime.strptime(request.query.get("date", ""), "%Y%m%d").date()
+        except ValueError:
+            return self._json({"stat": NO_DATA})
+        return self._cached("MI_INDEX", day, lambda: self.data.mi_index(day))
+
+    async def _tpex_quotes(self, request: web.Request) -> web.Response:
+        ymd = _parse_roc(request.query.get("d", ""))
+        if ymd is None:
+            return self._json({"aaData": []})
+        day = dt.date(*ymd)
+        return self._cached("TPEX", day, lambda: self.data.tpex_quotes(day))
+
+    async def _mis(self, request: web.Request) -> web.Response:
+        channels = []
+        for ch in request.query.get("ex_ch", "").split("|"):
+            ex, _, rest = ch.partition("_")
+            if rest:
+                channels.append((ex, rest.split(".", 1)[0].upper()))
+        return self._json(self.data.mis(channels, dt.datetime.now()))
+
+    async def _isin(self, request: web.Request) -> web.Response:
+        market = "TPEX" if request.query.get("strMode") == "4" else "TWSE"
+        return web.Response(
+            body=self.data.isin_page(market), content_type="text/html", charset="cp950"
+        )
+
+    async def _holidays(self, request: web.Request) -> web.Response:
+        # 模擬器的行事曆沒有國定假日
+        return self._json({"stat": "ok", "data": []})
+
+    @contextlib.contextmanager
+    def patch(self) -> Iterator[None]:
+        """暫時把 app 的上游網址（主機部分）換成本機伺服器。"""
+        targets = [
+            (tw_markets.TWSEClient, "BASE"),
+            (tw_markets.TWSEClient, "MIS"),
+            (tw_markets.TPEXClient, "BASE"),
+            (rankings, "TWSE_MI_INDEX_URL"),
+            (rankings, "TPEX_QUOTES_URL"),
+            (symbols, "ISIN_URL"),
+            (trading_calendar, "HOLIDAY_SCHEDULE_URL"),
+        ]
+        saved = [(obj, attr, getattr(obj, attr)) for obj, attr in targets]
+        try:
+            for obj, attr, url in saved:
+                setattr(obj, attr, re.sub(r"^https?://[^/]+", self.base_url, url))
+            yield
+        finally:
+            for obj, attr, url in saved:
+                setattr(obj, attr, url)
@@ -2,23 +2,42 @@
 # File: bot.py
 # =========================
 from __future__ import annotations
+import asyncio
 import datetime as dt
+import logging
+import time
 from typing import Optional
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 
+from app import metrics, warm_state
+from app.bar_store import BAR_STORE
 from app.config import load_settings
-from app.tw_markets import fetch_daily, fetch_realtime
+from app.eod import EOD_INGESTOR
+from app.http_client import close_session, start_session
+from app.ratelimit import INTERACTIVE, set_priority
+from app.symbols import DIRECTORY, markets_for
+from app.tw_markets import fetch_daily, fetch_daily_range, fetch_realtime
 from app.formatting import (
     ohlc_embed,
     realtime_embed,
     gainers_embed,
     losers_embed,
     actives_embed,
+    range_embed,
+    indicators_embed,
+    stats_embed,
 )
-from app.markets_utils import auto_daily, find_last_daily, find_last_realtime
+from app.indicators import indicators_for
+from app.markets_utils import (
+    REALTIME_POLLER,
+    auto_daily,
+    find_last_daily,
+    find_last_realtime,
+)
+from app.watch import WATCH_MAX_MINUTES, cancel_watches, start_watch
 from app.rankings import (
     top_gainers as svc_top_gainers,
     top_losers as svc_top_losers,
@@ -26,7 +45,60 @@ from app.rankings import (
 )
 
 INTENTS = discord.Intents.default()
-BOT = commands.Bot(command_prefix="!", intents=INTENTS)
+log = logging.getLogger("stockbot")
+
+
+class StockTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # 指令處理期間的上游請求優先於背景回補/輪詢
+        set_priority(INTERACTIVE)
+        if metrics.METRICS_ENABLED:
+            interaction.extras["t0"] = time.perf_counter()
+        return True
+
+
+class StockBot(commands.Bot):
+    async def setup_hook(self) -> None:
+        # 共用 HTTP session 隨 bot 生命週期建立/關閉
+        await start_session()
+        await metrics.METRICS_SERVER.start()
+        # 載回上次關閉時的快取（月資料、排行快照、代號目錄）；目錄已是今日版本時預熱不會打上游
+        loaded = warm_state.load()
+        if loaded:
+            log.info("Warm state restored: %s", loaded)
+        await self._sync_commands()
+        # 代號目錄於背景預熱，避免第一個查詢等待 ISIN 清單
+        self._directory_warmup = asyncio.create_task(DIRECTORY.ensure_fresh())
+        # 盤後整批匯入全市場日線，當日查詢不必逐檔打 STOCK_DAY
+        EOD_INGESTOR.start()
+
+    async def _sync_commands(self) -> None:
+        # 全域 sync 慢且有速率限制：指令樹指紋與上次 sync 相同時略過
+        fingerprint = warm_state.tree_fingerprint(self.tree, self.application_id)
+        if not warm_state.needs_sync(fingerprint):
+            log.info("Slash commands unchanged, skipping sync")
+            return
+        try:
+            await self.tree.sync()
+        except Exception as e:
+            log.warning("Slash sync failed: %s", e)
+            return
+        warm_state.mark_synced(fingerprint)
+
+    async def close(self) -> None:
+        cancel_watches()
+        EOD_INGESTOR.stop()
+        try:
+            await super().close()
+        finally:
+            warm_state.save()
+            if BAR_STORE is not None:
+                await BAR_STORE.flush()
+            await metrics.METRICS_SERVER.stop()
+            await close_session()
+
+
+BOT = StockBot(command_prefix="!", intents=INTENTS, tree_cls=StockTree)
 
 
 def _parse_date(s: Optional[str]) -> Optional[dt.date]:
@@ -40,13 +112,34 @@ def _parse_date(s: Optional[str]) -> Optional[dt.date]:
     raise commands.BadArgument("日期格式錯誤，請用 YYYY-MM-DD。")
 
 
+async def _fail(interaction: discord.Interaction, e: Exception) -> None:
+    """指令失敗：記錄 log 並標記（延遲統計依此區分 outcome），再回覆使用者。"""
+    log.warning(
+        "/%s failed: %s",
+        interaction.command.name if interaction.command else "?",
+        e,
+        exc_info=e,
+    )
+    interaction.extras["failed"] = True
+    await interaction.followup.send(f"查詢失敗：{e}")
+
+
 @BOT.event
 async def on_ready():
-    try:
-        await BOT.tree.sync()
-    except Exception as e:
-        print("Slash sync failed:", e)
-    print(f"Logged in as {BOT.user} (ID: {BOT.user.id})")
+    # 每次重連都會觸發；指令 sync 已移至 setup_hook（每個行程至多一次）
+    log.info("Logged in as %s (ID: %s)", BOT.user, BOT.user.id)
+
+
+@BOT.event
+async def on_app_command_completion(interaction: discord.Interaction, command) -> None:
+    # 從 interaction_check（defer 前）到指令回傳（followup 已送出）
+    t0 = interaction.extras.get("t0")
+    if t0 is not None:
+        metrics.observe_command(
+            command.name,
+            time.perf_counter() - t0,
+            ok=not interaction.extras.get("failed"),
+        )
 
 
 @BOT.tree.command(name="search", description="自動判斷市場（可回補最近有資料的交易日）")
@@ -79,7 +172,7 @@ async def search_cmd(
             embed = ohlc_embed(f"{symbol} {market} 日線", payload)
             await interaction.followup.send(embed=embed)
     except Exception as e:
-        await interaction.followup.send(f"查詢失敗：{e}")
+        await _fail(interaction, e)
 
 
 @BOT.tree.command(name="daily", description="查詢日線 (TWSE/TPEX)")
@@ -105,10 +198,61 @@ async def daily(
         embed = ohlc_embed(f"{symbol} {market.value} 日線", payload)
         await interaction.followup.send(embed=embed)
     except Exception as e:
-        await interaction.followup.send(f"查詢失敗：{e}")
+        await _fail(interaction, e)
 
 
-@BOT.tree.command(name="realtime", description="查詢即時報價 (TWSE, 自動回補)")
+@BOT.tree.command(name="range", description="區間日線摘要：最高/最低/報酬/總量")
+@app_commands.describe(
+    symbol="股票代碼",
+    start="起日 YYYY-MM-DD，預設 end 前 30 天",
+    end="迄日 YYYY-MM-DD，預設今天",
+)
+async def range_cmd(
+    interaction: discord.Interaction,
+    symbol: str,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+):
+    await interaction.response.defer(thinking=True)
+    try:
+        end_d = _parse_date(end) or dt.date.today()
+        start_d = _parse_date(start) or end_d - dt.timedelta(days=30)
+        markets = await markets_for(symbol)
+        if not markets:
+            await interaction.followup.send(f"查無此代號：{symbol}")
+            return
+        series = await fetch_daily_range(symbol, markets[0], start_d, end_d)
+        embed = range_embed(f"{symbol} {series.market} 區間", series)
+        await interaction.followup.send(embed=embed)
+    except Exception as e:
+        await _fail(interaction, e)
+
+
+@BOT.tree.command(name="indicators", description="技術指標：MA5/20/60、RSI、MACD、KD")
+@app_commands.describe(symbol="股票代碼", date="基準日 YYYY-MM-DD，預設今天")
+async def indicators_cmd(
+    interaction: discord.Interaction,
+    symbol: str,
+    date: Optional[str] = None,
+):
+    await interaction.response.defer(thinking=True)
+    try:
+        markets = await markets_for(symbol)
+        if not markets:
+            await interaction.followup.send(f"查無此代號：{symbol}")
+            return
+        ind = await indicators_for(symbol, markets[0], _parse_date(date))
+        if not ind:
+            await interaction.followup.send("找不到可計算指標的日線資料。")
+            return
+        await interaction.followup.send(
+            embed=indicators_embed(f"{symbol} {ind['market']} 技術指標", ind)
+        )
+    except Exception as e:
+        await _fail(interaction, e)
+
+
+@BOT.tree.command(name="realtime", description="查詢即時報價 (TWSE/TPEX, 自動回補)")
 @app_commands.describe(
     symbol="股票代碼",
     max_minutes="回補分鐘數 (預設環境值, 1-10)",
@@ -122,16 +266,55 @@ async def realtime(
 ):
     await interaction.response.defer(thinking=True)
     try:
-        data = await fetch_realtime(symbol)
-        if not data:
-            data = await find_last_realtime(symbol, max_minutes=max_minutes, interval_sec=interval_sec)
+        # 先查一次；無成交時盤中等待下一筆、休市時直接回最近收盤
+        data = await find_last_realtime(
+            symbol, max_minutes=max_minutes, interval_sec=interval_sec
+        )
         if not data:
             await interaction.followup.send("找不到有效的即時報價。")
             return
         embed = realtime_embed(symbol, data)
         await interaction.followup.send(embed=embed)
     except Exception as e:
-        await interaction.followup.send(f"查詢失敗：{e}")
+        await _fail(interaction, e)
+
+
+@BOT.tree.command(name="watch", description="即時看盤：同一則訊息隨成交更新")
+@app_commands.describe(
+    symbol="股票代碼",
+    minutes=f"看盤分鐘數 (1-{WATCH_MAX_MINUTES}, 預設 5)",
+)
+async def watch(
+    interaction: discord.Interaction,
+    symbol: str,
+    minutes: Optional[int] = 5,
+):
+    await interaction.response.defer(thinking=True)
+    try:
+        markets = await markets_for(symbol)
+        if not markets:
+            await interaction.followup.send(f"查無此代號：{symbol}")
+            return
+        minutes = max(1, min(int(minutes or 5), WATCH_MAX_MINUTES))
+        data = await fetch_realtime(symbol, markets[0])
+        message = await interaction.followup.send(
+            embed=realtime_embed(symbol, data or {}), wait=True
+        )
+    except Exception as e:
+        await _fail(interaction, e)
+        return
+
+    async def _edit(quote):
+        await message.edit(embed=realtime_embed(symbol, quote))
+
+    start_watch(
+        REALTIME_POLLER,
+        markets[0],
+        symbol.strip().upper(),
+        minutes,
+        _edit,
+        initial=data,
+    )
 
 
 # ---- 排行指令 ----
@@ -169,7 +352,7 @@ async def top_gainers(
         )
         await interaction.followup.send(embed=gainers_embed(payload))
     except Exception as e:
-        await interaction.followup.send(f"查詢失敗：{e}")
+        await _fail(interaction, e)
 
 
 @BOT.tree.command(name="top_losers", description="跌幅排行")
@@ -191,7 +374,7 @@ async def top_losers(
         )
         await interaction.followup.send(embed=losers_embed(payload))
     except Exception as e:
-        await interaction.followup.send(f"查詢失敗：{e}")
+        await _fail(interaction, e)
 
 
 @BOT.tree.command(name="actives", description="成交量排行")
@@ -213,9 +396,26 @@ async def actives(
         )
         await interaction.followup.send(embed=actives_embed(payload))
     except Exception as e:
-        await interaction.followup.send(f"查詢失敗：{e}")
+        await _fail(interaction, e)
+
+
+@BOT.tree.command(name="stats", description="（管理員）指令延遲、上游請求、快取命中率")
+@app_commands.default_permissions(administrator=True)
+@app_commands.guild_only()
+async def stats(interaction: discord.Interaction):
+    # default_permissions 只是預設值，伺服器可在整合設定中覆寫；執行時再確認一次
+    perms = getattr(interaction.user, "guild_permissions", None)
+    if not (perms and perms.administrator) and not await BOT.is_owner(interaction.user):
+        await interaction.response.send_message("此指令僅限伺服器管理員使用。", ephemeral=True)
+        return
+    await interaction.response.send_message(
+        embed=stats_embed(metrics.summary()), ephemeral=True
+    )
 
 
 if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
     settings = load_settings()
     BOT.run(settings.discord_token)
@@ -20,10 +20,13 @@ echo       - uses: actions/checkout@v4
 echo       - uses: actions/setup-python@v5
 echo         with:
 echo           python-version: "3.11"
-echo       - run: pip install -r requirements.txt
+echo       - run: pip install -r requirements.txt orjson  # orjson ΡACI @ִ
 echo       - run: ruff check .
 echo       - run: black --check .
 echo       - run: pytest
+echo       - run: python -m benchmarks.bench_upstream --smoke
+echo       - run: pip install discord.py==2.3.2
+echo       - run: pytest
 ) > ".github\workflows\ci.yml"
 
 echo.
@@ -0,0 +1,30 @@
+# =========================
+# File: tests/conftest.py
+# =========================
+import pytest
+import pytest_asyncio
+
+from app import http_client, symbols, trading_calendar
+
+
+@pytest.fixture(autouse=True)
+def _offline_symbol_directory(monkeypatch):
+    # 測試不抓 ISIN 清單：目錄停用時一律兩個市場都試
+    monkeypatch.setattr(symbols, "SYMBOL_DIRECTORY_ENABLED", False)
+    monkeypatch.setattr(symbols, "DIRECTORY", symbols.SymbolDirectory())
+
+
+@pytest.fixture(autouse=True)
+def _offline_trading_calendar(monkeypatch):
+    # 測試不抓休市日程：交易日曆只排除週末（個別測試以 load_year 指定休市日）
+    monkeypatch.setattr(trading_calendar, "HOLIDAY_FETCH_ENABLED", False)
+    monkeypatch.setattr(
+        trading_calendar, "CALENDAR", trading_calendar.TradingCalendar()
+    )
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def _close_shared_session():
+    # 測試中建立的共用 session 於各測試結束時關閉（每個測試各自一個 event loop）
+    yield
+    await http_client.close_session()
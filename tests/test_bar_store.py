@@ -0,0 +1,176 @@
+# =========================
+# File: tests/test_bar_store.py
+# =========================
+import datetime as dt
+
+import pytest
+
+from app import tw_markets
+from app.bar_store import BarStore
+from app.market_hours import TAIPEI_TZ
+from app.month_cache import MONTH_CACHE
+
+
+def _bar(close: float):
+    return {
+        "open": close,
+        "high": close + 1,
+        "low": close - 1,
+        "close": close,
+        "change": 0.5,
+        "volume": 1000.0,
+        "turnover": None,
+        "transactions": 3.0,
+    }
+
+
+def test_put_range_and_reload(tmp_path):
+    store = BarStore(str(tmp_path))
+    start = dt.date(2015, 1, 1)
+    bars = [(start + dt.timedelta(days=i), _bar(100 + i)) for i in range(3650)]
+    store.put("TWSE", "2330", bars)
+    store.put("TWSE", "2330", [(start, _bar(1.0))])  # 同日覆寫
+
+    reloaded = BarStore(str(tmp_path))
+    s = reloaded.read_range("TWSE", "2330", dt.date(2016, 1, 1), dt.date(2016, 1, 31))
+    assert len(s) == 31
+    assert s.close[0] == 100 + (dt.date(2016, 1, 1) - start).days
+    assert reloaded.get("TWSE", "2330", start)["close"] == 1.0
+    assert reloaded.get("TWSE", "2330", start)["turnover"] is None
+    june = reloaded.read_range(
+        "TWSE", "2330", dt.date(2015, 6, 1), dt.date(2015, 6, 30)
+    )
+    assert len(june) == 30
+    assert not reloaded.read_range(
+        "TWSE", "2330", dt.date(2030, 1, 1), dt.date(2030, 1, 31)
+    )
+
+
+@pytest.mark.asyncio
+async def test_backfill_then_fetch_daily_reads_store(monkeypatch, tmp_path):
+    MONTH_CACHE.clear()
+    store = BarStore(str(tmp_path))
+    monkeypatch.setattr(tw_markets, "BAR_STORE", store)
+    calls = []
+
+    async def fake_stock_day(self, symbol, date):
+        calls.append((date.year, date.month))
+        roc = f"{date.year - 1911}/{date.month:02d}/05"
+        return {
+            "stat": "OK",
+            "data": [[roc, "1,000", "2,000", "10", "11", "9", "10.5", "-0.50", "7"]],
+        }
+
+    monkeypatch.setattr(tw_markets.TWSEClient, "stock_day", fake_stock_day)
+
+    n = await tw_markets.backfill_daily(
+        "2330", "TWSE", dt.date(2020, 1, 1), dt.date(2020, 3, 31), 0
+    )
+    assert n == 3 and calls == [(2020, 1), (2020, 2), (2020, 3)]
+    assert (
+        await tw_markets.backfill_daily(
+            "2330", "TWSE", dt.date(2020, 1, 1), dt.date(2020, 3, 31), 0
+        )
+        == 0
+    )
+
+    MONTH_CACHE.clear()
+    calls.clear()
+    payload = await tw_markets.fetch_daily("2330", "TWSE", dt.date(2020, 2, 5))
+    assert calls == []
+    assert payload["record"]["close"] == 10.5
+    assert payload["record"]["change"] == -0.5
+    assert payload["raw_date"] == "109/02/05"
+    MONTH_CACHE.clear()
+
+
+@pytest.mark.asyncio
+async def test_put_in_loop_writes_in_background_and_coalesces(tmp_path):
+    store = BarStore(str(tmp_path))
+    batches = []
+    write = store._write_batch
+    store._write_batch = lambda batch: (batches.append(sorted(batch)), write(batch))
+    start = dt.date(2020, 1, 1)
+    store.put(
+        "TWSE",
+        "2330",
+        [(start + dt.timedelta(days=i), _bar(10 + i)) for i in range(31)],
+        complete=[(2020, 1)],
+    )
+    store.put(
+        "TWSE",
+        "2330",
+        [(dt.date(2020, 1, 10), _bar(1.0)), (dt.date(2020, 2, 3), _bar(2.0))],
+    )
+    # 記憶體立即可見；檔案於背景落地，同一序列只寫最後一版
+    assert store.get("TWSE", "2330", dt.date(2020, 1, 10))["close"] == 1.0
+    assert store.get("TWSE", "2330", dt.date(2020, 1, 11))["close"] == 20.0
+    await store.flush()
+    assert batches == [[("TWSE", "2330")]]
+
+    reloaded = BarStore(str(tmp_path))
+    assert len(reloaded.series("TWSE", "2330")) == 32
+    assert reloaded.month_complete("TWSE", "2330", 2020, 1)
+    assert not reloaded.month_complete("TWSE", "2330", 2020, 2)
+    assert reloaded.read_range(
+        "TWSE", "2330", dt.date(2020, 2, 1), dt.date(2020, 2, 29)
+    )
+
+
+@pytest.mark.asyncio
+async def test_range_refetches_month_cached_mid_way(monkeypatch, tmp_path):
+    MONTH_CACHE.clear()
+    store = BarStore(str(tmp_path))
+    monkeypatch.setattr(tw_markets, "BAR_STORE", store)
+    now = dt.datetime(2025, 8, 20, 15, 0, tzinfo=TAIPEI_TZ)
+    monkeypatch.setattr(tw_markets, "taipei_now", lambda: now)
+    monkeypatch.setattr(MONTH_CACHE, "clock", lambda: now)
+
+    async def fake_stock_day(self, symbol, date):
+        last = 31 if now.month > 8 else now.day
+        rows = [
+            [f"114/08/{d:02d}", "1,000", "2,000", "10", "11", "9", str(d), "+0.50", "7"]
+            for d in range(1, last + 1)
+            if dt.date(2025, 8, d).weekday() < 5
+        ]
+        return {"stat": "OK", "data": rows}
+
+    monkeypatch.setattr(tw_markets.TWSEClient, "stock_day", fake_stock_day)
+    august = (dt.date(2025, 8, 1), dt.date(2025, 8, 31))
+
+    partial = await tw_markets.fetch_daily_range("2330", "TWSE", *august)
+    assert len(partial) == 14 and not store.month_complete("TWSE", "2330", 2025, 8)
+    # 舊版會把進行中的月份寫入儲存：模擬留下的半個月資料
+    store.put_series(partial)
+
+    # 進入 9 月：8 月需完整取回並落地
+    now = dt.datetime(2025, 9, 2, 10, 0, tzinfo=TAIPEI_TZ)
+    full = await tw_markets.fetch_daily_range("2330", "TWSE", *august)
+    assert len(full) == 21 and full.close[-1] == 29.0
+    assert store.month_complete("TWSE", "2330", 2025, 8)
+    await store.flush()
+    MONTH_CACHE.clear()
+
+
+def test_backfill_cli_resolves_market_and_flushes(monkeypatch, tmp_path):
+    store = BarStore(str(tmp_path))
+    monkeypatch.setattr(tw_markets, "BAR_STORE", store)
+    calls = []
+
+    async def fake_backfill(symbol, market, start, end, interval):
+        calls.append((symbol, market, start, end, interval))
+        store.put(market, symbol, [(start, _bar(10.0))], complete=[(2020, 1)])
+        return 1
+
+    async def fake_markets_for(symbol):
+        return ("TPEX",) if symbol == "6488" else ("TWSE", "TPEX")
+
+    monkeypatch.setattr(tw_markets, "backfill_daily", fake_backfill)
+    monkeypatch.setattr(tw_markets, "markets_for", fake_markets_for)
+
+    rc = tw_markets.main(
+        ["backfill", "6488", "9999", "--start", "2020-01-01", "--interval", "0"]
+    )
+    assert rc == 0
+    assert calls == [("6488", "TPEX", dt.date(2020, 1, 1), None, 0.0)]
+    assert BarStore(str(tmp_path)).month_complete("TPEX", "6488", 2020, 1)
@@ -0,0 +1,176 @@
+# =========================
+# File: tests/test_eod.py
+# =========================
+import datetime as dt
+
+import pytest
+
+from app import eod, markets_utils, rankings, tw_markets
+from app.market_hours import TAIPEI_TZ, close_update_at
+
+DAY = dt.date(2025, 8, 8)
+
+MI_INDEX = {
+    "stat": "OK",
+    "fields9": [
+        "證券代號",
+        "證券名稱",
+        "成交股數",
+        "成交筆數",
+        "成交金額",
+        "開盤價",
+        "最高價",
+        "最低價",
+        "收盤價",
+        "漲跌(+/-)",
+        "漲跌價差",
+        "最後揭示買價",
+    ],
+    "data9": [
+        [
+            "2330",
+            "台積電",
+            "2,000,000",
+            "12,345",
+            "1,800,000,000",
+            "910.00",
+            "915.00",
+            "890.00",
+            "900.00",
+            "<p style= color:green>-</p>",
+            "10.00",
+            "899.00",
+        ],
+    ],
+}
+TPEX_QUOTES = {
+    "fields": [
+        "代號",
+        "名稱",
+        "收盤",
+        "漲跌",
+        "開盤",
+        "最高",
+        "最低",
+        "均價",
+        "成交股數",
+        "成交金額(元)",
+        "成交筆數",
+    ],
+    "aaData": [
+        [
+            "8431",
+            "匯鑽科",
+            "33.00",
+            "+3.00",
+            "30.00",
+            "33.00",
+            "29.80",
+            "32.00",
+            "300,000",
+            "9,900,000",
+            "3,000",
+        ]
+    ],
+}
+
+
+@pytest.fixture(autouse=True)
+def _clear():
+    rankings.SNAPSHOTS.clear()
+    yield
+    rankings.SNAPSHOTS.clear()
+
+
+def _after_close(day: dt.date) -> dt.datetime:
+    return close_update_at(day) + dt.timedelta(minutes=10)
+
+
+def _no_stock_day(monkeypatch):
+    async def boom(self, symbol, date):
+        raise AssertionError("STOCK_DAY should not be called")
+
+    monkeypatch.setattr(tw_markets.TWSEClient, "stock_day", boom)
+    monkeypatch.setattr(tw_markets.TPEXClient, "stock_day", boom)
+
+
+def test_snapshot_keeps_ohlc_columns():
+    snap = rankings.Snapshot.parse(MI_INDEX, "TWSE", DAY)
+    i = snap.index_of("2330")
+    assert i == 0 and snap.index_of("9999") == -1
+    assert snap.record(i) == {
+        "open": 910.0,
+        "high": 915.0,
+        "low": 890.0,
+        "close": 900.0,
+        "change": -10.0,
+        "volume": 2_000_000.0,
+        "turnover": 1_800_000_000.0,
+        "transactions": 12_345.0,
+    }
+    tpex = rankings.Snapshot.parse(TPEX_QUOTES, "TPEX", DAY)
+    assert tpex.record(0)["open"] == 30.0 and tpex.record(0)["transactions"] == 3000.0
+
+
+def test_final_requires_after_close_fetch():
+    snap = rankings.Snapshot.parse(MI_INDEX, "TWSE", DAY)
+    rankings.SNAPSHOTS.put(snap, dt.datetime(2025, 8, 8, 11, 0, tzinfo=TAIPEI_TZ))
+    assert rankings.SNAPSHOTS.final("TWSE", DAY) is None
+    rankings.SNAPSHOTS.put(snap, _after_close(DAY))
+    assert rankings.SNAPSHOTS.final("TWSE", DAY) is snap
+    rankings.SNAPSHOTS.put(rankings.Snapshot("TPEX", DAY), _after_close(DAY))
+    assert rankings.SNAPSHOTS.final("TPEX", DAY) is None  # 空表不算
+
+
+@pytest.mark.asyncio
+async def test_fetch_daily_and_auto_daily_answer_from_snapshot(monkeypatch):
+    _no_stock_day(monkeypatch)
+    rankings.SNAPSHOTS.put(
+        rankings.Snapshot.parse(MI_INDEX, "TWSE", DAY), _after_close(DAY)
+    )
+    rankings.SNAPSHOTS.put(
+        rankings.Snapshot.parse(TPEX_QUOTES, "TPEX", DAY), _after_close(DAY)
+    )
+
+    payload = await tw_markets.fetch_daily("2330", "TWSE", DAY)
+    assert payload["record"]["close"] == 900.0 and payload["raw_date"] == "114/08/08"
+
+    # 代號目錄停用時兩個市場都可能；由快照直接判斷為 TPEX
+    market, payload = await markets_utils.auto_daily("8431", DAY)
+    assert market == "TPEX" and payload["record"]["change"] == 3.0
+    market, payload, used = await markets_utils.find_last_daily("2330", DAY)
+    assert (market, used) == ("TWSE", DAY)
+
+
+@pytest.mark.asyncio
+async def test_ingest_loads_both_markets(monkeypatch):
+    calls = []
+
+    async def fake_load(market, date):
+        calls.append(market)
+        return rankings.Snapshot.parse(
+            MI_INDEX if market == "TWSE" else TPEX_QUOTES, market, date
+        )
+
+    monkeypatch.setattr(rankings, "_load_snapshot", fake_load)
+    assert await eod.ingest(DAY) == {"TWSE": 1, "TPEX": 1}
+    assert eod.is_ingested(DAY)
+    # 已定稿：不再打上游
+    await eod.ingest(DAY)
+    assert calls == ["TWSE", "TPEX"]
+
+
+def test_next_run_schedule():
+    ing = eod.EodIngestor(delay_sec=600)
+    friday_noon = dt.datetime(2025, 8, 8, 12, 0, tzinfo=TAIPEI_TZ)
+    assert ing.next_run(friday_noon) == dt.datetime(
+        2025, 8, 8, 14, 40, tzinfo=TAIPEI_TZ
+    )
+    # 盤後重啟且尚未匯入：立即執行
+    friday_late = dt.datetime(2025, 8, 8, 18, 0, tzinfo=TAIPEI_TZ)
+    assert ing.next_run(friday_late) == friday_late
+    # 今日已處理：跳過週末到下週一
+    ing.last_date = DAY
+    assert ing.next_run(friday_late) == dt.datetime(
+        2025, 8, 11, 14, 40, tzinfo=TAIPEI_TZ
+    )
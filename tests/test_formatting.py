@@ -0,0 +1,52 @@
+# =========================
+# File: tests/test_formatting.py
+# =========================
+from app import formatting
+
+
+def _item(i: int, name: str = "測試"):
+    return {
+        "market": "TWSE",
+        "symbol": f"{1000 + i}",
+        "name": name,
+        "close": 10.0 + i,
+        "change": 0.5,
+        "change_pct": 1.23,
+        "volume": 1e6,
+        "value": 2e7,
+        "display": {},
+    }
+
+
+def test_large_limit_paginates_fields_under_1024_chars():
+    items = [_item(i, "很長的公司名稱" * 3) for i in range(50)]
+    embed = formatting.rank_embed(
+        {"date": "2025-08-08", "items": items}, "漲幅排行", "movers", 0
+    )
+    assert len(embed.fields) > 1
+    assert all(len(f.value) <= formatting.FIELD_VALUE_MAX for f in embed.fields)
+    text = "\n".join(f.value for f in embed.fields)
+    assert text.count("\n**") == 49 and "**50. " in text
+
+
+def test_render_cache_reuses_embed_and_item_lines(monkeypatch):
+    formatting._RENDERED.clear()
+    items = [_item(i) for i in range(3)]
+    payload = {
+        "date": "2025-08-08",
+        "items": items,
+        "source": "TWSE",
+        "version": ("gainers", 1),
+    }
+    first = formatting.gainers_embed(payload)
+    title, detail = items[0]["display"]["movers"]
+    assert title == "[TWSE] 1000 測試" and detail.startswith("收盤 ")
+    assert "**1. [TWSE] 1000 測試**\n收盤 " in first.fields[0].value
+
+    calls = []
+    monkeypatch.setattr(formatting, "_build_rank_embed", lambda *a: calls.append(a))
+    first.add_field(name="x", value="y")  # 呼叫端修改不影響快取
+    again = formatting.gainers_embed(payload)
+    assert calls == [] and again.to_dict()["fields"] == first.to_dict()["fields"][:-1]
+    assert again.footer.text == "來源：TWSE"
+    formatting._RENDERED.clear()
@@ -0,0 +1,37 @@
+# =========================
+# File: tests/test_http_client.py
+# =========================
+import pytest
+
+from app import http_client
+
+
+@pytest.mark.asyncio
+async def test_session_is_shared_until_closed():
+    s1 = await http_client.get_session()
+    s2 = await http_client.get_session()
+    assert s1 is s2
+    assert s1.connector.limit_per_host == http_client.HTTP_LIMIT_PER_HOST
+
+    await http_client.close_session()
+    assert s1.closed
+
+    s3 = await http_client.get_session()
+    assert s3 is not s1
+    await http_client.close_session()
+
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_decode_json_bytes_keep_and_fallback(monkeypatch, fast):
+    if not fast:
+        monkeypatch.setattr(http_client, "_orjson", None)
+    body = '{"stat": "OK", "data9": [["2330", "台積電"]], "data1": [[1]]}'.encode(
+        "utf-8"
+    )
+    assert http_client.decode_json(body)["data1"] == [[1]]
+    assert http_client.decode_json(body, keep=("stat", "data9", "tables")) == {
+        "stat": "OK",
+        "data9": [["2330", "台積電"]],
+    }
+    assert http_client.decode_json(b"\xef\xbb\xbf" + body)["stat"] == "OK"  # BOM
+    assert http_client.decode_json(b"  ") is None
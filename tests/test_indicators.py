@@ -0,0 +1,76 @@
+# =========================
+# File: tests/test_indicators.py
+# =========================
+import math
+from array import array
+
+import numpy as np
+
+from app.bar_store import BarSeries
+from app.indicators import IndicatorCache, build_states
+
+
+def _series(symbol: str, n: int, seed: int = 0) -> BarSeries:
+    rng = np.random.default_rng(seed)
+    c = 100 + np.cumsum(rng.normal(0, 1, n))
+    return BarSeries(
+        "TWSE",
+        symbol,
+        array("q", range(737000, 737000 + n)),
+        close=array("d", c),
+        # 高低不對稱：補齊若用各自首值，KD 的 RSV 不會停在 50
+        high=array("d", c + rng.uniform(0.5, 3.0, n)),
+        low=array("d", c - rng.uniform(0.0, 1.0, n)),
+        volume=array("d", rng.integers(1, 1000, n).astype(float)),
+    )
+
+
+def _same(a, b):
+    for k, v in a.items():
+        if isinstance(v, float):
+            assert (math.isnan(v) and math.isnan(b[k])) or abs(v - b[k]) < 1e-9, k
+        else:
+            assert v == b[k], k
+
+
+def test_known_values_on_linear_series():
+    n = 80
+    c = np.arange(1.0, n + 1)
+    s = BarSeries(
+        "TWSE",
+        "1",
+        array("q", range(1, n + 1)),
+        close=array("d", c),
+        high=array("d", c),
+        low=array("d", c),
+        volume=array("d", c),
+    )
+    ind = build_states([s])[0].latest()
+    assert ind["ma5"] == np.mean(c[-5:]) and ind["ma60"] == np.mean(c[-60:])
+    assert ind["rsi"] == 100.0  # 只漲不跌
+    assert abs(ind["k"] - 100.0) < 1e-6 and ind["macd"] > 0
+
+
+def test_incremental_matches_full_and_batch_padding():
+    s = _series("x", 120)
+    cache = IndicatorCache()
+    cache.update(s.slice(0, 119))
+    inc = cache.update(s)
+    assert cache.incremental == 1 and cache.full == 1
+    full = build_states([s])[0].latest()
+    _same(inc, full)
+    # 不同長度的序列一起計算（左側補齊）結果不變
+    _same(build_states([_series("y", 300, 1), s])[1].latest(), full)
+    # 補齊的影響在短序列上最明顯（KD 的平滑來不及淡化）
+    head = s.slice(0, 12)
+    _same(
+        build_states([_series("y", 300, 1), head])[1].latest(),
+        build_states([head])[0].latest(),
+    )
+    # 短於各視窗時對應指標為 NaN
+    short = build_states([s.slice(0, 10)])[0].latest()
+    assert (
+        math.isnan(short["ma20"])
+        and math.isnan(short["rsi"])
+        and not math.isnan(short["k"])
+    )
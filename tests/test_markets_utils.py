@@ -0,0 +1,91 @@
+# =========================
+# File: tests/test_markets_utils.py
+# =========================
+import datetime as dt
+
+import pytest
+
+from app import markets_utils, tw_markets
+
+
+def _twse_row(day: str, close: str):
+    return [day, "1,000", "100,000", close, close, close, close, "+0.50", "10"]
+
+
+@pytest.mark.asyncio
+async def test_find_last_daily_month_mode_crosses_month_once(monkeypatch):
+    calls = []
+
+    async def fake_month(market, symbol, date):
+        calls.append((market, date.month))
+        if market == "TWSE" and date.month == 1:
+            return tw_markets.parse_month(
+                market,
+                symbol,
+                {"stat": "OK", "data": [_twse_row("114/01/24", "600.00")]},
+            )
+        return tw_markets.parse_month(market, symbol, {"stat": "OK", "data": []})
+
+    monkeypatch.setattr(tw_markets, "_stock_day_cached", fake_month)
+    monkeypatch.setattr(markets_utils, "BACKTRACK_MODE", "month")
+
+    # 2025 春節連假：2/1 往前只需 2 月 + 1 月兩次請求
+    market, payload, used = await markets_utils.find_last_daily(
+        "2330", dt.date(2025, 2, 3)
+    )
+    assert market == "TWSE"
+    assert used == dt.date(2025, 1, 24)
+    assert payload["record"]["close"] == 600.0
+    assert calls == [("TWSE", 2), ("TWSE", 1)]
+
+    # 2/1 為週六：交易日曆直接從 1/31 起算，不必抓 2 月
+    calls.clear()
+    market, payload, used = await markets_utils.find_last_daily(
+        "2330", dt.date(2025, 2, 1)
+    )
+    assert used == dt.date(2025, 1, 24)
+    assert calls == [("TWSE", 1)]
+
+
+@pytest.mark.asyncio
+async def test_find_last_daily_month_mode_respects_backtrack_limit(monkeypatch):
+    async def fake_month(market, symbol, date):
+        return tw_markets.parse_month(
+            market, symbol, {"stat": "OK", "data": [_twse_row("114/01/02", "600.00")]}
+        )
+
+    monkeypatch.setattr(tw_markets, "_stock_day_cached", fake_month)
+    monkeypatch.setattr(markets_utils, "BACKTRACK_MODE", "month")
+    monkeypatch.setattr(markets_utils, "MAX_BACKTRACK_DAYS", 14)
+
+    assert await markets_utils.find_last_daily("2330", dt.date(2025, 1, 31)) == (
+        None,
+        None,
+        None,
+    )
+
+
+@pytest.mark.asyncio
+async def test_auto_daily_race_first_record_wins_and_is_remembered(monkeypatch):
+    import asyncio
+
+    calls = []
+
+    async def fake_fetch_daily(symbol, market, date):
+        calls.append(market)
+        if market == "TWSE":
+            await asyncio.sleep(10)  # 應被取消
+            return {"record": None}
+        return {"market": market, "record": {"close": 33.0}}
+
+    monkeypatch.setattr(markets_utils, "fetch_daily", fake_fetch_daily)
+
+    market, payload = await markets_utils.auto_daily(
+        "8431", dt.date(2025, 8, 8), race=True
+    )
+    assert market == "TPEX"
+    assert payload["record"]["close"] == 33.0
+
+    calls.clear()
+    await markets_utils.auto_daily("8431", dt.date(2025, 8, 8), race=True)
+    assert calls == ["TPEX"]
@@ -0,0 +1,105 @@
+# =========================
+# File: tests/test_metrics.py
+# =========================
+import socket
+
+import aiohttp
+import pytest
+
+from app import metrics, resilience
+from app.formatting import stats_embed
+from app.ratelimit import LIMITER
+
+
+@pytest.fixture(autouse=True)
+def _reset(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", True)
+    monkeypatch.setattr(LIMITER, "enabled", False)
+    metrics.reset()
+    resilience.BREAKERS.clear()
+    yield
+    metrics.reset()
+    resilience.BREAKERS.clear()
+
+
+def test_histogram_quantile_and_render():
+    h = metrics.Histogram("x_seconds", "x", ("cmd",), (0.1, 1.0))
+    for v in (0.05, 0.05, 0.5, 5.0):
+        h.observe(v, "daily")
+    assert h.count(("daily",)) == 4
+    assert h.quantile(0.5, ("daily",)) == 0.1
+    assert h.quantile(0.75, ("daily",)) == 1.0
+    assert h.quantile(0.99, ("daily",)) == float("inf")
+    text = "\n".join(h.render())
+    assert 'x_seconds_bucket{cmd="daily",le="0.1"} 2' in text
+    assert 'x_seconds_bucket{cmd="daily",le="+Inf"} 4' in text
+    assert 'x_seconds_count{cmd="daily"} 4' in text
+
+
+def test_endpoint_and_status():
+    assert metrics.endpoint_of("/exchangeReport/STOCK_DAY") == "STOCK_DAY"
+    assert metrics.endpoint_of("/stock/api/getStockInfo.jsp") == "getStockInfo"
+    assert metrics.status_of(None) == "200"
+    assert metrics.status_of(RuntimeError("TWSE HTTP 503")) == "503"
+    assert metrics.status_of(TimeoutError()) == "TimeoutError"
+
+
+def test_disabled_records_nothing(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", False)
+    metrics.observe_upstream("h", "/a", 0.1)
+    metrics.observe_command("daily", 0.1)
+    assert not metrics.UPSTREAM_REQUESTS.values
+    assert not metrics.COMMAND_LATENCY.series
+
+
+@pytest.mark.asyncio
+async def test_guarded_records_status_and_latency():
+    async def ok():
+        return 1
+
+    async def boom():
+        raise RuntimeError("HTTP 500")
+
+    url = "https://www.twse.com.tw/exchangeReport/STOCK_DAY?x=1"
+    assert await resilience.guarded(url, ok) == 1
+    with pytest.raises(RuntimeError):
+        await resilience.guarded(url, boom)
+    reqs = metrics.UPSTREAM_REQUESTS.values
+    assert reqs[("www.twse.com.tw", "STOCK_DAY", "200")] == 1
+    assert reqs[("www.twse.com.tw", "STOCK_DAY", "500")] == 1
+    assert metrics.UPSTREAM_LATENCY.count(("www.twse.com.tw", "STOCK_DAY")) == 2
+
+
+def test_summary_and_stats_embed():
+    metrics.observe_command("daily", 0.03)
+    metrics.observe_command("daily", 0.2, ok=False)
+    metrics.observe_upstream("www.twse.com.tw", "/rwd/zh/afterTrading/MI_INDEX", 0.1)
+    s = metrics.summary()
+    assert s["commands"]["daily"]["count"] == 2
+    assert s["commands"]["daily"]["errors"] == 1
+    assert s["upstream"]["www.twse.com.tw"] == {"200": 1}
+    assert "month" in s["caches"]
+    embed = stats_embed(s)
+    assert "/daily" in embed.fields[0].value
+
+
+@pytest.mark.asyncio
+async def test_server_exposes_prometheus_text():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = metrics.MetricsServer()
+    metrics.observe_command("search", 0.01)
+    await server.start("127.0.0.1", port)
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{port}/metrics") as resp:
+                assert resp.status == 200
+                text = await resp.text()
+    finally:
+        await server.stop()
+    assert (
+        'stockbot_command_latency_seconds_count{command="search",outcome="ok"} 1'
+        in text
+    )
+    assert "stockbot_cache_hits_total" in text
@@ -0,0 +1,57 @@
+# =========================
+# File: tests/test_month_cache.py
+# =========================
+import datetime as dt
+
+from app.market_hours import TAIPEI_TZ
+from app.tw_markets import parse_month
+from app.month_cache import MonthCache
+
+
+class FakeClock:
+    def __init__(self, now: dt.datetime):
+        self.now = now
+
+    def __call__(self) -> dt.datetime:
+        return self.now
+
+
+def _at(h: int, m: int = 0, day: int = 15) -> dt.datetime:
+    return dt.datetime(2025, 8, day, h, m, tzinfo=TAIPEI_TZ)
+
+
+def test_past_month_is_immutable_and_persisted(tmp_path):
+    clock = FakeClock(_at(10))
+    cache = MonthCache(ttl_sec=60, persist_dir=str(tmp_path), clock=clock)
+    row = ["114/07/03", "1,000", "2,000", "10", "11", "9", "10.5", "-0.50", "7"]
+    bars = parse_month("TWSE", "2330", {"stat": "OK", "data": [row]})
+    cache.put("TWSE", "2330", dt.date(2025, 7, 3), bars)
+
+    clock.now = _at(10, day=31)
+    assert cache.get("TWSE", "2330", dt.date(2025, 7, 28)) is bars
+
+    # 新的快取實例可從磁碟讀回
+    fresh = MonthCache(ttl_sec=60, persist_dir=str(tmp_path), clock=clock)
+    loaded = fresh.get("TWSE", "2330", dt.date(2025, 7, 1))
+    assert list(loaded.days) == list(bars.days) and loaded.record(0) == bars.record(0)
+
+
+def test_current_month_expires_on_ttl_and_close_update(tmp_path):
+    clock = FakeClock(_at(10))
+    cache = MonthCache(ttl_sec=600, persist_dir=str(tmp_path), clock=clock)
+    row = ["114/08/14", "1,000", "2,000", "10", "11", "9", "10.5", "-0.50", "7"]
+    bars = parse_month("TPEX", "8431", {"aaData": [row]})
+    assert len(bars) == 1
+    cache.put("TPEX", "8431", dt.date(2025, 8, 15), bars)
+    # 當月資料不落地
+    assert not list(tmp_path.rglob("*.bars"))
+
+    clock.now = _at(10, 5)
+    assert cache.get("TPEX", "8431", dt.date(2025, 8, 1)) is bars
+    clock.now = _at(10, 11)
+    assert cache.get("TPEX", "8431", dt.date(2025, 8, 1)) is None
+
+    clock.now = _at(14, 25)
+    cache.put("TPEX", "8431", dt.date(2025, 8, 15), bars)
+    clock.now = _at(14, 31)
+    assert cache.get("TPEX", "8431", dt.date(2025, 8, 15)) is None
@@ -1,6 +1,7 @@
 # =========================
 # File: tests/test_rankings.py
 # =========================
+import asyncio
 import json
 import datetime as dt
 import pathlib
@@ -12,7 +13,11 @@ FIXTURE_TWSE = pathlib.Path(__file__).parent / "fixtures" / "mi_index_sample.jso
 FIXTURE_TPEX = pathlib.Path(__file__).parent / "fixtures" / "tpex_quotes_sample.json"
 
 
-
+@pytest.fixture(autouse=True)
+def _clear_snapshot_cache():
+    rankings.SNAPSHOTS.clear()
+    yield
+    rankings.SNAPSHOTS.clear()
 
 
 @pytest.fixture()
@@ -71,6 +76,30 @@ async def test_most_actives_all(monkeypatch, mi_payload, tpex_payload):
     assert result["items"][0]["market"] == "TPEX"
 
 
+@pytest.mark.asyncio
+async def test_all_fetches_both_markets_concurrently(
+    monkeypatch, mi_payload, tpex_payload
+):
+    started = {"TWSE": asyncio.Event(), "TPEX": asyncio.Event()}
+
+    async def fetch(market, other, payload):
+        # 依序抓取時另一個市場永遠不會開始，逾時失敗
+        started[market].set()
+        await asyncio.wait_for(started[other].wait(), 1)
+        return payload
+
+    async def fake_twse(date: dt.date):
+        return await fetch("TWSE", "TPEX", mi_payload)
+
+    async def fake_tpex(date: dt.date):
+        return await fetch("TPEX", "TWSE", tpex_payload)
+
+    monkeypatch.setattr(rankings, "_fetch_twse_mi_index", fake_twse)
+    monkeypatch.setattr(rankings, "_fetch_tpex_quotes", fake_tpex)
+
+    result = await rankings.top_gainers(limit=3, date=dt.date(2025, 8, 8), market="ALL")
+    assert len(result["items"]) == 3 and result["items"][0]["symbol"] == "8431"
+
 
 @pytest.mark.asyncio
 async def test_top_gainers(monkeypatch, mi_payload):
@@ -107,3 +136,148 @@ async def test_most_actives(monkeypatch, mi_payload):
     result = await rankings.most_actives(limit=1, date=dt.date(2025, 8, 8))
     codes = [it["symbol"] for it in result["items"]]
     assert codes[0] == "2603"  # largest volume
+
+
+def test_snapshot_parses_signed_change_without_pct_column():
+    payload = {
+        "tables": [
+            {
+                "fields": ["指數", "收盤指數"],
+                "data": [["發行量加權股價指數", "23,000.00"]],
+            },
+            {
+                "fields": [
+                    "證券代號",
+                    "證券名稱",
+                    "成交股數",
+                    "成交筆數",
+                    "成交金額",
+                    "開盤價",
+                    "最高價",
+                    "最低價",
+                    "收盤價",
+                    "漲跌(+/-)",
+                    "漲跌價差",
+                ],
+                "data": [
+                    [
+                        "2330",
+                        "台積電",
+                        "2,000",
+                        "10",
+                        "1,800,000",
+                        "910.00",
+                        "915.00",
+                        "890.00",
+                        "900.00",
+                        "<p style= color:green>-</p>",
+                        "10.00",
+                    ],
+                    [
+                        "2317",
+                        "鴻海",
+                        "1,000",
+                        "10",
+                        "100,000",
+                        "--",
+                        "--",
+                        "--",
+                        "--",
+                        "<p> </p>",
+                        "0.00",
+                    ],
+                ],
+            },
+        ]
+    }
+    snap = rankings.Snapshot.parse(payload, "TWSE", dt.date(2025, 8, 8))
+    assert snap.symbols == ["2330", "2317"]
+    assert snap.change[0] == -10.0
+    assert round(snap.change_pct[0], 2) == -1.10
+    # 無成交者不進排行
+    assert snap.candidates(True, True) == [0]
+
+
+@pytest.mark.asyncio
+async def test_rank_types_share_one_snapshot_fetch(monkeypatch, mi_payload):
+    calls = 0
+
+    async def fake_fetch(date: dt.date):
+        nonlocal calls
+        calls += 1
+        return mi_payload
+
+    monkeypatch.setattr(rankings, "_fetch_twse_mi_index", fake_fetch)
+
+    day = dt.date(2025, 8, 8)
+    await rankings.top_gainers(limit=1, date=day)
+    await rankings.top_losers(limit=3, date=day, exclude_etf=False)
+    await rankings.most_actives(limit=2, date=day, exclude_warrants=False)
+    assert calls == 1
+
+
+def test_snapshot_ttl_follows_session():
+    from app.market_hours import TAIPEI_TZ
+
+    cache = rankings.SnapshotCache(max_entries=2, ttl_sec=60)
+    snap = rankings.Snapshot.parse(
+        {"data9": [["2330", "台積電", "1", "1", "1", "1", "1", "1", "900", "+", "1"]]},
+        "TWSE",
+        dt.date(2025, 8, 8),
+    )
+    intraday = dt.datetime(2025, 8, 8, 10, 0, tzinfo=TAIPEI_TZ)
+    assert cache.expires_at(snap, intraday) == intraday + dt.timedelta(seconds=60)
+    after_close = dt.datetime(2025, 8, 8, 15, 0, tzinfo=TAIPEI_TZ)  # 週五
+    assert cache.expires_at(snap, after_close) == dt.datetime(
+        2025, 8, 11, 9, 0, tzinfo=TAIPEI_TZ
+    )
+
+    for d in (8, 7, 6):
+        s = rankings.Snapshot(market="TWSE", date=dt.date(2025, 8, d))
+        cache.put(s, after_close)
+    assert cache.get("TWSE", dt.date(2025, 8, 8), after_close) is None  # LRU 淘汰
+
+
+@pytest.mark.asyncio
+async def test_default_date_uses_last_published_trading_day(monkeypatch, mi_payload):
+    from app.market_hours import TAIPEI_TZ
+
+    published = {dt.date(2026, 10, 15), dt.date(2026, 10, 16)}
+    fetched = []
+
+    async def fake_fetch(date: dt.date):
+        fetched.append(date)
+        return (
+            mi_payload if date in published else {"stat": "很抱歉，沒有符合條件的資料!"}
+        )
+
+    monkeypatch.setattr(rankings, "_fetch_twse_mi_index", fake_fetch)
+
+    # 週六：直接取週五，不打週六的空表
+    monkeypatch.setattr(
+        rankings,
+        "taipei_now",
+        lambda: dt.datetime(2026, 10, 17, 10, 0, tzinfo=TAIPEI_TZ),
+    )
+    result = await rankings.top_gainers(limit=3)
+    assert result["date"] == "2026-10-16" and len(result["items"]) == 3
+    assert fetched == [dt.date(2026, 10, 16)]
+
+    # 週一盤中：上一個盤後更新為週五
+    monkeypatch.setattr(
+        rankings,
+        "taipei_now",
+        lambda: dt.datetime(2026, 10, 19, 10, 0, tzinfo=TAIPEI_TZ),
+    )
+    assert (await rankings.top_losers(limit=1))["date"] == "2026-10-16"
+
+    # 週一盤後但尚未公布：退回前一個交易日
+    monkeypatch.setattr(
+        rankings,
+        "taipei_now",
+        lambda: dt.datetime(2026, 10, 19, 14, 40, tzinfo=TAIPEI_TZ),
+    )
+    result = await rankings.most_actives(limit=2)
+    assert result["date"] == "2026-10-16" and len(result["items"]) == 2
+    # 週五快照仍在快取中：只多打一次週一
+    assert fetched == [dt.date(2026, 10, 16), dt.date(2026, 10, 19)]
@@ -0,0 +1,66 @@
+# =========================
+# File: tests/test_ratelimit.py
+# =========================
+import asyncio
+
+import pytest
+
+from app.ratelimit import (
+    BACKGROUND,
+    INTERACTIVE,
+    RateLimiter,
+    _parse_limits,
+    priority,
+    set_priority,
+)
+
+
+def test_parse_limits():
+    limits = _parse_limits("www.twse.com.tw=0.5/2, mis.twse.com.tw=1 ,bad=x/1")
+    assert limits["www.twse.com.tw"] == (0.5, 2.0)
+    assert limits["mis.twse.com.tw"][0] == 1.0
+    assert "bad" not in limits
+
+
+@pytest.mark.asyncio
+async def test_burst_then_paced_and_interactive_jumps_queue():
+    limiter = RateLimiter({"h.example": (50.0, 2.0)})
+    url = "https://h.example/x"
+    order = []
+
+    async def req(tag, level):
+        await limiter.acquire(url, level)
+        order.append(tag)
+
+    # 兩個 token 立即用完，其後背景請求排隊；晚到的互動請求插隊到背景之前
+    await req("b0", BACKGROUND)
+    await req("b1", BACKGROUND)
+    bg = [asyncio.create_task(req(f"b{i}", BACKGROUND)) for i in range(2, 5)]
+    await asyncio.sleep(0)
+    ui = asyncio.create_task(req("ui", INTERACTIVE))
+    await asyncio.gather(*bg, ui)
+    assert order[:3] == ["b0", "b1", "ui"]
+
+    stats = limiter.stats()["h.example"]
+    assert stats["background"]["count"] == 5 and stats["background"]["delayed"] == 3
+    assert stats["interactive"]["delayed"] == 1 and stats["queued"] == 0
+
+
+@pytest.mark.asyncio
+async def test_priority_comes_from_contextvar():
+    limiter = RateLimiter({"h.example": (50.0, 1.0)})
+    await limiter.acquire("https://h.example/")  # 用掉唯一 token
+    order = []
+
+    async def req(tag, level):
+        set_priority(level)
+        await limiter.acquire("https://h.example/")
+        order.append(tag)
+
+    tasks = [asyncio.create_task(req("bg", BACKGROUND))]
+    await asyncio.sleep(0)
+    with priority(INTERACTIVE):
+        tasks.append(asyncio.create_task(limiter.acquire("https://h.example/")))
+    tasks[-1].add_done_callback(lambda _: order.append("ui"))
+    await asyncio.gather(*tasks)
+    assert order == ["ui", "bg"]
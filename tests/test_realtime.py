@@ -0,0 +1,101 @@
+# =========================
+# File: tests/test_realtime.py
+# =========================
+import asyncio
+
+import pytest
+
+from app.realtime import QuoteBatcher
+
+
+@pytest.mark.asyncio
+async def test_batcher_collapses_window_into_one_request():
+    seen = []
+
+    async def fake_many(channels):
+        seen.append(sorted(channels))
+        return {ch: {"c": ch[1], "z": "100"} for ch in channels if ch[1] != "9999"}
+
+    batcher = QuoteBatcher(fake_many, window_sec=0.01, max_batch=50)
+    results = await asyncio.gather(
+        batcher.get("TWSE", "2330"),
+        batcher.get("TWSE", "2330"),
+        batcher.get("TPEX", "8431"),
+        batcher.get("TWSE", "9999"),
+    )
+    assert seen == [[("TPEX", "8431"), ("TWSE", "2330"), ("TWSE", "9999")]]
+    assert results[0]["c"] == "2330" and results[1] is results[0]
+    assert results[2]["c"] == "8431"
+    assert results[3] is None
+
+
+@pytest.mark.asyncio
+async def test_batcher_flushes_at_max_batch_and_survives_errors():
+    calls = 0
+
+    async def failing_many(channels):
+        nonlocal calls
+        calls += 1
+        raise RuntimeError("MIS down")
+
+    batcher = QuoteBatcher(failing_many, window_sec=60, max_batch=2)
+    results = await asyncio.wait_for(
+        asyncio.gather(batcher.get("TWSE", "2330"), batcher.get("TWSE", "2317")),
+        timeout=1,
+    )
+    assert results == [None, None]
+    assert calls == 1
+
+
+@pytest.mark.asyncio
+async def test_poller_shares_polls_and_stops_when_nobody_waits():
+    from app.realtime import RealtimePoller
+
+    polls = []
+
+    async def fake_many(channels):
+        polls.append(sorted(channels))
+        if len(polls) < 2:
+            return {ch: {"c": ch[1], "z": "-"} for ch in channels}
+        return {("TWSE", "2330"): {"c": "2330", "z": "900.0", "t": "09:01:00"}}
+
+    poller = RealtimePoller(fake_many, interval_sec=0.01, min_interval_sec=0.01)
+    a, b, c = await asyncio.gather(
+        poller.wait_tick("TWSE", "2330", timeout=1),
+        poller.wait_tick("TWSE", "2330", timeout=1),
+        poller.wait_tick("TPEX", "8431", timeout=0.05),
+    )
+    assert a["z"] == "900.0" and b is a
+    assert c is None
+    # 每輪只發一次請求，涵蓋所有等待中的頻道
+    assert polls[0] == [("TPEX", "8431"), ("TWSE", "2330")]
+
+    await asyncio.sleep(0.05)
+    assert poller.wanted() == []
+    n = len(polls)
+    await asyncio.sleep(0.05)
+    assert len(polls) == n
+
+
+@pytest.mark.asyncio
+async def test_poller_splits_channels_into_batches():
+    from app.realtime import RealtimePoller
+
+    batches = []
+
+    async def fake_many(channels):
+        batches.append(len(channels))
+        if ("TWSE", "1000") in channels:
+            raise RuntimeError("HTTP 414")  # 單一批次失敗不影響其他批次
+        return {ch: {"c": ch[1], "z": "10.0", "t": "09:01:00"} for ch in channels}
+
+    poller = RealtimePoller(
+        fake_many, interval_sec=0.01, min_interval_sec=0.01, max_batch=2
+    )
+    codes = [str(1000 + i) for i in range(5)]
+    results = await asyncio.gather(
+        *(poller.wait_tick("TWSE", c, timeout=0.05) for c in codes)
+    )
+    assert sorted(batches[:3]) == [1, 2, 2] and max(batches) <= 2
+    assert results[0] is None and results[1] is None
+    assert [r["c"] for r in results[2:]] == codes[2:]
@@ -0,0 +1,104 @@
+# =========================
+# File: tests/test_resilience.py
+# =========================
+import asyncio
+import datetime as dt
+
+import pytest
+
+from app import resilience, tw_markets
+from app.month_cache import MONTH_CACHE
+from app.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+@pytest.fixture(autouse=True)
+def _reset():
+    resilience.BREAKERS.clear()
+    MONTH_CACHE.clear()
+    yield
+    resilience.BREAKERS.clear()
+    MONTH_CACHE.clear()
+
+
+def test_breaker_opens_then_half_open_trial():
+    now = [0.0]
+    b = CircuitBreaker("h", threshold=2, reset_sec=10, clock=lambda: now[0])
+    b.before()
+    b.failure()
+    b.before()
+    b.failure()
+    assert b.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        b.before()
+    now[0] = 11
+    b.before()  # 試探請求放行
+    assert b.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        b.before()  # 試探進行中，其餘仍短路
+    b.failure()
+    assert b.state == OPEN
+    now[0] = 22
+    b.before()
+    b.success()
+    assert b.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_guarded_fails_fast_when_open(monkeypatch):
+    monkeypatch.setattr(resilience, "BREAKER_FAILURES", 1)
+    resilience.BREAKERS["h.example"] = CircuitBreaker("h.example", threshold=1)
+    calls = []
+
+    async def boom():
+        calls.append(1)
+        raise RuntimeError("HTTP 503")
+
+    with pytest.raises(RuntimeError):
+        await resilience.guarded("https://h.example/a", boom)
+    with pytest.raises(CircuitOpenError):
+        await resilience.guarded("https://h.example/a", boom)
+    assert calls == [1]
+
+
+def _month(day: dt.date, close: str):
+    roc = f"{day.year - 1911}/{day.month:02d}/{day.day:02d}"
+    return {
+        "stat": "OK",
+        "data": [[roc, "1,000", "2,000", "10", "11", "9", close, "+0.50", "7"]],
+    }
+
+
+@pytest.mark.asyncio
+async def test_stale_served_on_failure_and_slow_refresh(monkeypatch):
+    monkeypatch.setattr(tw_markets, "BAR_STORE", None)
+    monkeypatch.setattr(resilience, "SWR_WAIT_SEC", 0.05)
+    today = dt.date.today()
+    MONTH_CACHE.put(
+        "TWSE",
+        "2330",
+        today,
+        tw_markets.parse_month("TWSE", "2330", _month(today, "10.5")),
+    )
+    monkeypatch.setattr(MONTH_CACHE, "ttl_sec", 0)  # 當月資料立即過期
+
+    async def failing(self, symbol, date):
+        raise tw_markets.HttpError("TWSE stock_day HTTP 503")
+
+    monkeypatch.setattr(tw_markets.TWSEClient, "stock_day", failing)
+    payload = await tw_markets.fetch_daily("2330", "TWSE", today)
+    assert payload["record"]["close"] == 10.5 and "stale_since" in payload
+
+    done = asyncio.Event()
+
+    async def slow(self, symbol, date):
+        await asyncio.sleep(0.2)
+        done.set()
+        return _month(date, "11.0")
+
+    monkeypatch.setattr(tw_markets.TWSEClient, "stock_day", slow)
+    payload = await tw_markets.fetch_daily("2330", "TWSE", today)
+    assert payload["record"]["close"] == 10.5 and "stale_since" in payload
+    # 背景更新完成後寫回快取
+    await asyncio.wait_for(done.wait(), 1)
+    await asyncio.sleep(0)
+    assert MONTH_CACHE.peek("TWSE", "2330", today)[0].close[0] == 11.0
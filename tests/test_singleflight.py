@@ -0,0 +1,70 @@
+# =========================
+# File: tests/test_singleflight.py
+# =========================
+import asyncio
+import datetime as dt
+
+import pytest
+
+from app import tw_markets
+from app.month_cache import MONTH_CACHE
+from app.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_calls_share_one_execution():
+    sf = SingleFlight("test.shared")
+    runs = 0
+
+    async def work():
+        nonlocal runs
+        runs += 1
+        await asyncio.sleep(0.01)
+        return {"ok": runs}
+
+    results = await asyncio.gather(*(sf.do("k", work) for _ in range(10)))
+    assert runs == 1
+    assert all(r is results[0] for r in results)
+    assert sf.stats() == {"calls": 10, "coalesced": 9, "inflight": 0}
+
+    # 完成後不再合併
+    await sf.do("k", work)
+    assert runs == 2
+
+
+@pytest.mark.asyncio
+async def test_errors_propagate_to_every_waiter():
+    sf = SingleFlight("test.errors")
+
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream 503")
+
+    results = await asyncio.gather(
+        sf.do("k", boom), sf.do("k", boom), return_exceptions=True
+    )
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_fetch_daily_coalesces_month_requests(monkeypatch):
+    MONTH_CACHE.clear()
+    calls = 0
+
+    async def fake_stock_day(self, symbol, date):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {
+            "stat": "OK",
+            "data": [["114/08/08", "1", "1", "1", "1", "1", "1", "+0.00", "1"]],
+        }
+
+    monkeypatch.setattr(tw_markets.TWSEClient, "stock_day", fake_stock_day)
+    day = dt.date(2025, 8, 8)
+    payloads = await asyncio.gather(
+        *(tw_markets.fetch_daily("2330", "TWSE", day) for _ in range(10))
+    )
+    assert calls == 1
+    assert all(p["record"]["close"] == 1.0 for p in payloads)
+    MONTH_CACHE.clear()
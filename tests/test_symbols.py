@@ -0,0 +1,101 @@
+# =========================
+# File: tests/test_symbols.py
+# =========================
+import asyncio
+import datetime as dt
+
+import pytest
+
+from app import markets_utils, symbols, tw_markets
+
+ISIN_HTML = """
+<table>
+<tr><td>有價證券代號及名稱 </td><td>國際證券辨識號碼(ISIN Code)</td><td>上市日</td><td>市場別</td><td>產業別</td><td>CFICode</td><td>備註</td></tr>
+<tr><td bgcolor=#D5FFD5 colspan=7 ><B> 股票 <B> </td></tr>
+<tr><td bgcolor=#FAFAD2>2330　台積電</td><td>TW0002330008</td><td>1994/09/05</td><td>上市</td><td>半導體業</td><td>ESVUFR</td><td></td></tr>
+<tr><td bgcolor=#D5FFD5 colspan=7 ><B> ETF <B> </td></tr>
+<tr><td bgcolor=#FAFAD2>0050　元大台灣50</td><td>TW0000050004</td><td>2003/06/30</td><td>上市</td><td></td><td>CEOGEU</td><td></td></tr>
+<tr><td bgcolor=#D5FFD5 colspan=7 ><B> 上市認購(售)權證 <B> </td></tr>
+<tr><td bgcolor=#FAFAD2>030001　台積電元大58購01</td><td>TW15Z0300019</td><td>2025/01/02</td><td>上市</td><td></td><td>RWSCCE</td><td></td></tr>
+</table>
+"""
+
+
+def test_parse_isin_page_tracks_section_kind():
+    infos = {it.symbol: it for it in symbols.parse_isin_page(ISIN_HTML, "TWSE")}
+    assert infos["2330"].name == "台積電" and infos["2330"].kind == "股票"
+    assert infos["0050"].is_etf
+    assert infos["030001"].is_warrant
+    assert len(infos) == 3
+
+
+@pytest.mark.asyncio
+async def test_routing_skips_wrong_market_and_rejects_unknown(monkeypatch):
+    directory = symbols.SymbolDirectory()
+    directory.load([symbols.SymbolInfo("8431", "TPEX", "匯鑽科", "股票")])
+    monkeypatch.setattr(symbols, "DIRECTORY", directory)
+    monkeypatch.setattr(symbols, "SYMBOL_DIRECTORY_ENABLED", True)
+
+    calls = []
+
+    async def fake_month(market, symbol, date):
+        calls.append(market)
+        return tw_markets.parse_month(market, symbol, {"aaData": []})
+
+    monkeypatch.setattr(tw_markets, "_stock_day_cached", fake_month)
+
+    await markets_utils.auto_daily("8431")
+    assert calls == ["TPEX"]
+
+    calls.clear()
+    assert await markets_utils.auto_daily("9999") == (None, None)
+    assert await markets_utils.find_last_daily("9999", None) == (None, None, None)
+    assert calls == []
+
+
+@pytest.mark.asyncio
+async def test_stale_directory_refreshes_in_background(monkeypatch):
+    directory = symbols.SymbolDirectory()
+    directory.load(
+        [symbols.SymbolInfo("8431", "TPEX", "匯鑽科", "股票")],
+        loaded_on=dt.date(2025, 1, 2),
+    )
+    release = asyncio.Event()
+
+    async def slow_fetch(market):
+        await release.wait()
+        return (
+            [symbols.SymbolInfo("2330", "TWSE", "台積電", "股票")]
+            if market == "TWSE"
+            else []
+        )
+
+    monkeypatch.setattr(directory, "_fetch_market", slow_fetch)
+    monkeypatch.setattr(symbols, "SYMBOL_DIRECTORY_ENABLED", True)
+
+    # 舊目錄立即回應，不等待 ISIN
+    assert await asyncio.wait_for(directory.markets_for("8431"), 1) == ("TPEX",)
+    assert directory.get("2330") is None
+
+    release.set()
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert await directory.markets_for("2330") == ("TWSE",)
+
+
+@pytest.mark.asyncio
+async def test_empty_directory_waits_for_refresh(monkeypatch):
+    directory = symbols.SymbolDirectory()
+
+    async def fetch(market):
+        await asyncio.sleep(0)
+        return (
+            [symbols.SymbolInfo("2330", "TWSE", "台積電", "股票")]
+            if market == "TWSE"
+            else []
+        )
+
+    monkeypatch.setattr(directory, "_fetch_market", fetch)
+    monkeypatch.setattr(symbols, "SYMBOL_DIRECTORY_ENABLED", True)
+    assert await directory.markets_for("2330") == ("TWSE",)
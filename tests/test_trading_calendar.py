@@ -0,0 +1,141 @@
+# =========================
+# File: tests/test_trading_calendar.py
+# =========================
+import datetime as dt
+
+import pytest
+
+from app import markets_utils, rankings, trading_calendar, tw_markets
+from app.market_hours import TAIPEI_TZ
+
+SCHEDULE_2025 = {
+    "stat": "ok",
+    "fields": ["日期", "名稱", "說明"],
+    "data": [
+        ["2025-01-01", "中華民國開國紀念日", "依規定放假1日。"],
+        ["2025-01-02", "國曆新年開始交易日", "國曆新年開始交易。"],
+        ["114/10/06", "中秋節", "依規定放假1日。"],
+        ["20251010", "國慶日", "依規定放假1日。"],
+        ["", "", ""],
+    ],
+}
+
+
+def _calendar(**extra) -> trading_calendar.TradingCalendar:
+    cal = trading_calendar.TradingCalendar(**extra)
+    cal.load_year(2025, *trading_calendar.parse_holiday_schedule(SCHEDULE_2025))
+    return cal
+
+
+def test_parse_schedule_and_trading_days():
+    holidays, trading = trading_calendar.parse_holiday_schedule(SCHEDULE_2025)
+    assert holidays == {
+        dt.date(2025, 1, 1),
+        dt.date(2025, 10, 6),
+        dt.date(2025, 10, 10),
+    }
+    assert trading == {dt.date(2025, 1, 2)}
+
+    cal = _calendar(
+        extra_holidays=trading_calendar.parse_extra_holidays("2025-07-07, bad")
+    )
+    assert not cal.is_trading_day(dt.date(2025, 10, 10))  # 國慶（週五）
+    assert not cal.is_trading_day(dt.date(2025, 7, 7))  # 颱風假
+    assert not cal.is_trading_day(dt.date(2025, 10, 11))  # 週六
+    assert cal.is_trading_day(dt.date(2025, 1, 2))
+    # 10/13（一）往前：略過週末與國慶
+    assert cal.last_trading_day(dt.date(2025, 10, 12)) == dt.date(2025, 10, 9)
+    assert cal.trading_days_back(dt.date(2025, 10, 13), 4) == [
+        dt.date(2025, 10, 13),
+        dt.date(2025, 10, 9),
+    ]
+
+
+def test_session_boundaries_skip_holidays():
+    cal = _calendar()
+    thursday_close = dt.datetime(2025, 10, 9, 15, 0, tzinfo=TAIPEI_TZ)
+    assert not cal.is_session_open(thursday_close)
+    assert cal.is_session_open(dt.datetime(2025, 10, 9, 9, 30, tzinfo=TAIPEI_TZ))
+    assert not cal.is_session_open(dt.datetime(2025, 10, 10, 9, 30, tzinfo=TAIPEI_TZ))
+    assert cal.next_session_open(thursday_close) == dt.datetime(
+        2025, 10, 13, 9, 0, tzinfo=TAIPEI_TZ
+    )
+    # 連假中：最近一次盤後更新為 10/9
+    holiday = dt.datetime(2025, 10, 11, 12, 0, tzinfo=TAIPEI_TZ)
+    assert cal.last_close_update(holiday) == dt.datetime(
+        2025, 10, 9, 14, 30, tzinfo=TAIPEI_TZ
+    )
+    monday_noon = dt.datetime(2025, 10, 13, 12, 0, tzinfo=TAIPEI_TZ)
+    assert cal.last_close_update(monday_noon) == dt.datetime(
+        2025, 10, 9, 14, 30, tzinfo=TAIPEI_TZ
+    )
+
+
+def test_holiday_snapshot_expires_at_next_open(monkeypatch):
+    monkeypatch.setattr(trading_calendar, "CALENDAR", _calendar())
+    cache = rankings.SnapshotCache(ttl_sec=60)
+    now = dt.datetime(2025, 10, 10, 10, 0, tzinfo=TAIPEI_TZ)
+    snap = rankings.Snapshot("TWSE", dt.date(2025, 10, 10))
+    assert cache.expires_at(snap, now) == dt.datetime(
+        2025, 10, 13, 9, 0, tzinfo=TAIPEI_TZ
+    )
+
+
+@pytest.mark.asyncio
+async def test_daily_backtrack_skips_non_trading_days(monkeypatch):
+    monkeypatch.setattr(trading_calendar, "CALENDAR", _calendar())
+    monkeypatch.setattr(markets_utils, "BACKTRACK_MODE", "daily")
+    calls = []
+
+    async def fake_daily(symbol, market, date):
+        calls.append((market, date))
+        return (
+            {"record": {"close": 10.0}}
+            if date == dt.date(2025, 10, 9)
+            else {"record": None}
+        )
+
+    monkeypatch.setattr(markets_utils, "fetch_daily", fake_daily)
+    market, _, used = await markets_utils.find_last_daily("2330", dt.date(2025, 10, 12))
+    assert (market, used) == ("TWSE", dt.date(2025, 10, 9))
+    assert calls == [("TWSE", dt.date(2025, 10, 9))]
+
+
+@pytest.mark.asyncio
+async def test_realtime_returns_last_close_when_market_closed(monkeypatch):
+    async def no_tick(symbol):
+        return {"z": "-", "t": ""}
+
+    async def never(*args, **kwargs):
+        raise AssertionError("should not poll while the market is closed")
+
+    async def fake_month(market, symbol, date):
+        row = [
+            "114/10/09",
+            "2,500,000",
+            "2,000",
+            "10.00",
+            "11.00",
+            "9.50",
+            "10.50",
+            "+0.50",
+            "7",
+        ]
+        return tw_markets.parse_month(
+            market, symbol, {"stat": "OK", "data": [row] if market == "TWSE" else []}
+        )
+
+    monkeypatch.setattr(trading_calendar, "CALENDAR", _calendar())
+    monkeypatch.setattr(markets_utils, "fetch_realtime", no_tick)
+    monkeypatch.setattr(markets_utils.REALTIME_POLLER, "wait_tick", never)
+    monkeypatch.setattr(markets_utils, "is_session_open", lambda: False)
+    monkeypatch.setattr(
+        markets_utils,
+        "taipei_now",
+        lambda: dt.datetime(2025, 10, 11, 10, 0, tzinfo=TAIPEI_TZ),
+    )
+    monkeypatch.setattr(tw_markets, "_stock_day_cached", fake_month)
+
+    data = await markets_utils.find_last_realtime("2330", max_minutes=3)
+    assert data["closed"] and data["market"] == "TWSE" and data["d"] == "20251009"
+    assert (data["z"], data["y"], data["v"]) == ("10.50", "10.00", 2500)
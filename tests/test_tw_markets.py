@@ -0,0 +1,85 @@
+# =========================
+# File: tests/test_tw_markets.py
+# =========================
+import asyncio
+import datetime as dt
+
+import pytest
+
+from app import tw_markets
+from app.month_cache import MONTH_CACHE
+
+
+@pytest.mark.asyncio
+async def test_fetch_daily_range_bounded_fan_out_merges_in_order(monkeypatch):
+    MONTH_CACHE.clear()
+    monkeypatch.setattr(tw_markets, "BAR_STORE", None)
+    active = 0
+    peak = 0
+
+    async def fake_stock_day(self, symbol, date):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        roc = f"{date.year - 1911}/{date.month:02d}"
+        rows = [
+            [
+                f"{roc}/{d:02d}",
+                "1,000",
+                "2,000",
+                "10",
+                "12",
+                "9",
+                str(10 + d),
+                "+0.50",
+                "7",
+            ]
+            for d in (20, 5)
+        ]  # 刻意倒序，並重複一列
+        return {"stat": "OK", "data": rows + rows[:1]}
+
+    monkeypatch.setattr(tw_markets.TWSEClient, "stock_day", fake_stock_day)
+
+    s = await tw_markets.fetch_daily_range(
+        "2330", "TWSE", dt.date(2020, 1, 10), dt.date(2020, 6, 10), concurrency=2
+    )
+    assert peak == 2
+    days = [dt.date.fromordinal(o) for o in s.days]
+    assert days == sorted(days) and len(days) == len(set(days))
+    # 1 月 5 日與 6 月 20 日落在區間外
+    assert days[0] == dt.date(2020, 1, 20) and days[-1] == dt.date(2020, 6, 5)
+    assert len(s) == 10
+    assert s.close[0] == 30.0 and s.change[0] == 0.5
+    MONTH_CACHE.clear()
+
+
+def test_parse_month_columns_and_lookup():
+    rows = [
+        ["114/08/05", "1,500", "2,000", "10", "11", "9", "10.5", "X-0.50", "7"],
+        ["114/08/01", "1,000", "2,000", "--", "--", "--", "--", " 0.00", "0"],
+        [
+            "114/08/05",
+            "1,600",
+            "2,000",
+            "10",
+            "11",
+            "9",
+            "10.6",
+            "+0.60",
+            "8",
+        ],  # 同日取最後一列
+    ]
+    bars = tw_markets.parse_month("TPEX", "8431", {"aaData": rows})
+    assert [dt.date.fromordinal(o) for o in bars.days] == [
+        dt.date(2025, 8, 1),
+        dt.date(2025, 8, 5),
+    ]
+    assert bars.volume[1] == 1_600_000 and bars.change[1] == 0.6
+    assert bars.record(0)["close"] is None
+    assert bars.index_of(dt.date(2025, 8, 4)) == -1
+    assert bars.index_on_or_before(dt.date(2025, 8, 4)) == 0
+    assert tw_markets._record_at(bars, 1)["date"] == "114/08/05"
+    twse = tw_markets.parse_month("TWSE", "2330", {"data": [rows[0]]})
+    assert twse.change[0] == -0.5 and twse.volume[0] == 1500
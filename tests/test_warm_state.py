@@ -0,0 +1,105 @@
+# =========================
+# File: tests/test_warm_state.py
+# =========================
+import datetime as dt
+import json
+import pathlib
+
+import discord
+import pytest
+from discord import app_commands
+
+from app import rankings, symbols, warm_state
+from app.market_hours import taipei_now
+from app.month_cache import MONTH_CACHE
+from app.tw_markets import parse_month
+
+FIXTURE_TWSE = pathlib.Path(__file__).parent / "fixtures" / "mi_index_sample.json"
+
+
+@pytest.fixture(autouse=True)
+def _clean():
+    MONTH_CACHE.clear()
+    rankings.SNAPSHOTS.clear()
+    yield
+    MONTH_CACHE.clear()
+    rankings.SNAPSHOTS.clear()
+
+
+def test_save_and_load_round_trip(tmp_path):
+    now = taipei_now()
+    rows = [["114/08/05", "1,500", "2,000", "10", "11", "9", "10.5", "+0.50", "7"]]
+    bars = parse_month("TWSE", "2330", {"data": rows})
+    MONTH_CACHE.put("TWSE", "2330", dt.date(2025, 8, 5), bars)
+    payload = json.loads(FIXTURE_TWSE.read_text(encoding="utf-8"))
+    payload["fields9"] = []  # 以預設欄位位置解析
+    snap = rankings.Snapshot.parse(payload, "TWSE", dt.date(2025, 8, 8))
+    rankings.SNAPSHOTS.put(snap, now)
+    symbols.DIRECTORY.load(
+        [symbols.SymbolInfo("2330", "TWSE", "台積電", "股票")], dt.date(2025, 8, 8)
+    )
+    symbols.DIRECTORY.remember("8431", "TPEX")
+
+    assert warm_state.save(str(tmp_path))
+
+    MONTH_CACHE.clear()
+    rankings.SNAPSHOTS.clear()
+    symbols.DIRECTORY = symbols.SymbolDirectory()
+    loaded = warm_state.load(str(tmp_path))
+    assert loaded == {"month_cache": 1, "snapshots": 1, "symbols": 1}
+
+    got = MONTH_CACHE.get("TWSE", "2330", dt.date(2025, 8, 1))
+    assert got is not None and list(got.close) == [10.5]
+    restored = rankings.SNAPSHOTS.get("TWSE", dt.date(2025, 8, 8), now)
+    assert restored is not None and restored.version != snap.version
+    assert restored.symbols == snap.symbols and list(restored.close) == list(snap.close)
+    assert symbols.DIRECTORY.get("2330").name == "台積電"
+    assert symbols.DIRECTORY.state()["routes"] == {"8431": "TPEX"}
+
+
+def test_load_skips_missing_and_corrupt_files(tmp_path):
+    (tmp_path / "snapshots.bin").write_bytes(b"garbage")
+    assert warm_state.load(str(tmp_path)) == {}
+    assert warm_state.load("") == {}
+    assert not warm_state.save("")
+
+
+def test_tree_fingerprint_gates_sync(tmp_path):
+    tree = app_commands.CommandTree(discord.Client(intents=discord.Intents.none()))
+
+    @tree.command(name="ping", description="ping")
+    async def ping(interaction: discord.Interaction, n: int = 1):
+        pass
+
+    fp = warm_state.tree_fingerprint(tree, 1)
+    assert fp == warm_state.tree_fingerprint(tree, 1)
+    assert fp != warm_state.tree_fingerprint(tree, 2)
+    assert warm_state.needs_sync(fp, str(tmp_path))
+    warm_state.mark_synced(fp, str(tmp_path))
+    assert not warm_state.needs_sync(fp, str(tmp_path))
+
+    @tree.command(name="pong", description="pong")
+    async def pong(interaction: discord.Interaction):
+        pass
+
+    assert warm_state.needs_sync(warm_state.tree_fingerprint(tree, 1), str(tmp_path))
+    # 未設定狀態目錄：一律 sync
+    assert warm_state.needs_sync(fp, "")
+
+
+def test_tree_fingerprint_accepts_to_dict_without_tree():
+    # discord.py 2.3.x：Command.to_dict() 不接受 tree 參數
+    class OldCommand:
+        def __init__(self, name):
+            self.name = name
+
+        def to_dict(self):
+            return {"name": self.name, "options": []}
+
+    class OldTree:
+        def get_commands(self):
+            return [OldCommand("pong"), OldCommand("ping")]
+
+    fp = warm_state.tree_fingerprint(OldTree(), 1)
+    assert fp == warm_state.tree_fingerprint(OldTree(), 1)
+    assert fp != warm_state.tree_fingerprint(OldTree(), 2)
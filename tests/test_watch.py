@@ -0,0 +1,61 @@
+# =========================
+# File: tests/test_watch.py
+# =========================
+import asyncio
+import time
+
+import pytest
+
+from app.realtime import RealtimePoller
+from app.watch import EditBudget, run_watch
+
+
+@pytest.mark.asyncio
+async def test_watchers_share_polls_and_skip_unchanged_prices():
+    prices = iter(["100", "100", "101", "101", "102"] + ["102"] * 100)
+    polls = 0
+
+    async def fake_many(channels):
+        nonlocal polls
+        polls += 1
+        return {ch: {"c": ch[1], "z": next(prices), "t": "09:00:00"} for ch in channels}
+
+    poller = RealtimePoller(fake_many, interval_sec=0.01, min_interval_sec=0.01)
+    seen = [[] for _ in range(20)]
+
+    def _recorder(bucket):
+        async def _edit(quote):
+            bucket.append(quote["z"])
+
+        return _edit
+
+    budget = EditBudget(rate=1000)
+    edits = await asyncio.gather(
+        *(
+            run_watch(
+                poller,
+                "TWSE",
+                "2330",
+                0.005,
+                _recorder(seen[i]),
+                initial={"z": "100"},
+                budget=budget,
+                interval_sec=0.01,
+            )
+            for i in range(20)
+        )
+    )
+    # 20 位看盤者共用同一輪詢，請求數與看盤人數無關
+    assert polls <= 0.005 * 60 / 0.01 + 2
+    assert all(s == ["101", "102"] for s in seen)
+    assert edits == [2] * 20
+    assert poller.wanted() == []
+
+
+@pytest.mark.asyncio
+async def test_edit_budget_paces_edits():
+    budget = EditBudget(rate=50, burst=1)
+    start = time.monotonic()
+    for _ in range(6):
+        await budget.acquire()
+    assert time.monotonic() - start >= 0.09